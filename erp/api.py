@@ -0,0 +1,296 @@
+import argparse
+import hmac
+import json
+import os
+import queue
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List, Literal, Optional
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+from starlette.staticfiles import StaticFiles
+
+from erp.assets import ASSET_DIR, ASSET_URL
+from erp.metrics import registry
+from erp.numbering import file_name
+from erp.pdf import PdfRenderer
+from erp.search import TARGETS
+from erp.tax import is_interstate
+from erp.tenants import DEFAULT_TENANT, get_router
+
+# Headless entry point for integrations (shop, POS): python -m erp.api, or
+# uvicorn erp.api:app. Shares the database, numbering and ledger with the Streamlit app.
+# A process serves one company (SALES_ERP_COMPANY, a slug from the company catalog); run
+# one per company to integrate several.
+MAX_BATCH = 1000
+# PDFs for a whole batch may be queued at once; the app's own renderer caps this at 32
+PDF_BACKLOG = int(os.environ.get('SALES_ERP_API_PDF_BACKLOG', 2000))
+# When set, every request except /health needs "Authorization: Bearer <token>". Without
+# it the API only listens on localhost.
+API_TOKEN = os.environ.get('SALES_ERP_API_TOKEN', '')
+LOCAL_HOSTS = {'127.0.0.1', 'localhost', '::1'}
+
+
+class Line(BaseModel):
+    name: str
+    description: str = ''
+    hsn: str = ''
+    qty: float = Field(gt=0)
+    price: float = Field(ge=0)
+    # Overrides the rate table for this line
+    tax_rate: Optional[float] = Field(None, ge=0, le=100)
+
+
+class Customer(BaseModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    contact: str = ''
+    address: str = ''
+    phone: str = ''
+    gstin: str = ''
+
+
+class Document(BaseModel):
+    doc_type: Literal['Invoice', 'Quotation', 'Purchase Order'] = 'Invoice'
+    doc_date: date = Field(default_factory=date.today)
+    customer: Customer
+    items: List[Line] = Field(min_length=1)
+    # Decided from the company and customer GSTIN state codes when left out
+    interstate: Optional[bool] = None
+    terms: str = ''
+
+
+class DocumentBatch(BaseModel):
+    documents: List[Document] = Field(min_length=1, max_length=MAX_BATCH)
+    render_pdf: bool = False
+
+
+class Payment(BaseModel):
+    doc_id: int
+    transaction_type: Literal['credit', 'debit'] = 'credit'
+    amount: float = Field(gt=0)
+    payment_mode: str = 'Bank Transfer'
+    payment_date: date = Field(default_factory=date.today)
+    remarks: str = ''
+
+
+class PaymentBatch(BaseModel):
+    payments: List[Payment] = Field(min_length=1, max_length=MAX_BATCH)
+
+
+svc = None
+renderer = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global svc, renderer
+    svc = await run_in_threadpool(get_router().services, os.environ.get('SALES_ERP_COMPANY', DEFAULT_TENANT))
+    renderer = PdfRenderer(max_pending=PDF_BACKLOG)
+    yield
+    renderer.shutdown()
+
+
+def _authorize(request: Request):
+    if not API_TOKEN or request.url.path == '/health':
+        return
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), API_TOKEN.encode()):
+        raise HTTPException(401, 'Missing or wrong API token', headers={'WWW-Authenticate': 'Bearer'})
+
+
+app = FastAPI(title='Sales ERP API', lifespan=lifespan, dependencies=[Depends(_authorize)])
+# Documents reference the logo by URL; serve the asset store under the same path the app uses
+if ASSET_URL.startswith('/'):
+    app.mount(ASSET_URL.rstrip('/'), StaticFiles(directory=ASSET_DIR, check_dir=False), name='assets')
+
+
+def _records(df):
+    # Through pandas' own JSON writer: numpy scalars and NaN come out as plain JSON
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+
+def _row(row):
+    return json.loads(row.drop(labels=['items_data'], errors='ignore').to_json(date_format='iso'))
+
+
+def _cursor(cursor):
+    # Keyset cursors travel as "<sort value>|<id>"
+    if cursor is None:
+        return None
+    key, _, row_id = cursor.rpartition('|')
+    if not key or not row_id.isdigit():
+        raise HTTPException(400, 'Malformed cursor')
+    return key, int(row_id)
+
+
+def _page(df, next_cursor):
+    return {'items': _records(df), 'next': None if next_cursor is None else f"{next_cursor[0]}|{next_cursor[1]}"}
+
+
+def _queue_pdf(doc_number, html):
+    try:
+        return renderer.submit(doc_number, html)
+    except queue.Full:
+        return None
+
+
+def _as_row(doc, doc_id, doc_number):
+    # The documents row this request just wrote, without reading it back
+    customer = doc['customer']
+    return {'id': doc_id, 'doc_type': doc['doc_type'], 'doc_number': doc_number, 'doc_date': doc['doc_date'],
+            'customer_name': customer['name'], 'customer_contact': customer['contact'],
+            'customer_address': customer['address'], 'customer_phone': customer['phone'],
+            'customer_gstin': customer['gstin'], 'subtotal': doc['subtotal'], 'cgst': doc['cgst'],
+            'sgst': doc['sgst'], 'igst': doc['igst'], 'total': doc['total'], 'terms_conditions': doc['terms']}
+
+
+def _create_documents(batch):
+    company_info = svc.company_info()
+    known = {}
+    documents = []
+    for doc in batch.documents:
+        customer = doc.customer.model_dump()
+        if customer['id'] is not None or not customer['name']:
+            # Any id given must exist, or the document and its ledger rows point at nobody;
+            # looked up once per customer per batch
+            if customer['id'] not in known:
+                known[customer['id']] = svc.customers.get(customer['id']) if customer['id'] is not None else None
+            row = known[customer['id']]
+            if row is None:
+                raise HTTPException(422, f"Customer {customer['id']} not found; give a name or a valid id")
+            if not customer['name']:
+                # By id only: fill in the registered details
+                customer.update(name=row['name'], contact=row['contact_person'] or '', address=row['address'] or '',
+                                phone=row['phone'] or '', gstin=row['gstin'] or '')
+        interstate = doc.interstate
+        if interstate is None:
+            interstate = is_interstate(company_info['gstin'], customer['gstin'])
+        priced = svc.price([line.model_dump() for line in doc.items], interstate)
+        documents.append(dict(priced, doc_type=doc.doc_type, doc_date=doc.doc_date, customer=customer, terms=doc.terms))
+    issued = svc.issue_documents(documents, company_info)
+
+    results = []
+    for doc, (doc_id, doc_number) in zip(documents, issued):
+        result = {'id': doc_id, 'doc_number': doc_number, 'total': float(doc['total'])}
+        if batch.render_pdf:
+            html = svc.document_html(_as_row(doc, doc_id, doc_number), doc['items'], company_info, doc['taxes'])
+            result['pdf'] = 'queued' if _queue_pdf(doc_number, html) else 'busy'
+        results.append(result)
+    return results
+
+
+@app.post('/documents', status_code=201)
+async def create_documents(batch: DocumentBatch):
+    # One transaction for the whole batch; PDFs (if asked for) render in the worker pool afterwards
+    return {'documents': await run_in_threadpool(_create_documents, batch)}
+
+
+@app.post('/payments', status_code=201)
+async def record_payments(batch: PaymentBatch):
+    try:
+        ids = await run_in_threadpool(svc.record_payments, [payment.model_dump() for payment in batch.payments])
+    except KeyError as e:
+        raise HTTPException(404, e.args[0])
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    return {'payments': ids}
+
+
+@app.get('/documents')
+async def list_documents(doc_type: Optional[str] = None, cursor: Optional[str] = None,
+                         limit: int = Query(50, ge=1, le=500), archived: bool = False):
+    return _page(*await run_in_threadpool(svc.documents.page, doc_type, _cursor(cursor), limit, archived))
+
+
+def _document(doc_id):
+    doc = svc.documents.get(doc_id)
+    if doc is None:
+        raise HTTPException(404, f"Document {doc_id} not found")
+    return dict(_row(doc), items=svc.documents.lines(doc_id), taxes=svc.documents.taxes(doc_id),
+                balance=svc.documents.balance(doc_id))
+
+
+@app.get('/documents/{doc_id}')
+async def get_document(doc_id: int):
+    return await run_in_threadpool(_document, doc_id)
+
+
+def _pdf(doc_id):
+    doc = svc.documents.get(doc_id)
+    if doc is None:
+        raise HTTPException(404, f"Document {doc_id} not found")
+    return doc['doc_number'], _queue_pdf(doc['doc_number'], svc.document_html(doc))
+
+
+@app.get('/documents/{doc_id}/pdf')
+async def get_document_pdf(doc_id: int):
+    # 202 until the worker pool has written it; poll again
+    doc_number, path = await run_in_threadpool(_pdf, doc_id)
+    if path is None:
+        return JSONResponse({'status': 'busy'}, 503, headers={'Retry-After': '5'})
+    status = renderer.status(path)
+    if status == 'done':
+        return FileResponse(path, media_type='application/pdf', filename=file_name(doc_number, 'pdf'))
+    if status == 'failed':
+        raise HTTPException(500, f"PDF rendering failed: {renderer.error(path)}")
+    return JSONResponse({'status': status}, 202, headers={'Retry-After': '1'})
+
+
+@app.get('/customers/{customer_id}/balance')
+async def get_customer_balance(customer_id: int):
+    return await run_in_threadpool(svc.customers.balance, customer_id)
+
+
+@app.get('/payments')
+async def list_payments(cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=500), archived: bool = False):
+    return _page(*await run_in_threadpool(svc.payments.page, _cursor(cursor), limit, archived))
+
+
+@app.get('/aging')
+async def get_aging(as_of: Optional[date] = None, customer_id: Optional[int] = None):
+    # Current balances of invoices dated up to as_of (default today), aged to that date
+    return _records(await run_in_threadpool(svc.payments.aging, as_of, customer_id))
+
+
+@app.get('/search/{table}')
+async def search(table: Literal[tuple(TARGETS)], q: str = '', doc_type: Optional[str] = None, archived: bool = False):
+    repo = {'customers': svc.customers, 'items': svc.items, 'documents': svc.documents}[table]
+    filters = {'doc_type': doc_type, 'archived': archived} if table == 'documents' else {}
+    hits = await run_in_threadpool(repo.search, q, **filters)
+    return [{'id': row_id, 'label': label} for row_id, label in hits]
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics():
+    return registry.prometheus()
+
+
+@app.get('/health')
+async def health():
+    return {'status': 'ok'}
+
+
+def main(argv=None):
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Serve the Sales ERP JSON API")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="listening on other interfaces requires SALES_ERP_API_TOKEN")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes; they share the database file but write one at a time")
+    parser.add_argument('--company', default=os.environ.get('SALES_ERP_COMPANY', DEFAULT_TENANT),
+                        help="slug of the company to serve")
+    args = parser.parse_args(argv)
+    if args.host not in LOCAL_HOSTS and not API_TOKEN:
+        parser.error(f"refusing to serve {args.host} without authentication; set SALES_ERP_API_TOKEN")
+    # Read by each worker's lifespan
+    os.environ['SALES_ERP_COMPANY'] = args.company
+    uvicorn.run('erp.api:app', host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import os
+import re
+import sqlite3
+from datetime import date
+
+from erp.db import DB_PATH, get_db
+
+# Cold storage: documents that are deleted, cancelled or from closed fiscal years move, with
+# their lines, tax breakdown and payments, to a second SQLite file ATTACHed as "archive".
+# The hot file then only holds the working set. Single-document reads, lines, taxes,
+# exports and batch ZIPs read through to the archive via source(); document and payment
+# lists and document search only do when asked to (archived=True, "Include archived" in
+# the app). Archived rows are read-only. By default the archive sits next to the
+# database; point SALES_ERP_ARCHIVE_DIR at slower, bigger storage to keep it elsewhere.
+SCHEMA = 'archive'
+ARCHIVE_DIR = os.environ.get('SALES_ERP_ARCHIVE_DIR')
+# Fiscal years kept hot: the current one and the one before, which can still be amended
+KEEP_YEARS = 2
+BATCH_SIZE = 500
+
+# Archived tables and the column tying their rows to a document
+TABLES = {'documents': 'id', 'document_lines': 'doc_id', 'document_taxes': 'doc_id', 'payments': 'doc_id'}
+# Column that identifies a row, for telling copies apart from originals
+KEYS = {'documents': 'id', 'document_lines': 'id', 'document_taxes': 'doc_id', 'payments': 'id'}
+
+ARCHIVE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_documents_date ON documents (doc_date)",
+    "CREATE INDEX IF NOT EXISTS idx_documents_customer_date ON documents (customer_id, doc_date)",
+    "CREATE INDEX IF NOT EXISTS idx_document_lines_doc ON document_lines (doc_id, line_no)",
+    "CREATE INDEX IF NOT EXISTS idx_payments_doc ON payments (doc_id)",
+    "CREATE INDEX IF NOT EXISTS idx_payments_date ON payments (payment_date)",
+    '''CREATE TABLE IF NOT EXISTS archive_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        cutoff DATE,
+        documents INTEGER NOT NULL,
+        payments INTEGER NOT NULL
+    )''',
+]
+
+_CREATE_TABLE = re.compile(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?', re.IGNORECASE)
+
+
+def archive_path(db_path, archive_dir=ARCHIVE_DIR):
+    root, ext = os.path.splitext(os.path.basename(db_path))
+    return os.path.join(archive_dir or os.path.dirname(db_path), f"{root}.archive{ext or '.db'}")
+
+
+def cutoff_date(keep_years=KEEP_YEARS, today=None):
+    # First day of the oldest fiscal year (April to March) that stays hot
+    d = today or date.today()
+    start = d.year if d.month >= 4 else d.year - 1
+    return date(start - keep_years + 1, 4, 1)
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _marks(values):
+    return ', '.join('?' * len(values))
+
+
+def source(conn, table):
+    # What to put after FROM to read `table` including its archived rows. Rows found in both
+    # files (a run interrupted between copying and purging) are read from main.
+    if table not in TABLES or SCHEMA not in getattr(conn, 'attached', ()):
+        return table
+    cols = ', '.join(_columns(conn, 'main', table))
+    key = KEYS[table]
+    return (f"(SELECT {cols} FROM main.{table} UNION ALL SELECT {cols} FROM {SCHEMA}.{table} a "
+            f"WHERE NOT EXISTS (SELECT 1 FROM main.{table} m WHERE m.{key} = a.{key})) AS {table}")
+
+
+class Archive:
+    def __init__(self, db, path=None):
+        self.db = db
+        self.path = path or archive_path(db.path)
+
+    @property
+    def is_open(self):
+        return SCHEMA in self.db.attachments
+
+    def open(self):
+        # Creates the archive file (or brings its tables up to the main schema's columns)
+        # with a connection of its own, then attaches it everywhere
+        with self.db.read() as conn:
+            tables = dict(conn.execute(f"SELECT name, sql FROM main.sqlite_master WHERE type='table' "
+                                       f"AND name IN ({_marks(TABLES)})", list(TABLES)).fetchall())
+            columns = {table: conn.execute(f"PRAGMA main.table_info({table})").fetchall() for table in TABLES}
+        archive = sqlite3.connect(self.path)
+        try:
+            archive.execute("PRAGMA journal_mode=WAL")
+            for table in TABLES:
+                archive.execute(_CREATE_TABLE.sub('CREATE TABLE IF NOT EXISTS ', tables[table], count=1))
+                present = set(_columns(archive, 'main', table))
+                for _, name, col_type, *_ in columns[table]:
+                    if name not in present:
+                        archive.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+            for sql in ARCHIVE_INDEXES:
+                archive.execute(sql)
+            archive.commit()
+        finally:
+            archive.close()
+        self.db.attach(SCHEMA, self.path)
+
+    def candidates(self, cutoff, after=0, limit=BATCH_SIZE):
+        # Deleted and cancelled documents, and everything dated before the cutoff except
+        # invoices that are still owed money
+        with self.db.read() as conn:
+            return [row[0] for row in conn.execute(
+                """SELECT d.id FROM main.documents d
+                   WHERE d.id > ? AND (d.status IN ('deleted', 'cancelled') OR (d.doc_date < ? AND NOT (
+                       d.doc_type = 'Invoice' AND d.status = 'active' AND EXISTS (
+                           SELECT 1 FROM main.invoice_balances b WHERE b.doc_id = d.id AND b.balance > 0.005))))
+                   ORDER BY d.id LIMIT ?""", (int(after), str(cutoff), int(limit)))]
+
+    def _copy(self, doc_ids):
+        with self.db.write() as conn:
+            for table, ref in TABLES.items():
+                cols = ', '.join(_columns(conn, 'main', table))
+                conn.execute(f"INSERT OR REPLACE INTO {SCHEMA}.{table} ({cols}) SELECT {cols} FROM main.{table} "
+                             f"WHERE {ref} IN ({_marks(doc_ids)})", doc_ids)
+
+    def _purge(self, doc_ids):
+        # Deletes the originals of what _copy wrote. Only documents whose copy still matches
+        # (status and payments unchanged since) go; the rest wait for the next run. Deleting
+        # fires the summary and ledger triggers like any delete, so their effect is added
+        # back: archiving never changes the dashboard or a customer's balance.
+        with self.db.write() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            moved = [row[0] for row in conn.execute(
+                f"""SELECT d.id FROM main.documents d JOIN {SCHEMA}.documents a ON a.id = d.id
+                    WHERE d.id IN ({_marks(doc_ids)}) AND a.status IS d.status
+                    AND NOT EXISTS (SELECT 1 FROM main.payments p WHERE p.doc_id = d.id AND NOT EXISTS (
+                        SELECT 1 FROM {SCHEMA}.payments ap WHERE ap.id = p.id))""", doc_ids)]
+            if not moved:
+                return 0, 0
+            marks = _marks(moved)
+            invoices, revenue = conn.execute(
+                f"""SELECT COALESCE(SUM(doc_type = 'Invoice' AND status = 'active'), 0),
+                    COALESCE(SUM(CASE WHEN doc_type = 'Invoice' AND status = 'active' THEN total ELSE 0 END), 0)
+                    FROM main.documents WHERE id IN ({marks})""", moved).fetchone()
+            payments, debit, credit = conn.execute(
+                f"""SELECT COUNT(*), COALESCE(SUM(CASE WHEN transaction_type = 'debit' THEN amount ELSE 0 END), 0),
+                    COALESCE(SUM(CASE WHEN transaction_type = 'credit' THEN amount ELSE 0 END), 0)
+                    FROM main.payments WHERE doc_id IN ({marks})""", moved).fetchone()
+            balances = conn.execute(
+                f"""SELECT debit, credit, balance, customer_id FROM main.invoice_balances
+                    WHERE doc_id IN ({marks}) AND status = 'active' AND customer_id IS NOT NULL""", moved).fetchall()
+            numbers = [row[0] for row in conn.execute(f"SELECT doc_number FROM main.documents WHERE id IN ({marks})", moved)]
+
+            for table, ref in reversed(list(TABLES.items())):
+                conn.execute(f"DELETE FROM main.{table} WHERE {ref} IN ({marks})", moved)
+            conn.execute(f"DELETE FROM main.invoice_balances WHERE doc_id IN ({marks})", moved)
+            conn.execute("""UPDATE dashboard_summary SET active_invoices = active_invoices + ?,
+                            invoice_revenue = invoice_revenue + ?, total_debit = total_debit + ?,
+                            total_credit = total_credit + ? WHERE id = 1""", (invoices, revenue, debit, credit))
+            conn.executemany("""UPDATE customer_balances SET debit = debit + ?, credit = credit + ?,
+                                balance = balance + ? WHERE customer_id = ?""", balances)
+            # Counters seed themselves from the highest number in main the first time a
+            # series is used; make sure they never restart below an archived number
+            counters = {}
+            for number in numbers:
+                parts = str(number).rsplit('/', 2)
+                if len(parts) == 3 and parts[2].isdigit():
+                    counters[parts[0], parts[1]] = max(counters.get((parts[0], parts[1]), 0), int(parts[2]) + 1)
+            conn.executemany("""INSERT INTO document_counters (prefix, fiscal_year, next_value) VALUES (?, ?, ?)
+                                ON CONFLICT (prefix, fiscal_year) DO UPDATE SET next_value = MAX(next_value, excluded.next_value)""",
+                             [(prefix, fy, value) for (prefix, fy), value in counters.items()])
+            return len(moved), payments
+
+    def run(self, keep_years=KEEP_YEARS, batch_size=BATCH_SIZE, progress=None):
+        # Batch by batch: copy into the archive and commit, then purge from main and commit.
+        # Transactions spanning two WAL files are only atomic per file, so a crash between the
+        # two leaves a duplicate (hidden by source(), cleaned up next run), never a loss.
+        if not self.is_open:
+            self.open()
+        cutoff = cutoff_date(keep_years)
+        documents = payments = 0
+        last_id = 0
+        while True:
+            doc_ids = self.candidates(cutoff, last_id, batch_size)
+            if not doc_ids:
+                break
+            self._copy(doc_ids)
+            moved, moved_payments = self._purge(doc_ids)
+            documents += moved
+            payments += moved_payments
+            last_id = doc_ids[-1]
+            if progress:
+                progress(documents, payments)
+        if documents:
+            with self.db.write() as conn:
+                conn.execute(f"INSERT INTO {SCHEMA}.archive_runs (cutoff, documents, payments) VALUES (?, ?, ?)",
+                             (str(cutoff), documents, payments))
+        return {'cutoff': cutoff, 'documents': documents, 'payments': payments}
+
+    def stats(self):
+        if not self.is_open:
+            return {'documents': 0, 'payments': 0, 'last_run': None, 'cutoff': None}
+        with self.db.read() as conn:
+            documents, payments, last_run = conn.execute(
+                f"SELECT COALESCE(SUM(documents), 0), COALESCE(SUM(payments), 0), MAX(archived_at) "
+                f"FROM {SCHEMA}.archive_runs").fetchone()
+            cutoff = conn.execute(f"SELECT cutoff FROM {SCHEMA}.archive_runs ORDER BY id DESC LIMIT 1").fetchone()
+        return {'documents': documents, 'payments': payments, 'last_run': last_run, 'cutoff': cutoff and cutoff[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move closed fiscal years and deleted documents to the archive")
+    parser.add_argument('db', nargs='?', default=DB_PATH)
+    parser.add_argument('--keep-years', type=int, default=KEEP_YEARS,
+                        help="fiscal years kept in the main database, counting the current one")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--vacuum', action='store_true',
+                        help="rewrite the main file afterwards to give the space back (blocks writers meanwhile)")
+    args = parser.parse_args(argv)
+    from erp.schema import migrate
+    db = get_db(args.db)
+    migrate(db)
+    archive = Archive(db)
+    result = archive.run(args.keep_years, args.batch_size,
+                         lambda documents, payments: print(f"\r{documents} documents, {payments} payments", end=''))
+    print(f"\narchived {result['documents']} documents and {result['payments']} payments "
+          f"(before {result['cutoff']}) to {archive.path}")
+    if args.vacuum:
+        with db.write() as conn:
+            conn.execute("VACUUM main")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import base64
+import functools
+import hashlib
+import io
+import os
+import re
+from urllib.parse import urljoin
+
+# Uploaded images live on disk, once, in pre-sized variants; settings and documents only
+# carry a key like "logo/<hash>". By default this is the app's static/ folder, which
+# Streamlit serves at /app/static/ (server.enableStaticServing).
+ASSET_DIR = os.environ.get('SALES_ERP_ASSET_DIR',
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static'))
+ASSET_URL = os.environ.get('SALES_ERP_ASSET_URL', '/app/static/')
+# Documents use server-relative URLs; WeasyPrint resolves them against this and then reads
+# the file straight from ASSET_DIR (see url_fetcher), never over HTTP
+BASE_URL = 'http://localhost/'
+
+# Bounding boxes; 'document' is twice the 150x80 header slot so print stays sharp
+VARIANTS = {'document': (300, 160), 'preview': (150, 80), 'large': (600, 320)}
+
+_ASSET_REF = re.compile(re.escape(ASSET_URL) + r'(logo/[0-9a-f]+/[a-z]+\.png|css/[0-9a-f]+\.css)')
+MIME_TYPES = {'.png': 'image/png', '.css': 'text/css'}
+
+
+def store_logo(data, asset_dir=ASSET_DIR):
+    # Normalized to PNG (EXIF rotation applied, alpha kept) and downsized to every variant.
+    # Content-addressed, so storing the same upload twice is free. Raises OSError for
+    # anything Pillow can't read.
+    from PIL import Image, ImageOps
+    key = f"logo/{hashlib.sha256(data).hexdigest()[:16]}"
+    folder = os.path.join(asset_dir, key)
+    if all(os.path.exists(os.path.join(folder, f"{variant}.png")) for variant in VARIANTS):
+        return key
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert('RGBA')
+    os.makedirs(folder, exist_ok=True)
+    for variant, box in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(box, Image.LANCZOS)
+        path = os.path.join(folder, f"{variant}.png")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        resized.save(tmp, 'PNG', optimize=True)
+        os.replace(tmp, path)
+    return key
+
+
+def store_stylesheet(data, asset_dir=ASSET_DIR):
+    # Content-addressed like logos; returns its URL. Written again if the file has gone
+    # missing, so a cleaned or redeployed asset folder heals on the next render.
+    name = f"css/{hashlib.sha256(data).hexdigest()[:16]}.css"
+    path = os.path.join(asset_dir, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return f"{ASSET_URL}{name}"
+
+
+def asset_path(key, variant='document', asset_dir=ASSET_DIR):
+    return os.path.join(asset_dir, key, f"{variant}.png") if key else ''
+
+
+def asset_url(key, variant='document', asset_dir=ASSET_DIR):
+    # Empty (no logo) when the file is gone, e.g. a database restored or deployed without
+    # its asset folder
+    if not key or not os.path.exists(asset_path(key, variant, asset_dir)):
+        return ''
+    return f"{ASSET_URL}{key}/{variant}.png"
+
+
+def _local_path(url):
+    # The file behind an asset URL, or None if the URL isn't one of ours
+    prefix = urljoin(BASE_URL, ASSET_URL)
+    url = urljoin(BASE_URL, url)
+    if not url.startswith(prefix):
+        return None
+    root = os.path.realpath(ASSET_DIR)
+    path = os.path.realpath(os.path.join(root, url[len(prefix):].split('?')[0]))
+    return path if path.startswith(root + os.sep) else None
+
+
+def url_fetcher(url, *args, **kwargs):
+    # For WeasyPrint: asset URLs come from disk, anything else takes the default route
+    path = _local_path(url)
+    if path is None:
+        from weasyprint import default_url_fetcher
+        return default_url_fetcher(url, *args, **kwargs)
+    with open(path, 'rb') as f:
+        return {'string': f.read(), 'mime_type': MIME_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream'),
+                'redirected_url': url}
+
+
+@functools.lru_cache(maxsize=32)
+def _data_uri(path):
+    # Assets never change under a key, so the encoded form can be kept
+    with open(path, 'rb') as f:
+        return f"data:{MIME_TYPES[os.path.splitext(path)[1]]};base64,{base64.b64encode(f.read()).decode()}"
+
+
+def inline_assets(html):
+    # For HTML that leaves the server (downloads, ZIPs): asset URLs become data URIs of
+    # the already downsized variant, so the file still shows its logo offline
+    def replace(match):
+        path = os.path.join(ASSET_DIR, match.group(1))
+        return _data_uri(path) if os.path.exists(path) else match.group(0)
+    return _ASSET_REF.sub(replace, html)
+
+
+def migrate_inline_logo(conn):
+    # Settings written before the asset store kept the upload itself as a data: URI
+    row = conn.execute("SELECT value FROM settings WHERE key='company_logo'").fetchone()
+    if row and row[0] and row[0].startswith('data:'):
+        try:
+            key = store_logo(base64.b64decode(row[0].split(',', 1)[1]))
+        except (OSError, ValueError, IndexError):
+            key = ''
+        conn.execute("UPDATE settings SET value=? WHERE key='company_logo'", (key,))
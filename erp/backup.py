@@ -0,0 +1,315 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import tarfile
+import threading
+import time
+from datetime import datetime
+
+from erp.archive import SCHEMA as ARCHIVE_SCHEMA, Archive, archive_path
+from erp.assets import ASSET_DIR
+from erp.db import DB_PATH, get_db
+from erp.metrics import timed
+
+# Snapshots are gzipped copies of the database (and its archive, if attached) taken with
+# SQLite's online backup API, plus a tar of the logo files its settings point at, each
+# with a JSON manifest holding the SHA-256 of every file. A snapshot without a manifest is
+# incomplete and never listed.
+ASSETS = 'assets'
+BACKUP_DIR = os.environ.get('SALES_ERP_BACKUP_DIR', 'backups')
+# Hours between scheduled snapshots; 0 turns the scheduler off
+BACKUP_HOURS = float(os.environ.get('SALES_ERP_BACKUP_HOURS', 24))
+# Copied in steps of this many pages with a pause after each, so the disk is shared with
+# the app rather than saturated
+STEP_PAGES = 256
+STEP_PAUSE = 0.002
+# Retention: the newest KEEP_LAST snapshots, plus the newest of each of the last KEEP_DAILY days
+KEEP_LAST = 7
+KEEP_DAILY = 30
+CHUNK_SIZE = 1 << 20
+
+_lock = threading.Lock()
+_errors = {}
+
+
+def _stem(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+
+def _copy_pages(src, path, schema, pause):
+    dst = sqlite3.connect(path)
+    try:
+        src.backup(dst, pages=STEP_PAGES, name=schema, progress=lambda *_: time.sleep(pause))
+    finally:
+        dst.close()
+
+
+def _compress(path, out_path):
+    # Streams the file through gzip; returns the uncompressed size and SHA-256
+    digest, size = hashlib.sha256(), 0
+    tmp = f"{out_path}.tmp"
+    with open(path, 'rb') as f, gzip.open(tmp, 'wb', compresslevel=6) as out:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    os.replace(tmp, out_path)
+    return size, digest.hexdigest()
+
+
+def _pack_assets(keys, path, asset_dir):
+    # The asset folders behind `keys` as an uncompressed tar; folders already gone are skipped
+    with tarfile.open(path, 'w') as tar:
+        for key in keys:
+            folder = os.path.join(asset_dir, key)
+            if os.path.isdir(folder):
+                tar.add(folder, arcname=key)
+
+
+def _write_json(path, value):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(value, f, indent=2)
+    os.replace(tmp, path)
+
+
+@timed()
+def create_snapshot(db, backup_dir=BACKUP_DIR, pause=STEP_PAUSE, asset_dir=ASSET_DIR):
+    # Every file is copied from one read transaction, so main and archive agree with each
+    # other. In WAL mode that never blocks writers and, unlike stepping without one, the
+    # copy doesn't restart when they commit; the WAL just can't be checkpointed past the
+    # snapshot until the copy is done. Returns the manifest.
+    with _lock:
+        os.makedirs(backup_dir, exist_ok=True)
+        created = datetime.now()
+        name = f"{_stem(db.path)}-{created:%Y%m%d-%H%M%S}"
+        schemas = ['main'] + list(db.attachments)
+        raw = {schema: os.path.join(backup_dir, f"{name}{'' if schema == 'main' else '.' + schema}.db")
+               for schema in schemas}
+        src = sqlite3.connect(db.path, timeout=db.timeout)
+        try:
+            for schema, path in db.attachments.items():
+                src.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+            src.execute("BEGIN")
+            for schema in schemas:
+                src.execute(f"SELECT COUNT(*) FROM {schema}.sqlite_master").fetchone()
+            version = src.execute("PRAGMA main.user_version").fetchone()[0]
+            logos = [row[0] for row in src.execute("SELECT value FROM main.settings WHERE key='company_logo' "
+                                                   "AND value != ''")]
+            for schema in schemas:
+                _copy_pages(src, f"{raw[schema]}.tmp", schema, pause)
+            src.rollback()
+        finally:
+            src.close()
+        # Asset files never change under a key, so copying them after the transaction is safe
+        raw[ASSETS] = os.path.join(backup_dir, f"{name}.{ASSETS}.tar")
+
+        files = {}
+        try:
+            _pack_assets(logos, f"{raw[ASSETS]}.tmp", asset_dir)
+            for schema in raw:
+                size, sha256 = _compress(f"{raw[schema]}.tmp", f"{raw[schema]}.gz")
+                files[schema] = {'file': os.path.basename(f"{raw[schema]}.gz"), 'size': size, 'sha256': sha256,
+                                 'compressed': os.path.getsize(f"{raw[schema]}.gz")}
+        finally:
+            for path in raw.values():
+                if os.path.exists(f"{path}.tmp"):
+                    os.remove(f"{path}.tmp")
+        manifest = {'name': name, 'database': os.path.abspath(db.path), 'created': created.isoformat(timespec='seconds'),
+                    'timestamp': created.timestamp(), 'schema_version': version, 'files': files}
+        _write_json(os.path.join(backup_dir, f"{name}.json"), manifest)
+        return manifest
+
+
+def list_snapshots(backup_dir=BACKUP_DIR, db_path=None):
+    # Newest first; only snapshots of `db_path` if given
+    snapshots = []
+    if not os.path.isdir(backup_dir):
+        return snapshots
+    for entry in os.scandir(backup_dir):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if db_path is None or manifest.get('name', '').rsplit('-', 2)[0] == _stem(db_path):
+            snapshots.append(manifest)
+    return sorted(snapshots, key=lambda manifest: manifest['timestamp'], reverse=True)
+
+
+def find_snapshot(name, backup_dir=BACKUP_DIR):
+    path = os.path.join(backup_dir, f"{os.path.basename(name).removesuffix('.json')}.json")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No snapshot named {name} in {backup_dir}")
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def verify_snapshot(manifest, backup_dir=BACKUP_DIR):
+    # Returns a list of problems; empty if every file decompresses to its recorded checksum
+    problems = []
+    for schema, entry in manifest['files'].items():
+        digest, size = hashlib.sha256(), 0
+        try:
+            with gzip.open(os.path.join(backup_dir, entry['file']), 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    size += len(chunk)
+        except (OSError, EOFError) as e:
+            problems.append(f"{entry['file']}: {e}")
+            continue
+        if size != entry['size'] or digest.hexdigest() != entry['sha256']:
+            problems.append(f"{entry['file']}: checksum mismatch")
+    return problems
+
+
+def rotate(backup_dir=BACKUP_DIR, db_path=None, keep_last=KEEP_LAST, keep_daily=KEEP_DAILY):
+    # Deletes snapshots outside the retention policy; the manifest goes first, so a
+    # half-deleted snapshot is never listed. Returns the names removed.
+    kept_days, removed = set(), []
+    for i, manifest in enumerate(list_snapshots(backup_dir, db_path)):
+        day = manifest['created'][:10]
+        if i < keep_last or (day not in kept_days and len(kept_days) < keep_daily):
+            kept_days.add(day)
+            continue
+        os.remove(os.path.join(backup_dir, f"{manifest['name']}.json"))
+        for entry in manifest['files'].values():
+            path = os.path.join(backup_dir, entry['file'])
+            if os.path.exists(path):
+                os.remove(path)
+        removed.append(manifest['name'])
+    return removed
+
+
+def restore_snapshot(manifest, db_path, backup_dir=BACKUP_DIR, asset_dir=ASSET_DIR):
+    # Checks the snapshot, then copies it over db_path (and its archive) through SQLite, so
+    # the WAL and any other connection see one consistent switch. Processes that have the
+    # database open keep their in-memory caches: restart them afterwards. Logo files are
+    # added to the asset folder; being keyed by content, none is ever overwritten with
+    # something else.
+    problems = verify_snapshot(manifest, backup_dir)
+    if problems:
+        raise ValueError(f"Snapshot {manifest['name']} is damaged: {'; '.join(problems)}")
+    targets = {'main': db_path, ARCHIVE_SCHEMA: archive_path(db_path)}
+    for schema, entry in manifest['files'].items():
+        if schema == ASSETS:
+            os.makedirs(asset_dir, exist_ok=True)
+            with tarfile.open(os.path.join(backup_dir, entry['file']), 'r:gz') as tar:
+                tar.extractall(asset_dir, filter='data')
+            continue
+        tmp = os.path.join(os.path.dirname(os.path.abspath(targets[schema])), f".{entry['file']}.restore")
+        try:
+            with gzip.open(os.path.join(backup_dir, entry['file']), 'rb') as f, open(tmp, 'wb') as out:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    out.write(chunk)
+            src = sqlite3.connect(tmp)
+            try:
+                if src.execute("PRAGMA quick_check").fetchone()[0] != 'ok':
+                    raise ValueError(f"{entry['file']} fails SQLite's integrity check")
+                dst = sqlite3.connect(targets[schema], timeout=30.0)
+                try:
+                    src.backup(dst)
+                finally:
+                    dst.close()
+            finally:
+                src.close()
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def scheduler_error(db):
+    return _errors.get(db.path)
+
+
+_schedulers = set()
+_schedulers_lock = threading.Lock()
+
+
+def start_scheduler(db, hours=BACKUP_HOURS, backup_dir=BACKUP_DIR):
+    # Once per database per process, off the script thread. Each process looks at the
+    # newest snapshot on disk before taking one, so the app and API workers sharing a
+    # database don't each take their own.
+    if hours <= 0:
+        return
+    with _schedulers_lock:
+        if db.path in _schedulers:
+            return
+        _schedulers.add(db.path)
+
+    def run():
+        interval = hours * 3600
+        while True:
+            snapshots = list_snapshots(backup_dir, db.path)
+            due = snapshots[0]['timestamp'] + interval if snapshots else 0
+            if time.time() >= due:
+                try:
+                    create_snapshot(db, backup_dir)
+                    rotate(backup_dir, db.path)
+                    _errors.pop(db.path, None)
+                except (OSError, sqlite3.Error) as e:
+                    _errors[db.path] = f"{datetime.now():%Y-%m-%d %H:%M}: {e}"
+                due = time.time() + interval
+            time.sleep(max(60, due - time.time()))
+
+    threading.Thread(target=run, name='backup-scheduler', daemon=True).start()
+
+
+def _open(db_path):
+    # As the app has it: with the archive attached when there is one
+    db = get_db(db_path)
+    archive = Archive(db)
+    if os.path.exists(archive.path):
+        archive.open()
+    return db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online snapshots of the Sales ERP database")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--dir', default=BACKUP_DIR, help="where snapshots are kept")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('create', help="take a snapshot now and apply retention")
+    commands.add_parser('list')
+    verify = commands.add_parser('verify', help="check every snapshot's checksums")
+    verify.add_argument('name', nargs='?')
+    restore = commands.add_parser('restore', help="replace the database with a snapshot")
+    restore.add_argument('name')
+    restore.add_argument('--no-safety-snapshot', action='store_true',
+                         help="don't snapshot the current database first")
+    args = parser.parse_args(argv)
+
+    if args.command == 'create':
+        manifest = create_snapshot(_open(args.db), args.dir)
+        print(f"{manifest['name']}: " + ', '.join(f"{entry['file']} ({entry['compressed'] / 2**20:.1f} MB)"
+                                                  for entry in manifest['files'].values()))
+        for name in rotate(args.dir, args.db):
+            print(f"removed {name}")
+    elif args.command == 'list':
+        for manifest in list_snapshots(args.dir, args.db):
+            size = sum(entry['compressed'] for entry in manifest['files'].values())
+            print(f"{manifest['name']}  {manifest['created']}  schema {manifest['schema_version']}  {size / 2**20:.1f} MB")
+    elif args.command == 'verify':
+        manifests = [find_snapshot(args.name, args.dir)] if args.name else list_snapshots(args.dir, args.db)
+        failed = 0
+        for manifest in manifests:
+            problems = verify_snapshot(manifest, args.dir)
+            failed += bool(problems)
+            print(f"{manifest['name']}: {'; '.join(problems) or 'ok'}")
+        return 1 if failed else 0
+    elif args.command == 'restore':
+        manifest = find_snapshot(args.name, args.dir)
+        if not args.no_safety_snapshot and os.path.exists(args.db):
+            print(f"current database saved as {create_snapshot(_open(args.db), args.dir)['name']}")
+        restore_snapshot(manifest, args.db, args.dir)
+        print(f"restored {manifest['name']} to {args.db}; restart the app and API")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,76 @@
+import queue
+import time
+import zipfile
+
+from erp.archive import source
+from erp.assets import inline_assets
+from erp.lines import load_lines_many
+from erp.numbering import file_name
+from erp.pdf import get_renderer
+
+BATCH_SIZE = 16
+
+
+def select_document_ids(conn, date_from=None, date_to=None, customer_id=None, doc_type=None):
+    where, params = ["status!='deleted'"], []
+    if date_from:
+        where.append("doc_date >= ?")
+        params.append(str(date_from))
+    if date_to:
+        where.append("doc_date <= ?")
+        params.append(str(date_to))
+    if customer_id:
+        where.append("customer_id = ?")
+        params.append(int(customer_id))
+    if doc_type:
+        where.append("doc_type = ?")
+        params.append(doc_type)
+    # Reads through to the archive, so closed years can still be exported
+    query = f"SELECT id FROM {source(conn, 'documents')} WHERE {' AND '.join(where)} ORDER BY doc_date, id"
+    return [row[0] for row in conn.execute(query, params)]
+
+
+def _fetch_documents(conn, doc_ids):
+    marks = ', '.join('?' * len(doc_ids))
+    c = conn.execute(f"SELECT * FROM {source(conn, 'documents')} WHERE id IN ({marks}) ORDER BY doc_date, id", doc_ids)
+    columns = [col[0] for col in c.description]
+    return [dict(zip(columns, row)) for row in c.fetchall()]
+
+
+def _submit(renderer, doc_number, html):
+    # Share the pool with interactive users: wait for room rather than fail the batch
+    while True:
+        try:
+            return renderer.submit(doc_number, html)
+        except queue.Full:
+            time.sleep(0.1)
+
+
+def export_documents_zip(db, doc_ids, build_html, out_path, batch_size=BATCH_SIZE,
+                         include_html=False, progress=None, renderer=None):
+    # Only one batch of documents, HTML and PDFs is in flight at a time; each batch renders
+    # in parallel on the PDF pool and is appended to the ZIP before the next is loaded.
+    # Documents whose PDF can't be rendered are written as HTML and returned.
+    renderer = renderer or get_renderer()
+    failed = []
+    with zipfile.ZipFile(out_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for start in range(0, len(doc_ids), batch_size):
+            batch = list(doc_ids[start:start + batch_size])
+            with db.read() as conn:
+                docs = _fetch_documents(conn, batch)
+                lines = load_lines_many(conn, batch)
+            jobs = []
+            for doc in docs:
+                html = build_html(doc, lines[doc['id']])
+                jobs.append((doc['doc_number'], html, _submit(renderer, doc['doc_number'], html)))
+            for doc_number, html, path in jobs:
+                done = renderer.wait(path) == 'done'
+                if include_html or not done:
+                    zf.writestr(file_name(doc_number, 'html'), inline_assets(html))
+                if done:
+                    zf.write(path, file_name(doc_number, 'pdf'), compress_type=zipfile.ZIP_STORED)
+                else:
+                    failed.append(doc_number)
+            if progress:
+                progress(start + len(batch), len(doc_ids))
+    return failed
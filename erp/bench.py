@@ -0,0 +1,293 @@
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from erp.db import Database
+from erp.exporter import export_table
+from erp.importer import import_csv
+from erp.lines import load_lines, save_lines, save_taxes
+from erp.numbering import NumberAllocator
+from erp.schema import migrate
+from erp.services import Services
+from erp.tax import compute, is_interstate
+
+# Headless benchmarks for the data layer: `generate` fills a database with synthetic
+# customers, items, documents, lines and payments; `run` times the operations the app
+# performs, writes the results as JSON and compares them with a stored baseline. `run`
+# writes too (saved documents, imported items), so point it at a throwaway database.
+#
+#   python -m erp.bench generate --db bench.db --documents 1000000
+#   python -m erp.bench run --db bench.db --output results.json --baseline baseline.json
+
+DOC_TYPES = ['Invoice'] * 6 + ['Quotation'] * 3 + ['Purchase Order']
+WORDS = ['Sharma', 'Patel', 'Reddy', 'Iyer', 'Gupta', 'Singh', 'Nair', 'Mehta', 'Rao', 'Das', 'Global',
+         'Sunrise', 'Shree', 'Ganesh', 'Lakshmi', 'Tech', 'Steel', 'Textiles', 'Foods', 'Pharma']
+SUFFIXES = ['Traders', 'Enterprises', 'Industries', 'Pvt Ltd', 'LLP', 'Agencies', 'Exports']
+PRODUCTS = ['Bolt', 'Nut', 'Washer', 'Bearing', 'Valve', 'Pipe', 'Cable', 'Switch', 'Motor', 'Pump',
+            'Sensor', 'Relay', 'Panel', 'Filter', 'Gasket', 'Hose', 'Clamp', 'Gear', 'Belt', 'Fan']
+# Seeded when the rate table is empty, so documents mix rates like real ones do
+RATES = [('84', 18, 'Machinery'), ('8415', 28, 'Air conditioners'), ('8432', 12, 'Agricultural machinery'),
+         ('85', 18, 'Electrical equipment'), ('8507', 28, 'Batteries'), ('8541', 12, 'Solar cells')]
+COMPANY = {'name': 'Bench Co', 'address': 'Plot 1\nIndustrial Area', 'phone': '9800000000',
+           'gstin': '27AAAAA0000A1Z5', 'created_by': 'bench', 'logo': ''}
+CHUNK = 5000
+TOLERANCE = 0.25
+NOISE_MS = 1.0
+
+
+def _gstin(rnd):
+    letters = ''.join(rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(5))
+    return f"{rnd.randint(1, 37):02d}{letters}{rnd.randint(0, 9999):04d}{rnd.choice('ABCDEFGHJK')}1Z{rnd.randint(0, 9)}"
+
+
+def _lines(rnd, items, average):
+    lines = []
+    for _ in range(max(1, int(rnd.expovariate(1 / average)) + 1)):
+        item_id, name, desc, hsn, price = rnd.choice(items)
+        lines.append({'name': name, 'description': desc, 'hsn': hsn, 'price': price, 'qty': rnd.randint(1, 50)})
+    return lines
+
+
+def generate(db, customers=1000, items=500, documents=20000, lines=4, paid=0.7, days=730, seed=1, progress=None):
+    # Documents are priced by the tax engine and saved with their lines and tax breakdown as
+    # the app saves them. Invoices get the debit the app posts on creation, and a full or
+    # partial credit with probability `paid`; document numbers come from the real allocator.
+    rnd = random.Random(seed)
+    svc = Services(db)
+    if not svc.rates.all():
+        svc.rates.replace(RATES)
+    rates, default_rate = svc.rates.all(), svc.default_tax_rate()
+    with db.write() as conn:
+        conn.executemany("INSERT INTO customers (name, contact_person, address, phone, gstin, email) VALUES (?, ?, ?, ?, ?, ?)",
+                         ((f"{rnd.choice(WORDS)} {rnd.choice(WORDS)} {rnd.choice(SUFFIXES)} {n}", rnd.choice(WORDS),
+                           f"{rnd.randint(1, 999)} Main Road\nCity {rnd.randint(1, 50)}", f"9{rnd.randint(0, 999999999):09d}",
+                           _gstin(rnd), f"accounts{n}@example.com") for n in range(customers)))
+        conn.executemany("INSERT INTO items (name, description, hsn_code, price) VALUES (?, ?, ?, ?)",
+                         ((f"{rnd.choice(PRODUCTS)} {rnd.choice(['M', 'S', 'X'])}{n}", f"{rnd.choice(PRODUCTS)} grade {n % 7}",
+                           f"{rnd.randint(8400, 8599)}", round(rnd.uniform(5, 5000), 2)) for n in range(items)))
+        customer_rows = conn.execute("SELECT id, name, contact_person, address, phone, gstin FROM customers "
+                                     "WHERE status='active'").fetchall()
+        item_rows = conn.execute("SELECT id, name, description, hsn_code, price FROM items WHERE status='active'").fetchall()
+
+    allocator = NumberAllocator(db, block_size=CHUNK)
+    prefixes = {'Invoice': 'INV', 'Quotation': 'QUO', 'Purchase Order': 'PO'}
+    start = date.today() - timedelta(days=days)
+    for done in range(0, documents, CHUNK):
+        with db.write() as conn:
+            for _ in range(min(CHUNK, documents - done)):
+                doc_type = rnd.choice(DOC_TYPES)
+                doc_date = start + timedelta(days=rnd.randint(0, days))
+                customer = rnd.choice(customer_rows)
+                priced = compute(_lines(rnd, item_rows, lines), rates, is_interstate(COMPANY['gstin'], customer[-1]),
+                                 default_rate)
+                total = priced['total']
+                doc_number = allocator.next_number(prefixes[doc_type], doc_date)
+                doc_id = conn.execute("""INSERT INTO documents (doc_type, doc_number, doc_date, customer_id, customer_name,
+                                         customer_contact, customer_address, customer_phone, customer_gstin, subtotal,
+                                         cgst, sgst, igst, total, terms_conditions, created_by, created_at)
+                                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                      (doc_type, doc_number, doc_date, *customer, priced['subtotal'], priced['cgst'],
+                                       priced['sgst'], priced['igst'], total, 'Payment due in 30 days', 'bench',
+                                       f"{doc_date} {rnd.randint(9, 18):02d}:{rnd.randint(0, 59):02d}:00")).lastrowid
+                save_lines(conn, doc_id, priced['items'])
+                save_taxes(conn, doc_id, priced['taxes'])
+                if doc_type == 'Invoice':
+                    payments = [('debit', total, 'Invoice', doc_date, 'Invoice generated')]
+                    if rnd.random() < paid:
+                        amount = total if rnd.random() < 0.7 else round(float(total) * rnd.uniform(0.1, 0.9), 2)
+                        payments.append(('credit', amount, rnd.choice(['Cash', 'UPI', 'Bank Transfer', 'Cheque']),
+                                         doc_date + timedelta(days=rnd.randint(0, 90)), ''))
+                    conn.executemany("""INSERT INTO payments (doc_id, doc_number, transaction_type, amount, payment_mode,
+                                        payment_date, remarks) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                     [(doc_id, doc_number) + p for p in payments])
+        if progress:
+            progress(min(done + CHUNK, documents), documents)
+    allocator.release()
+
+
+def _sample_document(db):
+    with db.read() as conn:
+        row = conn.execute("SELECT id, doc_type, doc_number, doc_date, customer_name FROM documents "
+                           "WHERE status!='deleted' ORDER BY id DESC LIMIT 1").fetchone()
+        return row, load_lines(conn, row[0])
+
+
+def _cases(svc, rnd):
+    # name -> (callable, repeats); reads and writes go through the same repositories the app uses
+    db = svc.db
+
+    def deep_page(pages=20):
+        cursor = None
+        for _ in range(pages):
+            _, cursor = svc.documents.page(cursor=cursor)
+
+    def save_document_and_payment():
+        svc.issue_document('Invoice', date.today(), customer, svc.price(_lines(rnd, items, 4), True),
+                           'Payment due in 30 days', company)
+
+    def import_items(rows=10000):
+        tag = f"{os.getpid()}-{time.time_ns()}"
+        csv = io.StringIO("name,description,hsn_code,price\n" + ''.join(
+            f"Bench {tag} {n},imported,{8400 + n % 100},{1 + n % 500}.50\n" for n in range(rows)))
+        import_csv(db, csv, 'items')
+
+    def export(fmt):
+        def run():
+            os.remove(export_table(db, 'documents', fmt))
+        return run
+
+    def render():
+        from erp.render import render_document
+        doc_type, doc_number, doc_date, customer_name = doc[1:]
+        return render_document(doc_type, doc_lines, doc_number=doc_number, doc_date=doc_date, company=COMPANY,
+                               customer={'name': customer_name, 'address': '', 'phone': '', 'gstin': ''},
+                               subtotal=100.0, cgst=9.0, sgst=9.0, igst=0, total=118.0, terms='', general_terms='')
+
+    def pdf():
+        from erp.pdf import render_pdf
+        render_pdf(render())
+
+    with db.read() as conn:
+        customer_id, customer_name = conn.execute("SELECT id, name FROM customers WHERE status='active' "
+                                                  "ORDER BY id LIMIT 1").fetchone()
+        items = conn.execute("SELECT id, name, description, hsn_code, price FROM items WHERE status='active' "
+                             "LIMIT 1000").fetchall()
+    customer = {'id': customer_id, 'name': customer_name}
+    company = dict(svc.company_info(), created_by='bench')
+    doc, doc_lines = _sample_document(db)
+    big_document = _lines(rnd, items, 200)
+    cases = {
+        'documents_page': (lambda: svc.documents.page(), 50),
+        'documents_page_deep': (deep_page, 10),
+        'documents_page_invoices': (lambda: svc.documents.page('Invoice'), 50),
+        'dashboard_kpis': (svc.dashboard.summary, 200),
+        'document_lines': (lambda: svc.documents.lines(doc[0]), 200),
+        'document_taxes': (lambda: svc.documents.taxes(doc[0]), 200),
+        'tax_summary': (svc.documents.tax_summary, 5),
+        'search_customers': (lambda: svc.customers.search(rnd.choice(WORDS)[:3]), 100),
+        'aging_report': (svc.payments.aging, 5),
+        'price_large_document': (lambda: svc.price(big_document), 50),
+        'save_document_and_payment': (save_document_and_payment, 50),
+        'import_items_csv_10k': (import_items, 3),
+        'export_documents_csv': (export('csv'), 3),
+        'render_document': (render, 100),
+        'render_pdf': (pdf, 5),
+    }
+    if importlib.util.find_spec('pyarrow') is not None:
+        cases['export_documents_parquet'] = (export('parquet'), 3)
+    return cases
+
+
+def run(db, only=None, repeat_scale=1.0, seed=1):
+    rnd = random.Random(seed)
+    svc = Services(db)
+    cases = _cases(svc, rnd)
+    results = {}
+    for name, (fn, repeats) in cases.items():
+        if only and name not in only:
+            continue
+        timings = []
+        try:
+            fn()  # warm-up: compiled templates, worker imports, SQLite's page cache
+            for _ in range(max(1, int(repeats * repeat_scale))):
+                # The query, not a result cache hit: every call starts with the cache empty
+                svc.cache.clear()
+                start = time.perf_counter()
+                fn()
+                timings.append((time.perf_counter() - start) * 1000)
+        except Exception as e:
+            # e.g. WeasyPrint without its system libraries: reported, not fatal
+            results[name] = {'skipped': f"{type(e).__name__}: {e}"}
+            continue
+        timings.sort()
+        results[name] = {'runs': len(timings), 'min_ms': round(timings[0], 3),
+                         'median_ms': round(statistics.median(timings), 3),
+                         'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+                         'max_ms': round(timings[-1], 3)}
+    svc.numbers.release()
+    return results
+
+
+def volumes(db):
+    with db.read() as conn:
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ('customers', 'items', 'documents', 'document_lines', 'payments')}
+
+
+def compare(results, baseline, tolerance=TOLERANCE, noise_ms=NOISE_MS):
+    # A case regresses when its median is more than `tolerance` slower than the baseline's
+    # and the difference is above the timer noise floor
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name, {})
+        if 'median_ms' not in result or 'median_ms' not in before:
+            continue
+        if (result['median_ms'] > before['median_ms'] * (1 + tolerance)
+                and result['median_ms'] - before['median_ms'] > noise_ms):
+            regressions.append((name, before['median_ms'], result['median_ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m erp.bench')
+    parser.add_argument('--db', default='bench.db')
+    sub = parser.add_subparsers(dest='command', required=True)
+    gen = sub.add_parser('generate')
+    gen.add_argument('--customers', type=int, default=1000)
+    gen.add_argument('--items', type=int, default=500)
+    gen.add_argument('--documents', type=int, default=20000)
+    gen.add_argument('--lines', type=float, default=4, help='average line items per document')
+    gen.add_argument('--paid', type=float, default=0.7, help='share of invoices with a payment')
+    gen.add_argument('--seed', type=int, default=1)
+    bench = sub.add_parser('run')
+    bench.add_argument('--output', help='write results JSON here (default: stdout)')
+    bench.add_argument('--baseline', help='compare with this results JSON; exit 1 on regressions')
+    bench.add_argument('--tolerance', type=float, default=TOLERANCE)
+    bench.add_argument('--only', nargs='*')
+    bench.add_argument('--repeat-scale', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    migrate(db)
+    if args.command == 'generate':
+        started = time.perf_counter()
+        generate(db, args.customers, args.items, args.documents, args.lines, args.paid, seed=args.seed,
+                 progress=lambda done, total: print(f"\r{done}/{total} documents", end='', file=sys.stderr))
+        print(f"\ngenerated in {time.perf_counter() - started:.1f}s: {volumes(db)}", file=sys.stderr)
+        return 0
+
+    report = {
+        'meta': {'at': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                 'sqlite': sqlite3.sqlite_version, 'machine': platform.machine(), 'cpus': os.cpu_count(),
+                 'volumes': volumes(db)},
+        'results': run(db, args.only, args.repeat_scale),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    for name, result in report['results'].items():
+        line = result.get('skipped') or f"median {result['median_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms"
+        print(f"{name:<28} {line}", file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report['results'], json.load(f), args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.3f} ms -> {after:.3f} ms", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import functools
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Tables whose generation counters (rows in cache_versions, bumped by triggers on every
+# write from any process) cached results can depend on
+TABLES = ('customers', 'items', 'documents', 'document_lines', 'document_taxes', 'payments')
+CACHE_BUDGET = int(float(os.environ.get('SALES_ERP_CACHE_MB', 64)) * 1024 * 1024)
+
+
+def _footprint(value):
+    # Rough bytes held by a cached result; strings are counted, so this walks them once on
+    # the way in rather than on every hit
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_footprint(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_footprint(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    # Process-wide LRU of query results, shared by every session. An entry remembers the
+    # generations of the tables it was read from and is only served while they are
+    # unchanged; generations are read before the query runs, so a write that lands
+    # during the load makes the entry stale rather than wrong. Cached values are shared:
+    # callers must not modify them.
+    def __init__(self, db, budget=CACHE_BUDGET):
+        self.db = db
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def generations(self):
+        with self.db.read() as conn:
+            return dict(conn.execute("SELECT name, version FROM cache_versions").fetchall())
+
+    def get(self, key, tables, load):
+        current = self.generations()
+        versions = tuple(current.get(table) for table in tables)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = load()
+        size = _footprint(value)
+        if size > self.budget // 4:
+            return value
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._entries[key] = (versions, value, size)
+            self.bytes += size
+            while self.bytes > self.budget:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'budget': self.budget,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def cached(*tables):
+    # For repository methods: the result is keyed by method and arguments and depends on
+    # `tables`
+    def decorate(func):
+        name = func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            return self.cache.get(key, tables, lambda: func(self, *args, **kwargs))
+        return wrapper
+    return decorate
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db):
+    with _caches_lock:
+        if db.path not in _caches:
+            _caches[db.path] = ResultCache(db)
+        return _caches[db.path]
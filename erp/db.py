@@ -0,0 +1,147 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+import numpy
+
+from erp.metrics import TimedConnection
+
+DB_PATH = os.environ.get('SALES_ERP_DB', 'sales_erp.db')
+
+# Applied to every connection; journal_mode is persistent and set once by the writer
+PRAGMAS = {
+    'busy_timeout': 30000,
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+
+# Ids read back through pandas are numpy scalars; without these sqlite3 binds them as
+# 8-byte BLOBs, which then never compare equal to an INTEGER id
+for _type in (numpy.int64, numpy.int32):
+    sqlite3.register_adapter(_type, int)
+sqlite3.register_adapter(numpy.bool_, bool)
+# Money is computed in Decimal (erp.tax) and stored, already rounded to paise, as REAL
+sqlite3.register_adapter(Decimal, float)
+
+
+class Database:
+    def __init__(self, path=DB_PATH, readers=8, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self.max_readers = readers
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        # name -> path of database files ATTACHed to every connection (see attach())
+        self.attachments = {}
+        self._writer = None
+        self._open_writer().execute("PRAGMA journal_mode=WAL")
+
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, factory=TimedConnection)
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        if readonly:
+            conn.execute("PRAGMA query_only=1")
+        conn.attached = set()
+        return conn
+
+    def _open_writer(self):
+        # With the write lock held; connections are reopened on demand after close()
+        if self._writer is None:
+            self._writer = self._connect()
+            self._attach(self._writer)
+        return self._writer
+
+    def _attach(self, conn):
+        for name, path in list(self.attachments.items()):
+            if name not in conn.attached:
+                conn.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+                conn.attached.add(name)
+
+    def attach(self, name, path):
+        # From now on `name.<table>` can be queried on every connection; pooled readers pick
+        # it up the next time they are handed out
+        with self._write_lock:
+            self.attachments[name] = path
+            self._attach(self._open_writer())
+
+    def _acquire_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._reader_lock:
+            if self._reader_count < self.max_readers:
+                self._reader_count += 1
+                return self._connect(readonly=True)
+        return self._readers.get(timeout=self.timeout)
+
+    @contextmanager
+    def read(self):
+        conn = self._acquire_reader()
+        try:
+            if len(conn.attached) != len(self.attachments):
+                self._attach(conn)
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def write(self):
+        # Single serialized writer; nested write() blocks join the outer transaction
+        with self._write_lock:
+            self._write_depth += 1
+            conn = self._open_writer()
+            try:
+                yield conn
+                if self._write_depth == 1:
+                    conn.commit()
+            except BaseException:
+                if self._write_depth == 1:
+                    conn.rollback()
+                raise
+            finally:
+                self._write_depth -= 1
+
+    def close(self):
+        # Closes the writer and every idle reader (readers in use are kept and pooled again
+        # when handed back); the Database stays usable and reconnects on the next call
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._reader_lock:
+                self._reader_count -= 1
+
+    @property
+    def is_open(self):
+        return self._writer is not None or self._reader_count > 0
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_db(path=DB_PATH):
+    # One Database per file per process, shared by every Streamlit session
+    with _instances_lock:
+        if path not in _instances:
+            _instances[path] = Database(path)
+        return _instances[path]
@@ -0,0 +1,100 @@
+import csv
+import os
+import tempfile
+import time
+from contextlib import suppress
+from datetime import datetime
+
+from erp.archive import source
+
+EXPORT_DIR = os.environ.get('SALES_ERP_EXPORTS', 'exports')
+CHUNK_SIZE = 5000
+FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+# table -> (filter applied to every export, column used for the optional date range)
+TABLES = {
+    'customers': ("status!='deleted'", 'created_at'),
+    'items': ("status!='deleted'", 'created_at'),
+    'documents': ("status!='deleted'", 'doc_date'),
+    'payments': (None, 'payment_date'),
+}
+
+
+def new_export_path(name, ext, export_dir=EXPORT_DIR, max_age=6 * 3600):
+    # Exports are written to disk and served from there; old ones are swept on the way in.
+    # Sessions share the process, so the file is created here under a name no other call
+    # gets, and a file another session's sweep got to first is skipped.
+    os.makedirs(export_dir, exist_ok=True)
+    cutoff = time.time() - max_age
+    for entry in os.scandir(export_dir):
+        with suppress(FileNotFoundError):
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+    fd, path = tempfile.mkstemp(suffix=f".{ext}", prefix=f"{name}-{datetime.now():%Y%m%d-%H%M%S}-", dir=export_dir)
+    os.close(fd)
+    return path
+
+
+def table_columns(conn, table):
+    return [(row[1], (row[2] or '').upper()) for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _chunks(cursor, chunksize):
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            return
+        yield rows
+
+
+def _write_csv(path, columns, chunks):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(rows)
+
+
+def _write_parquet(path, columns, types, chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {'INTEGER': pa.int64(), 'REAL': pa.float64()}
+    schema = pa.schema([(col, arrow_types.get(types[col], pa.string())) for col in columns])
+    # One row group per chunk, so only a single chunk is ever held in memory
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for rows in chunks:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+def export_table(db, table, fmt='csv', columns=None, date_from=None, date_to=None, chunksize=CHUNK_SIZE):
+    # Reads through a cursor in fixed-size chunks and appends each one to a file on disk;
+    # returns the file's path
+    base_filter, date_column = TABLES[table]
+    with db.read() as conn:
+        types = dict(table_columns(conn, table))
+        columns = [col for col in (columns or types) if col in types]
+        # Non-numeric columns are cast so loosely-typed SQLite values fit one Parquet type
+        select = ', '.join(col if types[col] in ('INTEGER', 'REAL') else f"CAST({col} AS TEXT) AS {col}"
+                           for col in columns)
+        where, params = [base_filter] if base_filter else [], []
+        if date_from:
+            where.append(f"{date_column} >= ?")
+            params.append(str(date_from))
+        if date_to:
+            # created_at is a timestamp, so compare against the end of the day
+            where.append(f"{date_column} < date(?, '+1 day')")
+            params.append(str(date_to))
+        # Archived documents and payments are included
+        query = f"SELECT {select} FROM {source(conn, table)}"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY id"
+        chunks = _chunks(conn.execute(query, params), chunksize)
+        path = new_export_path(table, fmt)
+        if fmt == 'parquet':
+            _write_parquet(path, columns, types, chunks)
+        else:
+            _write_csv(path, columns, chunks)
+    return path
@@ -0,0 +1,79 @@
+import pandas as pd
+
+CHUNK_SIZE = 20000
+MAX_REPORTED_ROWS = 1000
+STATUSES = ('active', 'inactive')
+GSTIN_PATTERN = r'^\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]$'
+
+# table -> (insertable columns, columns the CSV must have)
+TABLES = {
+    'customers': (['name', 'contact_person', 'address', 'phone', 'gstin', 'email', 'status'], ['name']),
+    'items': (['name', 'description', 'hsn_code', 'price', 'status'], ['name', 'price']),
+}
+
+
+def _validate(chunk, table, existing):
+    # Returns the per-row rejection reason ('' when the row is fine); every check is a
+    # column operation over the whole chunk
+    reason = pd.Series('', index=chunk.index)
+
+    def reject(mask, why):
+        reason[mask & (reason == '')] = why
+
+    names = chunk['name'].str.strip()
+    keys = names.str.lower()
+    reject(names == '', 'missing name')
+    reject(~chunk['status'].isin(STATUSES), 'invalid status')
+    if table == 'customers':
+        gstin = chunk['gstin']
+        reject((gstin != '') & ~gstin.str.match(GSTIN_PATTERN), 'invalid GSTIN')
+    else:
+        price = pd.to_numeric(chunk['price'], errors='coerce')
+        reject(price.isna(), 'invalid price')
+        reject(price <= 0, 'price must be positive')
+    reject(keys.isin(existing), 'name already exists')
+    reject(keys.duplicated(), 'duplicate name in file')
+    return reason
+
+
+def import_csv(db, source, table, chunksize=CHUNK_SIZE):
+    # Streams the file in chunks and inserts every accepted row with executemany in a single
+    # transaction, so a failed import leaves nothing behind
+    columns, required = TABLES[table]
+    report = {'accepted': 0, 'rejected': 0, 'reasons': {}, 'rejected_rows': []}
+    with db.write() as conn:
+        existing = {row[0] for row in conn.execute(f"SELECT lower(trim(name)) FROM {table} WHERE status!='deleted'")}
+        reader = pd.read_csv(source, chunksize=chunksize, dtype=str, keep_default_na=False)
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.strip().str.lower()
+            missing = [col for col in required if col not in chunk.columns]
+            if missing:
+                raise ValueError(f"CSV is missing required column(s): {', '.join(missing)}")
+            chunk = chunk.reindex(columns=columns, fill_value='')
+            chunk = chunk.apply(lambda col: col.str.strip())
+            chunk['status'] = chunk['status'].str.lower().replace('', 'active')
+            if table == 'customers':
+                chunk['gstin'] = chunk['gstin'].str.upper()
+
+            reason = _validate(chunk, table, existing)
+            ok = reason == ''
+            accepted = chunk[ok]
+            if table == 'items':
+                accepted = accepted.assign(price=pd.to_numeric(accepted['price']))
+            rows = accepted.astype(object).where(accepted != '', None).itertuples(index=False, name=None)
+            conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+            existing.update(accepted['name'].str.lower())
+
+            report['accepted'] += int(ok.sum())
+            report['rejected'] += int((~ok).sum())
+            for why, count in reason[~ok].value_counts().items():
+                report['reasons'][why] = report['reasons'].get(why, 0) + int(count)
+            room = MAX_REPORTED_ROWS - sum(len(part) for part in report['rejected_rows'])
+            if room > 0 and not ok.all():
+                # +2: 1-based and the header line, so it matches the line in the file
+                rejected = chunk.loc[~ok, ['name']].assign(line=chunk.index[~ok] + 2, reason=reason[~ok])
+                report['rejected_rows'].append(rejected.head(room))
+    parts = report['rejected_rows']
+    report['rejected_rows'] = (pd.concat(parts)[['line', 'name', 'reason']] if parts
+                               else pd.DataFrame(columns=['line', 'name', 'reason']))
+    return report
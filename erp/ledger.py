@@ -0,0 +1,42 @@
+import pandas as pd
+
+# (label, first day overdue, last day overdue or None)
+AGING_BUCKETS = [('0-30', 0, 30), ('31-60', 31, 60), ('61-90', 61, 90), ('90+', 91, None)]
+LEDGER_COLUMNS = ['debit', 'credit', 'balance']
+
+
+def invoice_balance(conn, doc_id):
+    row = conn.execute("SELECT debit, credit, balance FROM invoice_balances WHERE doc_id = ?",
+                       (doc_id,)).fetchone()
+    return dict(zip(LEDGER_COLUMNS, row or (0.0, 0.0, 0.0)))
+
+
+def customer_balance(conn, customer_id):
+    row = conn.execute("SELECT debit, credit, balance FROM customer_balances WHERE customer_id = ?",
+                       (customer_id,)).fetchone()
+    return dict(zip(LEDGER_COLUMNS, row or (0.0, 0.0, 0.0)))
+
+
+def _bucket_sums():
+    sums = []
+    for label, low, high in AGING_BUCKETS:
+        cond = f"age >= {low}" if high is None else f"age BETWEEN {low} AND {high}"
+        sums.append(f"SUM(CASE WHEN {cond} THEN balance ELSE 0 END) AS \"{label}\"")
+    return ', '.join(sums)
+
+
+def aging_report(conn, as_of=None, customer_id=None):
+    # One row per customer with an open balance, split by days since the invoice date. The
+    # WHERE matches idx_invoice_balances_open, so settled invoices are never read. Balances
+    # are today's; as_of only sets the age and leaves out invoices dated after it.
+    as_of = str(as_of or pd.Timestamp.today().date())
+    where, params = ["status = 'active' AND balance > 0.005 AND doc_date <= ?"], [as_of, as_of]
+    if customer_id:
+        where.append("customer_id = ?")
+        params.append(int(customer_id))
+    return pd.read_sql(f"""SELECT b.customer_id, COALESCE(c.name, '(no customer)') AS customer,
+                           {_bucket_sums()}, SUM(balance) AS total
+                           FROM (SELECT customer_id, balance, CAST(julianday(?) - julianday(doc_date) AS INTEGER) AS age
+                                 FROM invoice_balances WHERE {' AND '.join(where)}) b
+                           LEFT JOIN customers c ON c.id = b.customer_id
+                           GROUP BY b.customer_id ORDER BY total DESC""", conn, params=params)
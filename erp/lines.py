@@ -0,0 +1,131 @@
+import ast
+import re
+import threading
+
+import pandas as pd
+
+from erp.archive import source
+
+LINE_COLUMNS = "line_no, name, description, hsn_code, qty, price, total, tax_rate"
+
+# Older rows were saved with str(list_of_dicts); numpy 2 reprs scalars as np.float64(1.0)
+_NUMPY_SCALAR = re.compile(r"np\.\w+\(([^()]*)\)")
+
+
+def parse_items_data(items_data):
+    if not items_data:
+        return []
+    return ast.literal_eval(_NUMPY_SCALAR.sub(r"\1", items_data))
+
+
+def save_lines(conn, doc_id, items):
+    conn.executemany(f"INSERT INTO document_lines (doc_id, {LINE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     [(doc_id, n, item['name'], item.get('description', ''), item.get('hsn', ''),
+                       item['qty'], item['price'], item['total'], item.get('tax_rate'))
+                      for n, item in enumerate(items, 1)])
+
+
+def save_taxes(conn, doc_id, taxes):
+    # The per-rate breakdown from erp.tax.compute
+    conn.executemany("INSERT INTO document_taxes (doc_id, rate, taxable, cgst, sgst, igst) VALUES (?, ?, ?, ?, ?, ?)",
+                     [(doc_id, tax['rate'], tax['taxable'], tax['cgst'], tax['sgst'], tax['igst']) for tax in taxes])
+
+
+def _line_dict(name, desc, hsn, qty, price, total, tax_rate):
+    return {'name': name, 'description': desc or '', 'hsn': hsn or '',
+            'qty': int(qty) if float(qty).is_integer() else qty,
+            'price': price, 'total': total, 'tax_rate': tax_rate}
+
+
+def lines_from_frame(df):
+    # Line dicts from an edited grid (name/description/hsn/qty/price/tax_rate columns):
+    # blank rows are dropped and the rest cleaned column-wise in one go
+    df = df[df['name'].fillna('').astype(str).str.strip().ne('') & df['qty'].gt(0) & df['price'].ge(0)]
+    df = df.assign(name=df['name'].astype(str).str.strip(),
+                   description=df['description'].fillna('').astype(str),
+                   hsn=df['hsn'].fillna('').astype(str).str.strip(),
+                   tax_rate=df['tax_rate'].astype(object).where(df['tax_rate'].notna(), None))
+    return [{'name': name, 'description': desc, 'hsn': hsn,
+             'qty': int(qty) if float(qty).is_integer() else qty, 'price': price, 'tax_rate': tax_rate}
+            for name, desc, hsn, qty, price, tax_rate
+            in df[['name', 'description', 'hsn', 'qty', 'price', 'tax_rate']].itertuples(index=False)]
+
+
+def load_lines(conn, doc_id):
+    return load_lines_many(conn, [doc_id])[doc_id]
+
+
+def load_lines_many(conn, doc_ids):
+    doc_ids = list(doc_ids)
+    marks = ', '.join('?' * len(doc_ids))
+    lines = {doc_id: [] for doc_id in doc_ids}
+    for row in conn.execute(f"""SELECT doc_id, {LINE_COLUMNS} FROM {source(conn, 'document_lines')}
+                                WHERE doc_id IN ({marks}) ORDER BY doc_id, line_no""", doc_ids):
+        lines[row[0]].append(_line_dict(*row[2:]))
+    # Not backfilled yet
+    pending = [doc_id for doc_id, items in lines.items() if not items]
+    if pending:
+        marks = ', '.join('?' * len(pending))
+        query = f"SELECT id, items_data FROM {source(conn, 'documents')} WHERE id IN ({marks})"
+        for doc_id, items_data in conn.execute(query, pending):
+            lines[doc_id] = parse_items_data(items_data)
+    return lines
+
+
+def line_summary(conn, group_by='name'):
+    col = {'name': 'l.name', 'hsn': 'l.hsn_code'}[group_by]
+    return pd.read_sql(f"""SELECT {col} AS {group_by}, SUM(l.qty) AS qty, SUM(l.total) AS amount,
+                           COUNT(DISTINCT l.doc_id) AS documents
+                           FROM document_lines l JOIN documents d ON d.id = l.doc_id
+                           WHERE d.status!='deleted' GROUP BY {col} ORDER BY amount DESC""", conn)
+
+
+def _check_items(items):
+    # What save_lines can store: a list of line dicts with plain values
+    if not isinstance(items, list):
+        raise ValueError(f"expected a list of lines, got {type(items).__name__}")
+    for item in items:
+        if not isinstance(item, dict) or not {'name', 'qty', 'price', 'total'} <= item.keys():
+            raise ValueError(f"not a line: {item!r:.80}")
+        if not all(isinstance(value, (str, int, float, type(None))) for value in item.values()):
+            raise ValueError(f"unsupported value in line: {item!r:.80}")
+    return items
+
+
+def backfill_lines(db, batch_size=500):
+    # Move items_data blobs into document_lines in id order, one transaction per batch. A
+    # row that doesn't hold a list of lines is left as it is and reported in `failed`, so
+    # one bad document never stops (or rolls back) the rest.
+    last_id, migrated, failed = 0, 0, []
+    while True:
+        with db.read() as conn:
+            rows = conn.execute("""SELECT id, items_data FROM documents
+                                   WHERE id > ? AND items_data IS NOT NULL AND items_data != ''
+                                   ORDER BY id LIMIT ?""", (last_id, batch_size)).fetchall()
+        if not rows:
+            return migrated, failed
+        with db.write() as conn:
+            for doc_id, items_data in rows:
+                try:
+                    items = _check_items(parse_items_data(items_data))
+                except Exception:
+                    failed.append(doc_id)
+                    continue
+                conn.execute("DELETE FROM document_lines WHERE doc_id=?", (doc_id,))
+                save_lines(conn, doc_id, items)
+                conn.execute("UPDATE documents SET items_data=NULL WHERE id=?", (doc_id,))
+                migrated += 1
+        last_id = rows[-1][0]
+
+
+_backfills = set()
+_backfills_lock = threading.Lock()
+
+
+def start_backfill(db):
+    # Once per database per process, off the script thread
+    with _backfills_lock:
+        if db.path in _backfills:
+            return
+        _backfills.add(db.path)
+    threading.Thread(target=backfill_lines, args=(db,), name='document-lines-backfill', daemon=True).start()
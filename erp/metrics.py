@@ -0,0 +1,282 @@
+import bisect
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+# Histogram upper bounds in seconds (Prometheus' defaults plus a finer low end)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERY_SECONDS = float(os.environ.get('SALES_ERP_SLOW_QUERY_MS', 100)) / 1000
+SLOW_LOG_SIZE = 200
+MAX_STATEMENTS = 500
+METRICS_FILE = os.environ.get('SALES_ERP_METRICS_FILE')
+DUMP_INTERVAL = 15
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class Stat:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def observe(self, seconds, rows=0, nbytes=0):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+        self.bytes += nbytes
+
+    def quantile(self, q):
+        # Interpolated within the bucket holding the q-th observation, like histogram_quantile()
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = min(BUCKETS[i] if i < len(BUCKETS) else self.max, self.max)
+                return lower + (max(upper, lower) - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+
+class Registry:
+    # Process-wide: every Streamlit session, and the background threads, report here
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.statements = {}
+        self._normalized = {}
+        self.slow = deque(maxlen=SLOW_LOG_SIZE)
+
+    def observe(self, name, seconds, rows=0, nbytes=0):
+        with self._lock:
+            self.calls.setdefault(name, Stat()).observe(seconds, rows, nbytes)
+
+    def observe_sql(self, sql, seconds, rows=0):
+        key = self._normalized.get(sql)
+        if key is None:
+            key = self._normalized[sql] = _WHITESPACE.sub(' ', sql).strip()
+        sql = key
+        with self._lock:
+            stat = self.statements.get(sql)
+            if stat is None:
+                # Statements are built from a fixed set of templates, but cap them anyway
+                if len(self.statements) >= MAX_STATEMENTS:
+                    sql = '(other)'
+                    self._normalized.clear()
+                stat = self.statements.setdefault(sql, Stat())
+            stat.observe(seconds, rows)
+            if seconds >= SLOW_QUERY_SECONDS:
+                self.slow.appendleft((time.strftime('%Y-%m-%d %H:%M:%S'), round(seconds * 1000, 1), rows, sql))
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.statements.clear()
+            self.slow.clear()
+
+    def _frame(self, stats, key):
+        with self._lock:
+            rows = [(name, s.count, s.seconds * 1000, s.seconds * 1000 / s.count, s.quantile(0.5) * 1000,
+                     s.quantile(0.95) * 1000, s.max * 1000, s.rows, s.bytes)
+                    for name, s in stats.items() if s.count]
+        return pd.DataFrame(rows, columns=[key, 'calls', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms',
+                                           'rows', 'bytes']).sort_values('total_ms', ascending=False)
+
+    def calls_frame(self):
+        return self._frame(self.calls, 'name')
+
+    def statements_frame(self):
+        return self._frame(self.statements, 'sql')
+
+    def slow_frame(self):
+        with self._lock:
+            return pd.DataFrame(list(self.slow), columns=['at', 'ms', 'rows', 'sql'])
+
+    def prometheus(self):
+        lines = []
+
+        def histogram(metric, label, stats):
+            stats = [(name.replace('\\', '\\\\').replace('"', '\\"'), s) for name, s in stats]
+            lines.append(f"# TYPE {metric}_seconds histogram")
+            for tag, s in stats:
+                seen = 0
+                for bound, n in zip(BUCKETS + ('+Inf',), s.buckets):
+                    seen += n
+                    lines.append(f'{metric}_seconds_bucket{{{label}="{tag}",le="{bound}"}} {seen}')
+                lines.append(f'{metric}_seconds_sum{{{label}="{tag}"}} {s.seconds:.6f}')
+                lines.append(f'{metric}_seconds_count{{{label}="{tag}"}} {s.count}')
+            for field in ('rows', 'bytes'):
+                lines.append(f"# TYPE {metric}_{field}_total counter")
+                lines.extend(f'{metric}_{field}_total{{{label}="{tag}"}} {getattr(s, field)}' for tag, s in stats)
+
+        with self._lock:
+            calls = list(self.calls.items())
+            # Per-statement series would explode label cardinality; group by statement kind
+            kinds = {}
+            for sql, s in self.statements.items():
+                kind = kinds.setdefault(sql.split(' ', 1)[0].lower() or 'other', Stat())
+                kind.buckets = [a + b for a, b in zip(kind.buckets, s.buckets)]
+                kind.count += s.count
+                kind.seconds += s.seconds
+                kind.rows += s.rows
+            slow = len(self.slow)
+        histogram('sales_erp_call', 'name', calls)
+        histogram('sales_erp_sql', 'statement', sorted(kinds.items()))
+        lines.append("# TYPE sales_erp_slow_queries gauge")
+        lines.append(f"sales_erp_slow_queries {slow}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+
+registry = Registry()
+
+
+def _size(result):
+    # (rows, bytes) of whatever a helper returned. Frames are sized from their dtypes (strings
+    # count as a pointer): memory_usage() costs more than the page query it would be measuring
+    if isinstance(result, pd.DataFrame):
+        return len(result), len(result) * sum(dtype.itemsize for dtype in result.dtypes)
+    if isinstance(result, pd.Series):
+        return 1, len(result) * result.dtype.itemsize
+    if isinstance(result, tuple) and result and isinstance(result[0], pd.DataFrame):
+        return _size(result[0])
+    if isinstance(result, (str, bytes)):
+        return 0, len(result)
+    if isinstance(result, (list, dict)):
+        return len(result), 0
+    return 0, 0
+
+
+def timed(name=None):
+    def decorate(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            registry.observe(label, time.perf_counter() - start, *_size(result))
+            return result
+        return wrapper
+    return decorate
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Time spent in execute and every fetch is charged to the statement, and recorded once
+    # the cursor is done with it (next execute, close, or garbage collection)
+    _sql = None
+
+    def _finish(self):
+        if self._sql is not None:
+            registry.observe_sql(self._sql, self._elapsed, self._rows)
+            self._sql = None
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def _run(self, method, sql, parameters):
+        self._finish()
+        self._sql, self._elapsed, self._rows = sql, 0.0, 0
+        result = self._timed(method, sql, parameters)
+        # Writes report what they touched; for SELECT rowcount is -1 and fetches count instead
+        self._rows = max(self.rowcount, 0)
+        return result
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(super().executemany, sql, seq_of_parameters)
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._elapsed += time.perf_counter() - start
+            raise
+        self._elapsed += time.perf_counter() - start
+        self._rows += 1
+        return row
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        self._rows += row is not None
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._rows += len(rows)
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+_dumper = None
+_dumper_lock = threading.Lock()
+
+
+def start_dumper(path=METRICS_FILE, interval=DUMP_INTERVAL):
+    # Optional: with SALES_ERP_METRICS_FILE set, the registry is rewritten there in
+    # Prometheus text format every `interval` seconds (for node_exporter's textfile collector)
+    global _dumper
+    if not path:
+        return
+    with _dumper_lock:
+        if _dumper is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    registry.write_prometheus(path)
+                except OSError:
+                    pass
+
+        _dumper = threading.Thread(target=run, name='metrics-dump', daemon=True)
+        _dumper.start()
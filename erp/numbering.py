@@ -0,0 +1,82 @@
+import atexit
+import os
+import threading
+from datetime import date
+
+BLOCK_SIZE = 10
+
+
+def financial_year(doc_date=None):
+    # April to March, written the short way so numbers stay within GST's 16 characters
+    d = doc_date or date.today()
+    start = d.year if d.month >= 4 else d.year - 1
+    return f"{start % 100:02d}-{(start + 1) % 100:02d}"
+
+
+def format_number(prefix, fy, value):
+    return f"{prefix}/{fy}/{value:05d}"
+
+
+def file_name(doc_number, ext):
+    return f"{str(doc_number).replace('/', '-')}.{ext}"
+
+
+class NumberAllocator:
+    # Numbers come from per-(prefix, financial year) counters in document_counters. Each
+    # process reserves a block with one write and hands it out from memory; whatever is
+    # left of a block is given back at exit if no other process has reserved after it, so
+    # gaps only appear when processes interleave or die. block_size=1 is gapless.
+    def __init__(self, db, block_size=BLOCK_SIZE):
+        self.db = db
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}
+        self._pid = os.getpid()
+
+    def _reserve(self, prefix, fy):
+        head = format_number(prefix, fy, 0)[:-5]
+        with self.db.write() as conn:
+            # First use of a counter starts after any number already issued in that year
+            conn.execute("""INSERT OR IGNORE INTO document_counters (prefix, fiscal_year, next_value)
+                            SELECT ?, ?, COALESCE(MAX(CAST(substr(doc_number, ?) AS INTEGER)), 0) + 1
+                            FROM documents WHERE doc_number GLOB ?""",
+                         (prefix, fy, len(head) + 1, head + '[0-9]*'))
+            end = conn.execute("""UPDATE document_counters SET next_value = next_value + ?
+                                  WHERE prefix = ? AND fiscal_year = ? RETURNING next_value""",
+                               (self.block_size, prefix, fy)).fetchone()[0]
+        return [end - self.block_size, end]
+
+    def next_number(self, prefix, doc_date=None):
+        fy = financial_year(doc_date)
+        with self._lock:
+            block = self._blocks.get((prefix, fy))
+            if not block or block[0] >= block[1]:
+                block = self._blocks[(prefix, fy)] = self._reserve(prefix, fy)
+            value = block[0]
+            block[0] += 1
+        return format_number(prefix, fy, value)
+
+    def release(self):
+        # A forked child (the PDF pool) inherits the blocks but must never give them back
+        if os.getpid() != self._pid:
+            return
+        with self._lock:
+            blocks, self._blocks = self._blocks, {}
+        with self.db.write() as conn:
+            for (prefix, fy), (start, end) in blocks.items():
+                if start < end:
+                    conn.execute("""UPDATE document_counters SET next_value = ?
+                                    WHERE prefix = ? AND fiscal_year = ? AND next_value = ?""",
+                                 (start, prefix, fy, end))
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_allocator(db):
+    with _allocators_lock:
+        if db.path not in _allocators:
+            _allocators[db.path] = NumberAllocator(db)
+            atexit.register(_allocators[db.path].release)
+        return _allocators[db.path]
@@ -0,0 +1,31 @@
+import pandas as pd
+
+PAGE_SIZE = 50
+
+
+def keyset_page(conn, table, columns, sort_col='created_at', where=None, params=(),
+                cursor=None, limit=PAGE_SIZE, descending=True):
+    # Seek past the (sort_col, id) of the previous page's last row instead of using
+    # OFFSET, so every page is one index range read no matter how deep it is
+    columns = list(columns)
+    for col in ('id', sort_col):
+        if col not in columns:
+            columns.append(col)
+    clauses = [where] if where else []
+    params = list(params)
+    if cursor is not None:
+        clauses.append(f"({sort_col}, id) {'<' if descending else '>'} (?, ?)")
+        params.extend(cursor)
+    direction = 'DESC' if descending else 'ASC'
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if clauses:
+        query += " WHERE " + " AND ".join(f"({c})" for c in clauses)
+    query += f" ORDER BY {sort_col} {direction}, id {direction} LIMIT ?"
+    params.append(limit + 1)
+    df = pd.read_sql(query, conn, params=params)
+    next_cursor = None
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        key = df.iloc[-1][sort_col]
+        next_cursor = (key.item() if hasattr(key, 'item') else key, int(df.iloc[-1]['id']))
+    return df, next_cursor
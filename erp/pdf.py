@@ -0,0 +1,184 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from contextlib import suppress
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from erp.assets import BASE_URL, url_fetcher
+from erp.metrics import registry
+
+PDF_STORE = os.environ.get('SALES_ERP_PDF_STORE', 'pdf_store')
+# A failed job is reported for this many seconds (so every rerun doesn't retry a broken
+# install), then dropped and rendered again on the next submit
+RETRY_AFTER = 30
+# Every edit or reprint with new content is a new file, so files not written for this long
+# are removed (at most once per SWEEP_EVERY seconds); a later download just renders again
+MAX_AGE = float(os.environ.get('SALES_ERP_PDF_MAX_AGE_DAYS', 30)) * 86400
+SWEEP_EVERY = 3600
+
+
+def store_path(doc_number, html, store=PDF_STORE):
+    # Content-addressed: any change to the rendered HTML is a new revision of the document
+    revision = hashlib.sha256(html.encode('utf-8')).hexdigest()[:16]
+    folder = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in doc_number)
+    return os.path.join(store, folder, f"{revision}.pdf")
+
+
+def sweep_store(store=PDF_STORE, max_age=MAX_AGE):
+    # Same idea as the export sweep, one level deeper; another process sweeping at the
+    # same time may get to a file first
+    cutoff = time.time() - max_age
+    if not os.path.isdir(store):
+        return
+    for folder in os.scandir(store):
+        with suppress(FileNotFoundError, NotADirectoryError):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                with suppress(FileNotFoundError):
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+        with suppress(OSError):
+            os.rmdir(folder.path)  # only succeeds once the folder is empty
+
+
+def render_pdf(html):
+    from weasyprint import HTML
+    return HTML(string=html, base_url=BASE_URL, url_fetcher=url_fetcher).write_pdf()
+
+
+def _render_to_store(html, path):
+    # Runs in a worker process; writes via a temp file so readers never see a partial PDF.
+    # Returns the render time and size, which the parent records (the worker's own
+    # metrics registry is never read).
+    start = time.perf_counter()
+    pdf = render_pdf(html)
+    seconds = time.perf_counter() - start
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(pdf)
+    os.replace(tmp, path)
+    return seconds, len(pdf)
+
+
+def _failed(job):
+    return job.cancelled() or job.exception() is not None
+
+
+def _record(submitted, job):
+    # Done callback in the parent: render time as measured by the worker, and the whole
+    # job including its wait in the queue
+    if not _failed(job):
+        seconds, size = job.result()
+        registry.observe('render_pdf', seconds, 0, size)
+        registry.observe('pdf_job', time.perf_counter() - submitted)
+    else:
+        registry.observe('pdf_job_failed', time.perf_counter() - submitted)
+
+
+class PdfRenderer:
+    def __init__(self, workers=None, max_pending=32, store=PDF_STORE, retry_after=RETRY_AFTER):
+        self.workers = workers or max(1, min(4, os.cpu_count() or 1))
+        self.max_pending = max_pending
+        self.store = store
+        self.retry_after = retry_after
+        self._jobs = {}
+        self._failed_at = {}
+        self._swept = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _pool(self):
+        # Workers come from a forkserver, a fresh single-threaded process with only this
+        # module loaded: a fork of the app would inherit the server, scheduler and backfill
+        # threads and could deadlock on a lock one of them held at that moment
+        if self._executor is None:
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload([__name__])
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+        return self._executor
+
+    def _sweep(self):
+        # Under self._lock. Keeps jobs in flight and failures younger than retry_after;
+        # finished ones are on disk. A failure is timed from the first sweep that sees it,
+        # so only this method ever touches _failed_at.
+        now = time.monotonic()
+        for p, job in self._jobs.items():
+            if job.done() and _failed(job):
+                self._failed_at.setdefault(p, now)
+        self._jobs = {p: job for p, job in self._jobs.items()
+                      if not job.done() or (p in self._failed_at and now - self._failed_at[p] < self.retry_after)}
+        self._failed_at = {p: at for p, at in self._failed_at.items() if p in self._jobs}
+
+    def submit(self, doc_number, html):
+        # Returns the store path, which doubles as the job id; raises queue.Full when saturated
+        path = store_path(doc_number, html, self.store)
+        with self._lock:
+            self._sweep()
+            if time.monotonic() - self._swept > SWEEP_EVERY:
+                self._swept = time.monotonic()
+                threading.Thread(target=sweep_store, args=(self.store,), name='pdf-store-sweep', daemon=True).start()
+            # Finished, in flight, or recently failed
+            if os.path.exists(path) or path in self._jobs:
+                return path
+            if sum(1 for job in self._jobs.values() if not job.done()) >= self.max_pending:
+                raise queue.Full
+            submitted = time.perf_counter()
+            try:
+                job = self._pool().submit(_render_to_store, html, path)
+            except BrokenProcessPool:
+                self._executor = None
+                job = self._pool().submit(_render_to_store, html, path)
+            job.add_done_callback(lambda job: _record(submitted, job))
+            self._jobs[path] = job
+        return path
+
+    def status(self, path):
+        if os.path.exists(path):
+            return 'done'
+        job = self._jobs.get(path)
+        if job is None:
+            return 'missing'
+        if not job.done():
+            return 'running' if job.running() else 'queued'
+        # Rendered, but the file has since been removed from the store
+        return 'failed' if _failed(job) else 'missing'
+
+    def error(self, path):
+        job = self._jobs.get(path)
+        if job is None or not job.done():
+            return None
+        return 'cancelled' if job.cancelled() else job.exception()
+
+    def wait(self, path, timeout=None):
+        job = self._jobs.get(path)
+        if job is not None:
+            job.exception(timeout)
+        return self.status(path)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = PdfRenderer()
+        return _renderer
@@ -0,0 +1,91 @@
+import functools
+import html
+import os
+import tempfile
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+from markupsafe import Markup, escape
+
+from erp.assets import store_stylesheet
+from erp.metrics import timed
+from erp.tax import derived_taxes, to_decimal
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+BYTECODE_DIR = os.path.join(tempfile.gettempdir(), 'sales_erp_templates')
+
+
+def money(value):
+    return f"₹{value:.2f}"
+
+
+def percent(value):
+    # 18 -> "18%", 2.5 -> "2.5%"
+    return f"{to_decimal(value).normalize():f}%"
+
+
+def nl2br(value):
+    return Markup('<br>').join(escape(line) for line in str(value or '').split('\n'))
+
+
+# Line rows are the only part that grows with the document, so they skip the template
+# machinery: one precompiled format per row, escaped with the stdlib, joined once
+_ROW = ('<tr><td>{}<br><small style="color:#666;">{}</small></td>'
+        '<td>{}</td><td>{}</td><td>₹{:.2f}</td><td>₹{:.2f}</td></tr>\n').format
+
+
+def render_rows(items):
+    esc = html.escape
+    return Markup(''.join([_ROW(esc(str(item['name']), False), esc(str(item['description'] or ''), False),
+                                esc(str(item['hsn'] or ''), False), esc(str(item['qty']), False),
+                                item['price'], item['total'])
+                           for item in items]))
+
+
+def _environment():
+    # Templates are compiled once per process (and the bytecode kept on disk for the next
+    # one); auto_reload is off so rendering never stats the template files
+    os.makedirs(BYTECODE_DIR, exist_ok=True)
+    env = Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=select_autoescape(['html']),
+        bytecode_cache=FileSystemBytecodeCache(BYTECODE_DIR),
+        auto_reload=False,
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+    env.filters['money'] = money
+    env.filters['nl2br'] = nl2br
+    env.filters['percent'] = percent
+    return env
+
+
+env = _environment()
+
+
+@functools.lru_cache(maxsize=None)
+def document_template(doc_type):
+    # A <doc_type>.html (e.g. purchase_order.html) extending document.html overrides the default
+    slug = str(doc_type).lower().replace(' ', '_')
+    return env.select_template([f"{slug}.html", "document.html"])
+
+
+@functools.lru_cache(maxsize=None)
+def _stylesheet_data():
+    with open(os.path.join(TEMPLATE_DIR, 'document.css'), 'rb') as f:
+        return f.read()
+
+
+def stylesheet_url():
+    # Shared by every document and served from the asset store like the logo; the URL
+    # carries the content hash, so a changed stylesheet also changes the PDF store key
+    return store_stylesheet(_stylesheet_data())
+
+
+@timed()
+def render_document(doc_type, items, taxes=None, **context):
+    # taxes: the per-rate breakdown from erp.tax; without one, a single group is derived
+    # from the document's tax totals
+    if taxes is None:
+        taxes = derived_taxes(context.get('subtotal'), context.get('cgst'), context.get('sgst'), context.get('igst'))
+    return document_template(doc_type).render(doc_type=doc_type, items=items, rows=render_rows(items),
+                                              taxes=taxes, stylesheet=stylesheet_url(), **context)
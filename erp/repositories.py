@@ -0,0 +1,268 @@
+from datetime import date
+
+import pandas as pd
+
+from erp.archive import source
+from erp.cache import cached, get_cache
+from erp.ledger import aging_report, customer_balance, invoice_balance
+from erp.lines import line_summary, load_lines, save_lines, save_taxes
+from erp.metrics import timed
+from erp.pagination import PAGE_SIZE, keyset_page
+from erp.search import search
+
+# Only the columns the list views show, so pages never drag items_data along
+CUSTOMER_LIST_COLUMNS = ['id', 'name', 'contact_person', 'address', 'phone', 'gstin', 'email', 'status', 'created_at']
+ITEM_LIST_COLUMNS = ['id', 'name', 'description', 'hsn_code', 'price', 'status', 'created_at']
+DOCUMENT_LIST_COLUMNS = ['id', 'doc_type', 'doc_number', 'doc_date', 'customer_name', 'total', 'status', 'created_by', 'created_at']
+PAYMENT_LIST_COLUMNS = ['id', 'doc_id', 'doc_number', 'transaction_type', 'amount', 'payment_mode', 'payment_date', 'remarks', 'created_at']
+
+
+class Repository:
+    table = None
+
+    def __init__(self, db):
+        self.db = db
+        self.cache = get_cache(db)
+
+    def _get(self, record_id):
+        with self.db.read() as conn:
+            rows = pd.read_sql(f"SELECT * FROM {source(conn, self.table)} WHERE id=?", conn, params=(int(record_id),))
+        return rows.iloc[0] if not rows.empty else None
+
+    def _search(self, text='', doc_type=None, archived=False):
+        with self.db.read() as conn:
+            return search(conn, self.table, text, doc_type=doc_type, archived=archived)
+
+
+class CustomerRepository(Repository):
+    table = 'customers'
+
+    @timed()
+    @cached('customers')
+    def get(self, customer_id):
+        return self._get(customer_id)
+
+    @timed()
+    @cached('customers')
+    def search(self, text=''):
+        return self._search(text)
+
+    @timed()
+    @cached('customers')
+    def page(self, status='active', cursor=None, limit=PAGE_SIZE):
+        with self.db.read() as conn:
+            return keyset_page(conn, 'customers', CUSTOMER_LIST_COLUMNS, 'name', "status=?", (status,),
+                               cursor, limit, descending=False)
+
+    @timed()
+    def create(self, name, contact, address, phone, gstin, email):
+        with self.db.write() as conn:
+            return conn.execute("INSERT INTO customers (name, contact_person, address, phone, gstin, email) VALUES (?, ?, ?, ?, ?, ?)",
+                                (name, contact, address, phone, gstin, email)).lastrowid
+
+    @timed()
+    def update(self, customer_id, name, contact, address, phone, gstin, email, status):
+        with self.db.write() as conn:
+            conn.execute("UPDATE customers SET name=?, contact_person=?, address=?, phone=?, gstin=?, email=?, status=? WHERE id=?",
+                         (name, contact, address, phone, gstin, email, status, customer_id))
+
+    @timed()
+    @cached('documents', 'payments')
+    def balance(self, customer_id):
+        with self.db.read() as conn:
+            return customer_balance(conn, customer_id)
+
+
+class ItemRepository(Repository):
+    table = 'items'
+
+    @timed()
+    @cached('items')
+    def get(self, item_id):
+        return self._get(item_id)
+
+    @timed()
+    @cached('items')
+    def search(self, text=''):
+        return self._search(text)
+
+    @timed()
+    @cached('items')
+    def page(self, status='active', cursor=None, limit=PAGE_SIZE):
+        with self.db.read() as conn:
+            return keyset_page(conn, 'items', ITEM_LIST_COLUMNS, 'name', "status=?", (status,),
+                               cursor, limit, descending=False)
+
+    @timed()
+    def create(self, name, desc, hsn, price):
+        with self.db.write() as conn:
+            return conn.execute("INSERT INTO items (name, description, hsn_code, price) VALUES (?, ?, ?, ?)",
+                                (name, desc, hsn, price)).lastrowid
+
+    @timed()
+    def update(self, item_id, name, desc, hsn, price, status):
+        with self.db.write() as conn:
+            conn.execute("UPDATE items SET name=?, description=?, hsn_code=?, price=?, status=? WHERE id=?",
+                         (name, desc, hsn, price, status, item_id))
+
+
+class DocumentRepository(Repository):
+    table = 'documents'
+
+    @timed()
+    @cached('documents')
+    def get(self, doc_id):
+        return self._get(doc_id)
+
+    @timed()
+    @cached('documents')
+    def search(self, text='', doc_type=None, archived=False):
+        return self._search(text, doc_type, archived)
+
+    @timed()
+    @cached('documents')
+    def page(self, doc_type=None, cursor=None, limit=PAGE_SIZE, archived=False):
+        # Live documents only, unless `archived`: reading through to the archive sorts the
+        # union, so it's slower and only done when asked for
+        where = "status!='deleted'"
+        params = ()
+        if doc_type:
+            where += " AND doc_type=?"
+            params = (doc_type,)
+        with self.db.read() as conn:
+            table = source(conn, 'documents') if archived else 'documents'
+            return keyset_page(conn, table, DOCUMENT_LIST_COLUMNS, 'created_at', where, params, cursor, limit)
+
+    @timed()
+    def is_archived(self, doc_id):
+        # Archived documents are read-only: status changes only ever touch main
+        with self.db.read() as conn:
+            return conn.execute("SELECT 1 FROM main.documents WHERE id=?", (int(doc_id),)).fetchone() is None
+
+    @timed()
+    def create(self, doc_type, doc_number, doc_date, customer_id, customer_name, customer_contact,
+               customer_address, customer_phone, customer_gstin, items, subtotal,
+               cgst, sgst, igst, total, terms, created_by, taxes=()):
+        with self.db.write() as conn:
+            c = conn.execute("""INSERT INTO documents (doc_type, doc_number, doc_date, customer_id, customer_name,
+                             customer_contact, customer_address, customer_phone, customer_gstin,
+                             subtotal, cgst, sgst, igst, total, terms_conditions, created_by)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (doc_type, doc_number, doc_date, customer_id, customer_name, customer_contact,
+                              customer_address, customer_phone, customer_gstin, subtotal,
+                              cgst, sgst, igst, total, terms, created_by))
+            save_lines(conn, c.lastrowid, items)
+            save_taxes(conn, c.lastrowid, taxes)
+            return c.lastrowid
+
+    @timed()
+    def numbers(self, doc_ids):
+        # {id: doc_number} for the ids that exist and aren't deleted
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        if not doc_ids:
+            return {}
+        with self.db.read() as conn:
+            return dict(conn.execute(f"SELECT id, doc_number FROM documents WHERE status!='deleted' "
+                                     f"AND id IN ({', '.join('?' * len(doc_ids))})", doc_ids).fetchall())
+
+    @timed()
+    def active_invoices(self, doc_ids):
+        # The ids among doc_ids that are active invoices, the only documents payments apply to
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        if not doc_ids:
+            return set()
+        with self.db.read() as conn:
+            return {row[0] for row in conn.execute(
+                f"SELECT id FROM documents WHERE doc_type='Invoice' AND status='active' "
+                f"AND id IN ({', '.join('?' * len(doc_ids))})", doc_ids)}
+
+    @timed()
+    @cached('documents', 'document_lines')
+    def lines(self, doc_id):
+        with self.db.read() as conn:
+            return load_lines(conn, doc_id)
+
+    @timed()
+    @cached('document_taxes')
+    def taxes(self, doc_id):
+        # The per-rate breakdown stored when the document was issued; [] for untaxed documents
+        with self.db.read() as conn:
+            c = conn.execute(f"SELECT rate, taxable, cgst, sgst, igst FROM {source(conn, 'document_taxes')} "
+                             f"WHERE doc_id=? ORDER BY rate", (int(doc_id),))
+            return [dict(zip(('rate', 'taxable', 'cgst', 'sgst', 'igst'), row)) for row in c.fetchall()]
+
+    @timed()
+    @cached('documents', 'document_taxes')
+    def tax_summary(self, doc_type='Invoice'):
+        # Taxable value and tax by rate over live documents, straight from the stored breakdowns
+        with self.db.read() as conn:
+            return pd.read_sql("""SELECT t.rate, COUNT(*) AS documents, SUM(t.taxable) AS taxable,
+                                  SUM(t.cgst) AS cgst, SUM(t.sgst) AS sgst, SUM(t.igst) AS igst
+                                  FROM document_taxes t JOIN documents d ON d.id = t.doc_id
+                                  WHERE d.status = 'active' AND d.doc_type = ?
+                                  GROUP BY t.rate ORDER BY t.rate""", conn, params=(doc_type,))
+
+    @timed()
+    @cached('documents', 'document_lines')
+    def line_summary(self, group_by='name'):
+        with self.db.read() as conn:
+            return line_summary(conn, group_by)
+
+    @timed()
+    def set_status(self, doc_id, status):
+        with self.db.write() as conn:
+            conn.execute("UPDATE documents SET status=?, modified_at=CURRENT_TIMESTAMP WHERE id=?",
+                         (status, doc_id))
+
+    @timed()
+    def delete(self, doc_id):
+        with self.db.write() as conn:
+            conn.execute("UPDATE documents SET status='deleted' WHERE id=?", (doc_id,))
+
+    @timed()
+    @cached('documents', 'payments')
+    def balance(self, doc_id):
+        with self.db.read() as conn:
+            return invoice_balance(conn, doc_id)
+
+
+class PaymentRepository(Repository):
+    table = 'payments'
+
+    @timed()
+    @cached('payments')
+    def page(self, cursor=None, limit=PAGE_SIZE, archived=False):
+        with self.db.read() as conn:
+            table = source(conn, 'payments') if archived else 'payments'
+            return keyset_page(conn, table, PAYMENT_LIST_COLUMNS, 'payment_date', cursor=cursor, limit=limit)
+
+    @timed()
+    def create(self, doc_id, doc_number, trans_type, amount, mode, pay_date, remarks):
+        with self.db.write() as conn:
+            return conn.execute("""INSERT INTO payments (doc_id, doc_number, transaction_type, amount,
+                                payment_mode, payment_date, remarks) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                (doc_id, doc_number, trans_type, amount, mode, pay_date, remarks)).lastrowid
+
+    @timed()
+    def aging(self, as_of=None, customer_id=None):
+        # Ages move with the calendar, so the date is part of the cache key
+        return self._aging(as_of or date.today(), customer_id)
+
+    @cached('customers', 'documents', 'payments')
+    def _aging(self, as_of, customer_id):
+        with self.db.read() as conn:
+            return aging_report(conn, as_of, customer_id)
+
+
+class DashboardRepository(Repository):
+    table = 'dashboard_summary'
+
+    @timed()
+    def summary(self):
+        with self.db.read() as conn:
+            c = conn.execute("SELECT * FROM dashboard_summary WHERE id = 1")
+            return dict(zip([col[0] for col in c.description], c.fetchone()))
+
+    def payment_totals(self):
+        summary = self.summary()
+        return summary['total_debit'], summary['total_credit']
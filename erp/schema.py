@@ -0,0 +1,412 @@
+import sqlite3
+import sys
+
+from erp.assets import migrate_inline_logo
+from erp.cache import TABLES as CACHED_TABLES
+from erp.db import get_db
+
+# dashboard_summary is kept current by applying each row change as a delta;
+# "x IS y" is used instead of "=" so NULL columns count as 0 rather than poisoning the sum
+def _summary_delta(row, sign):
+    return {
+        'customers': f"active_customers = active_customers {sign} ({row}.status IS 'active')",
+        'items': f"active_items = active_items {sign} ({row}.status IS 'active')",
+        'documents': (f"active_invoices = active_invoices {sign} ({row}.doc_type IS 'Invoice' AND {row}.status IS 'active'), "
+                      f"invoice_revenue = invoice_revenue {sign} (CASE WHEN {row}.doc_type IS 'Invoice' AND {row}.status IS 'active' "
+                      f"THEN COALESCE({row}.total, 0) ELSE 0 END)"),
+        'payments': (f"total_debit = total_debit {sign} (CASE WHEN {row}.transaction_type IS 'debit' THEN COALESCE({row}.amount, 0) ELSE 0 END), "
+                     f"total_credit = total_credit {sign} (CASE WHEN {row}.transaction_type IS 'credit' THEN COALESCE({row}.amount, 0) ELSE 0 END)"),
+    }
+
+
+# Only updates touching these columns can move the rollup
+_SUMMARY_COLUMNS = {
+    'customers': 'status',
+    'items': 'status',
+    'documents': 'doc_type, status, total',
+    'payments': 'transaction_type, amount',
+}
+
+
+def _summary_trigger(table, event):
+    rows = {'INSERT': [('NEW', '+')], 'DELETE': [('OLD', '-')], 'UPDATE': [('OLD', '-'), ('NEW', '+')]}[event]
+    body = ' '.join(f"UPDATE dashboard_summary SET {_summary_delta(row, sign)[table]} WHERE id = 1;" for row, sign in rows)
+    when = f"UPDATE OF {_SUMMARY_COLUMNS[table]}" if event == 'UPDATE' else event
+    return f"CREATE TRIGGER IF NOT EXISTS trg_summary_{table}_{event.lower()} AFTER {when} ON {table} BEGIN {body} END"
+
+
+SUMMARY_TRIGGERS = [_summary_trigger(table, event) for table in _SUMMARY_COLUMNS
+                    for event in ('INSERT', 'UPDATE', 'DELETE')]
+
+# Recomputes the rollup from scratch; also corrects any float drift in the running sums
+REBUILD_SUMMARY = """UPDATE dashboard_summary SET
+    active_customers = (SELECT COUNT(*) FROM customers WHERE status='active'),
+    active_items = (SELECT COUNT(*) FROM items WHERE status='active'),
+    active_invoices = (SELECT COUNT(*) FROM documents WHERE doc_type='Invoice' AND status='active'),
+    invoice_revenue = (SELECT COALESCE(SUM(total), 0) FROM documents WHERE doc_type='Invoice' AND status='active'),
+    total_debit = (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE transaction_type='debit'),
+    total_credit = (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE transaction_type='credit')
+    WHERE id = 1"""
+
+
+# Receivables ledger: debit/credit/balance per invoice and per customer, moved by triggers in
+# the same transaction as the payment or document write (an invoice's own total is posted as
+# a debit when it is created). Customer balances only count active invoices, so cancelling or
+# deleting one takes it out.
+def _ledger_amounts(row, sign):
+    debit = f"(CASE WHEN {row}.transaction_type IS 'debit' THEN COALESCE({row}.amount, 0) ELSE 0 END)"
+    credit = f"(CASE WHEN {row}.transaction_type IS 'credit' THEN COALESCE({row}.amount, 0) ELSE 0 END)"
+    sets = f"debit = debit {sign} {debit}, credit = credit {sign} {credit}, balance = balance {sign} ({debit} - {credit})"
+    return (f"UPDATE customer_balances SET {sets} WHERE customer_id = "
+            f"(SELECT customer_id FROM invoice_balances WHERE doc_id = {row}.doc_id AND status = 'active'); "
+            f"UPDATE invoice_balances SET {sets} WHERE doc_id = {row}.doc_id;")
+
+
+_STATUS_SIGN = "((NEW.status IS 'active') - (OLD.status IS 'active'))"
+
+
+def _invoice_column(column):
+    return f"{column} = {column} + {_STATUS_SIGN} * (SELECT {column} FROM invoice_balances WHERE doc_id = NEW.id)"
+
+
+LEDGER_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS trg_ledger_documents_insert AFTER INSERT ON documents
+    WHEN NEW.doc_type = 'Invoice' BEGIN
+        INSERT OR IGNORE INTO invoice_balances (doc_id, customer_id, doc_date, status)
+        VALUES (NEW.id, NEW.customer_id, NEW.doc_date, NEW.status);
+        INSERT OR IGNORE INTO customer_balances (customer_id) SELECT NEW.customer_id WHERE NEW.customer_id IS NOT NULL;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_ledger_documents_status AFTER UPDATE OF status ON documents
+    WHEN NEW.doc_type = 'Invoice' BEGIN
+        UPDATE customer_balances SET {', '.join(_invoice_column(col) for col in ('debit', 'credit', 'balance'))}
+        WHERE customer_id = (SELECT customer_id FROM invoice_balances WHERE doc_id = NEW.id);
+        UPDATE invoice_balances SET status = NEW.status WHERE doc_id = NEW.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_ledger_payments_insert AFTER INSERT ON payments BEGIN
+        {_ledger_amounts('NEW', '+')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_ledger_payments_delete AFTER DELETE ON payments BEGIN
+        {_ledger_amounts('OLD', '-')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_ledger_payments_update AFTER UPDATE OF doc_id, transaction_type, amount ON payments BEGIN
+        {_ledger_amounts('OLD', '-')}
+        {_ledger_amounts('NEW', '+')}
+    END""",
+]
+
+REBUILD_LEDGER = [
+    "DELETE FROM invoice_balances",
+    "DELETE FROM customer_balances",
+    """INSERT INTO invoice_balances (doc_id, customer_id, doc_date, status, debit, credit, balance)
+    SELECT d.id, d.customer_id, d.doc_date, d.status, COALESCE(SUM(p.debit), 0), COALESCE(SUM(p.credit), 0),
+           COALESCE(SUM(p.debit), 0) - COALESCE(SUM(p.credit), 0)
+    FROM documents d LEFT JOIN (
+        SELECT doc_id,
+               CASE WHEN transaction_type = 'debit' THEN COALESCE(amount, 0) ELSE 0 END AS debit,
+               CASE WHEN transaction_type = 'credit' THEN COALESCE(amount, 0) ELSE 0 END AS credit
+        FROM payments
+    ) p ON p.doc_id = d.id
+    WHERE d.doc_type = 'Invoice'
+    GROUP BY d.id""",
+    """INSERT INTO customer_balances (customer_id, debit, credit, balance)
+    SELECT customer_id, SUM(CASE WHEN status = 'active' THEN debit ELSE 0 END),
+           SUM(CASE WHEN status = 'active' THEN credit ELSE 0 END),
+           SUM(CASE WHEN status = 'active' THEN balance ELSE 0 END)
+    FROM invoice_balances WHERE customer_id IS NOT NULL GROUP BY customer_id""",
+]
+
+
+# Full-text search: one external-content FTS5 table per searchable table, so only the index
+# is stored and matches are joined back to the row by id. Prefix indexes keep typeahead
+# queries ("alp*") from walking the whole term list.
+SEARCH_INDEXES = {
+    'customers': ['name', 'gstin', 'phone'],
+    'items': ['name', 'hsn_code', 'description'],
+    'documents': ['doc_number', 'customer_name'],
+}
+
+
+def _search_statements(table, columns):
+    fts = f"{table}_fts"
+    cols = ', '.join(columns)
+    new = ', '.join(f"NEW.{col}" for col in columns)
+    old = ', '.join(f"OLD.{col}" for col in columns)
+    remove = f"INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', OLD.id, {old});"
+    add = f"INSERT INTO {fts} (rowid, {cols}) VALUES (NEW.id, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', content_rowid='id', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {table} BEGIN {add} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {table} BEGIN {remove} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {cols} ON {table} BEGIN {remove} {add} END",
+        f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')",
+    ]
+
+
+def _repair_blob_ids(conn):
+    # Foreign keys written from numpy ids before erp.db registered adapters were stored as
+    # native-endian 8-byte BLOBs
+    for table, col in (('documents', 'customer_id'), ('payments', 'doc_id')):
+        rows = conn.execute(f"SELECT id, {col} FROM {table} WHERE typeof({col})='blob'").fetchall()
+        conn.executemany(f"UPDATE {table} SET {col}=? WHERE id=?",
+                         [(int.from_bytes(value, sys.byteorder, signed=True), row_id) for row_id, value in rows])
+
+
+# Ordered (version, statements); the applied version is kept in PRAGMA user_version.
+# A statement may also be a callable, which is given the connection.
+MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            contact_person TEXT,
+            address TEXT,
+            phone TEXT,
+            gstin TEXT,
+            email TEXT,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            hsn_code TEXT,
+            price REAL NOT NULL,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doc_type TEXT NOT NULL,
+            doc_number TEXT UNIQUE NOT NULL,
+            doc_date DATE,
+            customer_id INTEGER,
+            customer_name TEXT,
+            customer_contact TEXT,
+            customer_address TEXT,
+            customer_phone TEXT,
+            customer_gstin TEXT,
+            items_data TEXT,
+            subtotal REAL,
+            cgst REAL,
+            sgst REAL,
+            igst REAL,
+            total REAL,
+            terms_conditions TEXT,
+            created_by TEXT,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            modified_at TIMESTAMP,
+            FOREIGN KEY (customer_id) REFERENCES customers (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doc_id INTEGER,
+            doc_number TEXT,
+            transaction_type TEXT,
+            amount REAL,
+            payment_mode TEXT,
+            payment_date DATE,
+            remarks TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (doc_id) REFERENCES documents (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )''',
+    ]),
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_customers_status_name ON customers (status, name)",
+        "CREATE INDEX IF NOT EXISTS idx_items_status_name ON items (status, name)",
+        "CREATE INDEX IF NOT EXISTS idx_documents_live_created ON documents (created_at) WHERE status!='deleted'",
+        "CREATE INDEX IF NOT EXISTS idx_documents_live_type_created ON documents (doc_type, created_at) WHERE status!='deleted'",
+        "CREATE INDEX IF NOT EXISTS idx_documents_type_status_total ON documents (doc_type, status, total)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_date ON payments (payment_date)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_doc ON payments (doc_id)",
+    ]),
+    (3, [
+        '''CREATE TABLE IF NOT EXISTS document_lines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doc_id INTEGER NOT NULL,
+            line_no INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            hsn_code TEXT,
+            qty REAL NOT NULL,
+            price REAL NOT NULL,
+            total REAL NOT NULL,
+            FOREIGN KEY (doc_id) REFERENCES documents (id)
+        )''',
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_document_lines_doc ON document_lines (doc_id, line_no)",
+        "CREATE INDEX IF NOT EXISTS idx_document_lines_name ON document_lines (name)",
+        "CREATE INDEX IF NOT EXISTS idx_document_lines_hsn ON document_lines (hsn_code)",
+    ]),
+    (4, [
+        # Bumped by triggers on every write so caches in any process can tell they are stale
+        '''CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )''',
+        "INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('settings', 0)",
+    ] + [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_settings_version_{event.lower()} AFTER {event} ON settings
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name='settings'; END'''
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+    (5, [
+        '''CREATE TABLE IF NOT EXISTS dashboard_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            active_customers INTEGER NOT NULL DEFAULT 0,
+            active_items INTEGER NOT NULL DEFAULT 0,
+            active_invoices INTEGER NOT NULL DEFAULT 0,
+            invoice_revenue REAL NOT NULL DEFAULT 0,
+            total_debit REAL NOT NULL DEFAULT 0,
+            total_credit REAL NOT NULL DEFAULT 0
+        )''',
+        "INSERT OR IGNORE INTO dashboard_summary (id) VALUES (1)",
+    ] + SUMMARY_TRIGGERS + [REBUILD_SUMMARY]),
+    (6, [
+        "CREATE INDEX IF NOT EXISTS idx_documents_live_date ON documents (doc_date) WHERE status!='deleted'",
+        "CREATE INDEX IF NOT EXISTS idx_documents_live_customer_date ON documents (customer_id, doc_date) WHERE status!='deleted'",
+    ]),
+    (7, [_repair_blob_ids]),
+    (8, [
+        '''CREATE TABLE IF NOT EXISTS invoice_balances (
+            doc_id INTEGER PRIMARY KEY,
+            customer_id INTEGER,
+            doc_date DATE,
+            status TEXT,
+            debit REAL NOT NULL DEFAULT 0,
+            credit REAL NOT NULL DEFAULT 0,
+            balance REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (doc_id) REFERENCES documents (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS customer_balances (
+            customer_id INTEGER PRIMARY KEY,
+            debit REAL NOT NULL DEFAULT 0,
+            credit REAL NOT NULL DEFAULT 0,
+            balance REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (customer_id) REFERENCES customers (id)
+        )''',
+        # Open invoices only: what aging reads, and it stays small as paid invoices pile up
+        "CREATE INDEX IF NOT EXISTS idx_invoice_balances_open ON invoice_balances (customer_id, doc_date, balance) "
+        "WHERE status = 'active' AND balance > 0.005",
+    ] + LEDGER_TRIGGERS + REBUILD_LEDGER),
+    (9, [sql for table, columns in SEARCH_INDEXES.items() for sql in _search_statements(table, columns)]),
+    (10, [
+        '''CREATE TABLE IF NOT EXISTS document_counters (
+            prefix TEXT NOT NULL,
+            fiscal_year TEXT NOT NULL,
+            next_value INTEGER NOT NULL,
+            PRIMARY KEY (prefix, fiscal_year)
+        ) WITHOUT ROWID''',
+    ]),
+    (11, [migrate_inline_logo]),
+    (12, [
+        # GST rate per HSN prefix (longest prefix wins), and each document's tax worked out
+        # per rate when it was issued, so reprints and reports never recompute it
+        '''CREATE TABLE IF NOT EXISTS tax_rates (
+            hsn_prefix TEXT PRIMARY KEY,
+            rate REAL NOT NULL,
+            description TEXT
+        ) WITHOUT ROWID''',
+        "INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('tax_rates', 0)",
+    ] + [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_tax_rates_version_{event.lower()} AFTER {event} ON tax_rates
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name='tax_rates'; END'''
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ] + [
+        '''CREATE TABLE IF NOT EXISTS document_taxes (
+            doc_id INTEGER NOT NULL,
+            rate REAL NOT NULL,
+            taxable REAL NOT NULL,
+            cgst REAL NOT NULL DEFAULT 0,
+            sgst REAL NOT NULL DEFAULT 0,
+            igst REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (doc_id, rate)
+        ) WITHOUT ROWID''',
+        "ALTER TABLE document_lines ADD COLUMN tax_rate REAL",
+        # Existing documents had one flat rate; record it as their only group
+        '''INSERT OR IGNORE INTO document_taxes (doc_id, rate, taxable, cgst, sgst, igst)
+        SELECT id, ROUND((COALESCE(cgst, 0) + COALESCE(sgst, 0) + COALESCE(igst, 0)) * 100 / subtotal, 2),
+               subtotal, COALESCE(cgst, 0), COALESCE(sgst, 0), COALESCE(igst, 0)
+        FROM documents WHERE subtotal > 0 AND COALESCE(cgst, 0) + COALESCE(sgst, 0) + COALESCE(igst, 0) > 0''',
+    ]),
+    # Per-table generations for erp.cache, kept the same way as the settings counter
+    (13, [f"INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('{table}', 0)" for table in CACHED_TABLES] + [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()} AFTER {event} ON {table}
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name='{table}'; END'''
+        for table in CACHED_TABLES for event in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Hot queries that must be answered from an index; checked by check_query_plans()
+HOT_QUERIES = {
+    'customers_by_status': ("SELECT * FROM customers WHERE status=? ORDER BY name", ('active',)),
+    'items_by_status': ("SELECT * FROM items WHERE status=? ORDER BY name", ('active',)),
+    'documents_live': ("SELECT * FROM documents WHERE status!='deleted' ORDER BY created_at DESC", ()),
+    'documents_live_by_type': ("SELECT * FROM documents WHERE status!='deleted' AND doc_type=? ORDER BY created_at DESC", ('Invoice',)),
+    'payments_by_date': ("SELECT * FROM payments ORDER BY payment_date DESC", ()),
+    'documents_page': ("SELECT id FROM documents WHERE (status!='deleted') AND ((created_at, id) < (?, ?)) ORDER BY created_at DESC, id DESC LIMIT 51", ('', 0)),
+    'documents_page_by_type': ("SELECT id FROM documents WHERE (status!='deleted' AND doc_type=?) AND ((created_at, id) < (?, ?)) ORDER BY created_at DESC, id DESC LIMIT 51", ('Invoice', '', 0)),
+    'payments_page': ("SELECT id FROM payments WHERE ((payment_date, id) < (?, ?)) ORDER BY payment_date DESC, id DESC LIMIT 51", ('', 0)),
+    'document_lines': ("SELECT line_no, name, description, hsn_code, qty, price, total, tax_rate FROM document_lines WHERE doc_id=? ORDER BY line_no", (1,)),
+    'document_taxes': ("SELECT rate, taxable, cgst, sgst, igst FROM document_taxes WHERE doc_id=? ORDER BY rate", (1,)),
+    'documents_by_date': ("SELECT id FROM documents WHERE status!='deleted' AND doc_date >= ? AND doc_date <= ? ORDER BY doc_date, id", ('2024-04-01', '2025-03-31')),
+    'documents_by_customer_date': ("SELECT id FROM documents WHERE status!='deleted' AND doc_date >= ? AND doc_date <= ? AND customer_id = ? ORDER BY doc_date, id", ('2024-04-01', '2025-03-31', 1)),
+    'customer_balance': ("SELECT debit, credit, balance FROM customer_balances WHERE customer_id = ?", (1,)),
+    'aging_open_invoices': ("SELECT customer_id, doc_date, balance FROM invoice_balances WHERE status = 'active' AND balance > 0.005", ()),
+    'aging_open_invoices_customer': ("SELECT customer_id, doc_date, balance FROM invoice_balances WHERE status = 'active' AND balance > 0.005 AND customer_id = ?", (1,)),
+    'search_customers': ("SELECT c.id FROM customers_fts JOIN customers c ON c.id = customers_fts.rowid "
+                         "WHERE customers_fts MATCH ? AND c.status = ? ORDER BY rank LIMIT 20", ('"alp"*', 'active')),
+    'search_items': ("SELECT i.id FROM items_fts JOIN items i ON i.id = items_fts.rowid "
+                     "WHERE items_fts MATCH ? AND i.status = ? ORDER BY rank LIMIT 20", ('"wid"*', 'active')),
+    'search_documents': ("SELECT d.id FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid "
+                         "WHERE documents_fts MATCH ? AND d.status != 'deleted' ORDER BY rank LIMIT 20", ('"inv"*',)),
+    'dashboard_summary': ("SELECT * FROM dashboard_summary WHERE id = 1", ()),
+    'dashboard_invoice_count': ("SELECT COUNT(*) FROM documents WHERE doc_type='Invoice' AND status='active'", ()),
+    'dashboard_invoice_revenue': ("SELECT COALESCE(SUM(total), 0) FROM documents WHERE doc_type='Invoice' AND status='active'", ()),
+}
+
+
+def migrate(db):
+    with db.write() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for sql in statements:
+                sql(conn) if callable(sql) else conn.execute(sql)
+            conn.execute(f"PRAGMA user_version={version}")
+        return max(current, SCHEMA_VERSION)
+
+
+def check_query_plans(conn=None, queries=None):
+    # A plain "SCAN <table>" or a temp B-tree sort means the query missed its index.
+    # Without a connection the plans are taken from a fresh, statistics-free copy of
+    # the schema so the result doesn't depend on how much data happens to be loaded.
+    if conn is None:
+        conn = sqlite3.connect(':memory:')
+        for _, statements in MIGRATIONS:
+            for sql in statements:
+                sql(conn) if callable(sql) else conn.execute(sql)
+    problems = []
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall():
+            detail = row[-1]
+            if (detail.startswith('SCAN ') and 'INDEX' not in detail) or 'TEMP B-TREE' in detail:
+                problems.append(f"{name}: {detail}")
+    return problems
+
+
+if __name__ == '__main__':
+    db = get_db(*sys.argv[1:2])
+    print(f"schema version {migrate(db)}")
+    problems = check_query_plans()
+    for problem in problems:
+        print(f"FULL SCAN {problem}")
+    sys.exit(1 if problems else 0)
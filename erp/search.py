@@ -0,0 +1,58 @@
+import re
+
+from erp.archive import SCHEMA as ARCHIVE, TABLES as ARCHIVED_TABLES
+from erp.schema import SEARCH_INDEXES
+
+SEARCH_LIMIT = 20
+
+# table -> (label shown for a hit, rows that are searchable, order used when nothing is typed)
+TARGETS = {
+    'customers': ("t.name || COALESCE(' · ' || NULLIF(t.gstin, ''), '')", "t.status = 'active'", "t.name"),
+    'items': ("t.name || COALESCE(' · HSN ' || NULLIF(t.hsn_code, ''), '')", "t.status = 'active'", "t.name"),
+    'documents': ("t.doc_number || COALESCE(' · ' || NULLIF(t.customer_name, ''), '')", "t.status != 'deleted'",
+                  "t.created_at DESC"),
+}
+
+# Same split as the unicode61 tokenizer, so "INV-4B60" matches the tokens INV and 4B60...
+_TOKEN = re.compile(r'\w+')
+
+
+def match_expression(text):
+    # Every word is a quoted prefix term, so user input can't be read as FTS5 syntax
+    tokens = _TOKEN.findall(str(text or ''))
+    return ' '.join(f'"{token}"*' for token in tokens) or None
+
+
+def _search_archive(conn, table, text, limit, where, params):
+    # The archive has no full-text index, so this is a scan: every word has to appear in
+    # one of the indexed columns. Rows still in main (an interrupted archive run) are skipped.
+    label, _, order = TARGETS[table]
+    haystack = " || ' ' || ".join(f"COALESCE(t.{col}, '')" for col in SEARCH_INDEXES[table])
+    tokens = _TOKEN.findall(str(text or ''))
+    where = where + [f"NOT EXISTS (SELECT 1 FROM main.{table} m WHERE m.id = t.id)"]
+    where += [f"{haystack} LIKE ? ESCAPE '\\'"] * len(tokens)
+    params = params + ['%' + token.replace('_', '\\_') + '%' for token in tokens]
+    query = f"SELECT t.id, {label} FROM {ARCHIVE}.{table} t WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ?"
+    return conn.execute(query, params + [int(limit)]).fetchall()
+
+
+def search(conn, table, text='', limit=SEARCH_LIMIT, doc_type=None, archived=False):
+    # Returns [(id, label)] for the best `limit` matches; with no search text, the first
+    # `limit` rows in the table's usual order. With `archived`, rows moved to the archive
+    # fill whatever the live rows leave of `limit`.
+    label, live, order = TARGETS[table]
+    where, params = [live], []
+    if doc_type:
+        where.append("t.doc_type = ?")
+        params.append(doc_type)
+    match = match_expression(text)
+    if match:
+        query = (f"SELECT t.id, {label} FROM {table}_fts f JOIN {table} t ON t.id = f.rowid "
+                 f"WHERE {table}_fts MATCH ? AND {' AND '.join(where)} ORDER BY f.rank LIMIT ?")
+        rows = conn.execute(query, [match] + params + [int(limit)]).fetchall()
+    else:
+        query = f"SELECT t.id, {label} FROM {table} t WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ?"
+        rows = conn.execute(query, params + [int(limit)]).fetchall()
+    if archived and len(rows) < limit and table in ARCHIVED_TABLES and ARCHIVE in getattr(conn, 'attached', ()):
+        rows += _search_archive(conn, table, text, limit - len(rows), where, params)
+    return rows
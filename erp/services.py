@@ -0,0 +1,154 @@
+import os
+import threading
+
+from erp.archive import Archive
+from erp.assets import asset_url
+from erp.backup import start_scheduler
+from erp.cache import get_cache
+from erp.db import DB_PATH, get_db
+from erp.lines import start_backfill
+from erp.metrics import start_dumper
+from erp.numbering import get_allocator
+from erp.render import render_document
+from erp.repositories import (CustomerRepository, DashboardRepository, DocumentRepository, ItemRepository,
+                              PaymentRepository)
+from erp.schema import migrate
+from erp.settings import get_settings
+from erp.tax import DEFAULT_RATE, compute, get_rates, to_decimal
+
+PREFIX_KEYS = {'Invoice': 'invoice_prefix', 'Quotation': 'quotation_prefix', 'Purchase Order': 'po_prefix'}
+DEFAULT_TERMS = 'Payment due within 30 days.\nGoods once sold will not be taken back.'
+
+
+class Services:
+    # Everything the views need, with no Streamlit in sight; one per database per process
+    def __init__(self, db):
+        self.db = db
+        self.settings = get_settings(db)
+        self.numbers = get_allocator(db)
+        self.rates = get_rates(db)
+        self.cache = get_cache(db)
+        self.customers = CustomerRepository(db)
+        self.items = ItemRepository(db)
+        self.documents = DocumentRepository(db)
+        self.payments = PaymentRepository(db)
+        self.dashboard = DashboardRepository(db)
+        self.archive = Archive(db)
+
+    def close(self):
+        # Gives back what an idle database holds: reserved numbers, cached results and
+        # connections. Everything reopens on the next call.
+        self.numbers.release()
+        self.cache.clear()
+        self.db.close()
+
+    def company_info(self):
+        settings = self.settings.all()
+        return {
+            'name': settings.get('company_name', 'Your Company Name'),
+            'address': settings.get('company_address', 'Company Address'),
+            'phone': settings.get('company_phone', '1234567890'),
+            'gstin': settings.get('company_gstin', '00XXXXX0000X0XX'),
+            'invoice_prefix': settings.get('invoice_prefix', 'INV'),
+            'quotation_prefix': settings.get('quotation_prefix', 'QUO'),
+            'po_prefix': settings.get('po_prefix', 'PO'),
+            'created_by': settings.get('created_by', 'Admin'),
+            'logo': asset_url(settings.get('company_logo', '')),
+            'logo_key': settings.get('company_logo', ''),
+            'terms': settings.get('general_terms', DEFAULT_TERMS),
+        }
+
+    def default_tax_rate(self):
+        return to_decimal(self.settings.get('default_gst_rate', '') or DEFAULT_RATE)
+
+    def price(self, items, interstate=False):
+        # Lines priced and taxed from the rate table; see erp.tax.compute for the result
+        return compute(items, self.rates.all(), interstate, self.default_tax_rate())
+
+    def issue_document(self, doc_type, doc_date, customer, priced, terms, company_info=None):
+        # Numbers the document, saves it with its lines and tax breakdown and, for invoices,
+        # posts the debit, all in one transaction. `customer` has name/contact/address/
+        # phone/gstin and an optional id; `priced` comes from price(). Returns (doc_id, doc_number).
+        document = dict(priced, doc_type=doc_type, doc_date=doc_date, customer=customer, terms=terms)
+        return self.issue_documents([document], company_info)[0]
+
+    def issue_documents(self, documents, company_info=None):
+        # Same as issue_document for a whole batch under a single transaction: either every
+        # document is saved or none is. Numbers are reserved first, outside it, because the
+        # allocator hands them out from memory and a rolled-back reservation would reissue them.
+        company_info = company_info or self.company_info()
+        numbers = [self.numbers.next_number(company_info.get(PREFIX_KEYS.get(doc['doc_type']), "DOC"), doc['doc_date'])
+                   for doc in documents]
+        issued = []
+        with self.db.write():
+            for doc, doc_number in zip(documents, numbers):
+                customer = doc['customer']
+                doc_id = self.documents.create(
+                    doc['doc_type'], doc_number, doc['doc_date'], customer.get('id'), customer['name'],
+                    customer.get('contact', ''), customer.get('address', ''), customer.get('phone', ''),
+                    customer.get('gstin', ''), doc['items'], doc['subtotal'], doc['cgst'], doc['sgst'], doc['igst'],
+                    doc['total'], doc['terms'], company_info['created_by'], doc.get('taxes', ())
+                )
+                if doc['doc_type'] == "Invoice":
+                    self.payments.create(doc_id, doc_number, 'debit', doc['total'], 'Invoice', doc['doc_date'],
+                                         'Invoice generated')
+                issued.append((doc_id, doc_number))
+        return issued
+
+    def record_payments(self, payments):
+        # Batch of {doc_id, transaction_type, amount, payment_mode, payment_date, remarks},
+        # all or nothing. Raises KeyError naming any document that doesn't exist, and
+        # ValueError naming any that isn't an active invoice (quotations, purchase orders,
+        # cancelled invoices carry no balance to pay against). Checked under the write lock,
+        # so a document can't be cancelled in between.
+        doc_ids = {payment['doc_id'] for payment in payments}
+        with self.db.write():
+            doc_numbers = self.documents.numbers(doc_ids)
+            missing = sorted(doc_ids - set(doc_numbers))
+            if missing:
+                raise KeyError(f"Unknown document id(s): {', '.join(map(str, missing))}")
+            not_payable = sorted(doc_ids - self.documents.active_invoices(doc_ids))
+            if not_payable:
+                raise ValueError(f"Not an active invoice: {', '.join(map(str, not_payable))}")
+            return [self.payments.create(payment['doc_id'], doc_numbers[payment['doc_id']],
+                                         payment['transaction_type'], payment['amount'], payment['payment_mode'],
+                                         payment['payment_date'], payment.get('remarks', ''))
+                    for payment in payments]
+
+    def document_html(self, doc, items=None, company_info=None, taxes=None):
+        # `doc` is a documents row; lines and the stored tax breakdown are loaded unless given
+        company_info = company_info or self.company_info()
+        if items is None:
+            items = self.documents.lines(doc['id'])
+        if taxes is None:
+            taxes = self.documents.taxes(doc['id']) or None
+        return render_document(
+            doc['doc_type'], doc_number=doc['doc_number'], doc_date=doc['doc_date'], company=company_info,
+            customer={'name': doc['customer_name'], 'contact': doc['customer_contact'],
+                      'address': doc['customer_address'], 'phone': doc['customer_phone'],
+                      'gstin': doc['customer_gstin']},
+            items=items, taxes=taxes, subtotal=doc['subtotal'], cgst=doc['cgst'], sgst=doc['sgst'], igst=doc['igst'],
+            total=doc['total'], terms=doc['terms_conditions'], general_terms=company_info['terms']
+        )
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_services(path=DB_PATH):
+    # Schema migration and the background workers run once per process, on first use,
+    # rather than once per Streamlit session
+    with _services_lock:
+        if path not in _services:
+            db = get_db(path)
+            migrate(db)
+            start_backfill(db)
+            start_dumper()
+            svc = Services(db)
+            # Read-through only once there is something archived
+            if os.path.exists(svc.archive.path):
+                svc.archive.open()
+            start_scheduler(db)
+            _services[path] = svc
+        return _services[path]
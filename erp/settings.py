@@ -0,0 +1,40 @@
+import threading
+
+
+class SettingsCache:
+    # All settings are loaded with one query and reused until the 'settings' counter in
+    # cache_versions moves, which triggers do on any write from any process
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._values = {}
+        self._version = None
+
+    def all(self):
+        with self.db.read() as conn:
+            version = conn.execute("SELECT version FROM cache_versions WHERE name='settings'").fetchone()
+            if version != self._version:
+                values = dict(conn.execute("SELECT key, value FROM settings").fetchall())
+                with self._lock:
+                    self._values, self._version = values, version
+        return self._values
+
+    def get(self, key, default=''):
+        return self.all().get(key, default)
+
+    def set_many(self, values):
+        with self.db.write() as conn:
+            conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", list(values.items()))
+        with self._lock:
+            self._version = None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_settings(db):
+    with _caches_lock:
+        if db.path not in _caches:
+            _caches[db.path] = SettingsCache(db)
+        return _caches[db.path]
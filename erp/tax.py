@@ -0,0 +1,118 @@
+import threading
+from decimal import ROUND_HALF_UP, Decimal
+
+DEFAULT_RATE = Decimal('18')
+PAISE = Decimal('0.01')
+ZERO = Decimal('0')
+
+
+def to_decimal(value):
+    # Through str() so a float like 0.1 becomes Decimal('0.1'), not its binary expansion
+    return value if isinstance(value, Decimal) else Decimal(str(value or 0))
+
+
+def round_money(value):
+    return to_decimal(value).quantize(PAISE, ROUND_HALF_UP)
+
+
+def state_code(gstin):
+    code = str(gstin or '')[:2]
+    return code if code.isdigit() and code != '00' else None
+
+
+def is_interstate(company_gstin, customer_gstin):
+    # Supply is interstate when both GSTINs carry a state code and they differ
+    ours, theirs = state_code(company_gstin), state_code(customer_gstin)
+    return bool(ours and theirs and ours != theirs)
+
+
+def lookup_rate(rates, hsn, default=DEFAULT_RATE):
+    # HSN codes are hierarchical (chapter, heading, subheading...); the longest
+    # configured prefix wins
+    code = ''.join(ch for ch in str(hsn or '') if ch.isdigit())
+    for n in range(len(code), 0, -1):
+        rate = rates.get(code[:n])
+        if rate is not None:
+            return rate
+    return default
+
+
+def compute(items, rates, interstate=False, default=DEFAULT_RATE):
+    # One pass over the lines: each is priced and assigned its rate (a line's own tax_rate
+    # wins over the table), then tax is worked out once per rate on that rate's taxable
+    # value, as the GST invoice rules have it. Amounts are Decimals rounded half-up to paise.
+    lines, taxable = [], {}
+    for item in items:
+        rate = item.get('tax_rate')
+        rate = lookup_rate(rates, item.get('hsn'), default) if rate is None else to_decimal(rate)
+        amount = round_money(to_decimal(item['qty']) * to_decimal(item['price']))
+        taxable[rate] = taxable.get(rate, ZERO) + amount
+        lines.append(dict(item, total=amount, tax_rate=rate))
+    taxes = []
+    for rate in sorted(taxable):
+        if interstate:
+            cgst = sgst = ZERO
+            igst = round_money(taxable[rate] * rate / 100)
+        else:
+            cgst = sgst = round_money(taxable[rate] * rate / 200)
+            igst = ZERO
+        taxes.append({'rate': rate, 'taxable': taxable[rate], 'cgst': cgst, 'sgst': sgst, 'igst': igst})
+    subtotal = sum(taxable.values(), ZERO)
+    cgst, sgst, igst = (sum((tax[key] for tax in taxes), ZERO) for key in ('cgst', 'sgst', 'igst'))
+    return {'items': lines, 'taxes': taxes, 'subtotal': subtotal, 'cgst': cgst, 'sgst': sgst, 'igst': igst,
+            'total': subtotal + cgst + sgst + igst}
+
+
+def derived_taxes(subtotal, cgst, sgst, igst):
+    # Breakdown for documents saved before rates were stored: one group at the overall rate
+    subtotal, tax = to_decimal(subtotal), to_decimal(cgst) + to_decimal(sgst) + to_decimal(igst)
+    if not subtotal or not tax:
+        return []
+    return [{'rate': (tax * 100 / subtotal).quantize(PAISE, ROUND_HALF_UP).normalize(), 'taxable': subtotal,
+             'cgst': to_decimal(cgst), 'sgst': to_decimal(sgst), 'igst': to_decimal(igst)}]
+
+
+class RateTable:
+    # GST rates by HSN prefix, loaded with one query and reused until the 'tax_rates'
+    # counter in cache_versions moves (same scheme as SettingsCache)
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._rates = {}
+        self._version = None
+
+    def all(self):
+        with self.db.read() as conn:
+            version = conn.execute("SELECT version FROM cache_versions WHERE name='tax_rates'").fetchone()
+            if version != self._version:
+                rates = {prefix: to_decimal(rate)
+                         for prefix, rate in conn.execute("SELECT hsn_prefix, rate FROM tax_rates").fetchall()}
+                with self._lock:
+                    self._rates, self._version = rates, version
+        return self._rates
+
+    def rows(self):
+        with self.db.read() as conn:
+            return conn.execute("SELECT hsn_prefix, rate, description FROM tax_rates ORDER BY hsn_prefix").fetchall()
+
+    def replace(self, rows):
+        # rows: (hsn_prefix, rate, description); the table is swapped wholesale
+        with self.db.write() as conn:
+            conn.execute("DELETE FROM tax_rates")
+            conn.executemany("INSERT OR REPLACE INTO tax_rates (hsn_prefix, rate, description) VALUES (?, ?, ?)",
+                             [(str(prefix).strip(), float(rate), description if isinstance(description, str) else '')
+                              for prefix, rate, description in rows
+                              if str(prefix or '').strip()])
+        with self._lock:
+            self._version = None
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_rates(db):
+    with _tables_lock:
+        if db.path not in _tables:
+            _tables[db.path] = RateTable(db)
+        return _tables[db.path]
@@ -0,0 +1,122 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from erp.db import DB_PATH
+from erp.services import get_services
+
+# One database file per company (legal entity), so each has its own settings, numbering,
+# caches and write lock, and one company's month-end doesn't queue behind another's. The
+# catalog is a small JSON file next to the company databases; the database that predates
+# it (DB_PATH) is the company with slug 'default'.
+TENANT_DIR = os.environ.get('SALES_ERP_TENANT_DIR', 'companies')
+CATALOG = 'companies.json'
+DEFAULT_TENANT = 'default'
+# Companies whose connections and result cache are kept open at the same time
+MAX_OPEN = int(os.environ.get('SALES_ERP_MAX_OPEN_COMPANIES', 4))
+
+
+def slugify(name):
+    return re.sub(r'[^a-z0-9]+', '-', str(name).lower()).strip('-') or 'company'
+
+
+class TenantRouter:
+    def __init__(self, tenant_dir=TENANT_DIR, default_path=DB_PATH, max_open=MAX_OPEN):
+        self.tenant_dir = tenant_dir
+        self.default_path = default_path
+        self.max_open = max_open
+        self.catalog_path = os.path.join(tenant_dir, CATALOG)
+        self._lock = threading.Lock()
+        self._used = OrderedDict()
+
+    def _read(self):
+        # {slug: {'name', 'db'}}; re-read on every call, so companies added by another
+        # process show up without a restart
+        try:
+            with open(self.catalog_path, encoding='utf-8') as f:
+                catalog = json.load(f)
+        except FileNotFoundError:
+            catalog = {}
+        default = catalog.pop(DEFAULT_TENANT, {})
+        return {DEFAULT_TENANT: {'name': default.get('name', 'Default Company'), 'db': self.default_path}, **catalog}
+
+    def _write(self, catalog):
+        os.makedirs(self.tenant_dir, exist_ok=True)
+        tmp = f"{self.catalog_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(catalog, f, indent=2)
+        os.replace(tmp, self.catalog_path)
+
+    def companies(self):
+        # slug -> display name, the default company first
+        return {slug: entry['name'] for slug, entry in self._read().items()}
+
+    def path(self, slug):
+        catalog = self._read()
+        if slug not in catalog:
+            raise KeyError(f"Unknown company: {slug}")
+        return catalog[slug]['db']
+
+    def add(self, name):
+        # Registers a company with a new, empty database and returns its slug. Raises
+        # ValueError if the name is blank or taken.
+        name = str(name or '').strip()
+        with self._lock:
+            catalog = self._read()
+            if not name or name.lower() in {entry['name'].lower() for entry in catalog.values()}:
+                raise ValueError(f"A company needs a name no other company has: {name!r}")
+            slug, n = slugify(name), 1
+            while slug in catalog or os.path.exists(os.path.join(self.tenant_dir, f"{slug}.db")):
+                n += 1
+                slug = f"{slugify(name)}-{n}"
+            catalog[slug] = {'name': name, 'db': os.path.join(self.tenant_dir, f"{slug}.db")}
+            self._write(catalog)
+        self.services(slug).settings.set_many({'company_name': name})
+        return slug
+
+    def rename(self, slug, name):
+        # Keeps the selector in step with the company name in its settings; a name already
+        # used by another company gets the slug appended so the two stay distinguishable
+        name = str(name or '').strip()
+        with self._lock:
+            catalog = self._read()
+            if not name or catalog[slug]['name'] == name:
+                return
+            if name.lower() in {entry['name'].lower() for other, entry in catalog.items() if other != slug}:
+                name = f"{name} ({slug})"
+            catalog[slug]['name'] = name
+            self._write(catalog)
+
+    def services(self, slug):
+        # The company's Services, opened (and migrated) on first use. Past max_open
+        # companies, the one used longest ago is closed: unused document numbers go back,
+        # its result cache is dropped and its connections are closed. The Services object
+        # stays valid and reconnects on its next query, so a session still holding it is
+        # unaffected.
+        svc = get_services(self.path(slug))
+        with self._lock:
+            # Every company used so far, least recent first; anything outside the newest
+            # max_open that has reconnected since it was last closed is closed again
+            self._used[slug] = svc
+            self._used.move_to_end(slug)
+            evicted = [old for old in list(self._used.values())[:-self.max_open] if old.db.is_open]
+        for old in evicted:
+            old.close()
+        return svc
+
+    def open_companies(self):
+        with self._lock:
+            return [slug for slug, svc in self._used.items() if svc.db.is_open]
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(tenant_dir=TENANT_DIR):
+    with _routers_lock:
+        if tenant_dir not in _routers:
+            _routers[tenant_dir] = TenantRouter(tenant_dir)
+        return _routers[tenant_dir]
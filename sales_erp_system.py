@@ -1,320 +1,250 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-from datetime import datetime, date
-import uuid
-import base64
-from io import BytesIO, StringIO
+from datetime import date
+import os
+import queue
+from collections import Counter
+from importlib.machinery import ModuleSpec
 
-# Database Setup
-def init_db():
-    conn = sqlite3.connect('sales_erp.db', check_same_thread=False)
-    c = conn.cursor()
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS customers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        contact_person TEXT,
-        address TEXT,
-        phone TEXT,
-        gstin TEXT,
-        email TEXT,
-        status TEXT DEFAULT 'active',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        description TEXT,
-        hsn_code TEXT,
-        price REAL NOT NULL,
-        status TEXT DEFAULT 'active',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS documents (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        doc_type TEXT NOT NULL,
-        doc_number TEXT UNIQUE NOT NULL,
-        doc_date DATE,
-        customer_id INTEGER,
-        customer_name TEXT,
-        customer_contact TEXT,
-        customer_address TEXT,
-        customer_phone TEXT,
-        customer_gstin TEXT,
-        items_data TEXT,
-        subtotal REAL,
-        cgst REAL,
-        sgst REAL,
-        igst REAL,
-        total REAL,
-        terms_conditions TEXT,
-        created_by TEXT,
-        status TEXT DEFAULT 'active',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        modified_at TIMESTAMP,
-        FOREIGN KEY (customer_id) REFERENCES customers (id)
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS payments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        doc_id INTEGER,
-        doc_number TEXT,
-        transaction_type TEXT,
-        amount REAL,
-        payment_mode TEXT,
-        payment_date DATE,
-        remarks TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (doc_id) REFERENCES documents (id)
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS settings (
-        key TEXT PRIMARY KEY,
-        value TEXT
-    )''')
-    
-    conn.commit()
-    return conn
+from erp.archive import KEEP_YEARS, cutoff_date
+from erp.assets import asset_path, inline_assets, store_logo
+from erp.backup import (BACKUP_DIR, BACKUP_HOURS, KEEP_DAILY, KEEP_LAST, create_snapshot, list_snapshots, rotate,
+                        scheduler_error)
+from erp.batch import export_documents_zip, select_document_ids
+from erp.exporter import FORMATS, export_table, new_export_path, table_columns
+from erp.importer import import_csv
+from erp.lines import lines_from_frame
+from erp.metrics import METRICS_FILE, SLOW_QUERY_SECONDS, registry
+from erp.numbering import file_name
+from erp.pdf import get_renderer
+from erp.render import percent, render_document
+from erp.tax import is_interstate
+from erp.tenants import get_router
 
-def get_setting(conn, key, default=''):
-    try:
-        result = pd.read_sql(f"SELECT value FROM settings WHERE key='{key}'", conn)
-        return result.iloc[0]['value'] if not result.empty else default
-    except:
-        return default
-
-def set_setting(conn, key, value):
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
-    conn.commit()
+# Streamlit runs this script as __main__, and multiprocessing would re-run it in every PDF
+# worker (erp.pdf) it starts; a spec naming the module __main__ tells it there's nothing
+# to import there
+__spec__ = ModuleSpec('__main__', None)
 
-if 'conn' not in st.session_state:
-    st.session_state.conn = init_db()
+# Repositories and settings live in erp.services and are shared by every session in this
+# process; each company's database is migrated once, on first use. This script is only the
+# view: `svc` and `db` are the selected company's (see the sidebar below).
+router = get_router()
 
-conn = st.session_state.conn
-
-# Load company info from database
-def load_company_info():
-    return {
-        'name': get_setting(conn, 'company_name', 'Your Company Name'),
-        'address': get_setting(conn, 'company_address', 'Company Address'),
-        'phone': get_setting(conn, 'company_phone', '1234567890'),
-        'gstin': get_setting(conn, 'company_gstin', '00XXXXX0000X0XX'),
-        'invoice_prefix': get_setting(conn, 'invoice_prefix', 'INV'),
-        'quotation_prefix': get_setting(conn, 'quotation_prefix', 'QUO'),
-        'po_prefix': get_setting(conn, 'po_prefix', 'PO'),
-        'created_by': get_setting(conn, 'created_by', 'Admin'),
-        'logo': get_setting(conn, 'company_logo', ''),
-        'terms': get_setting(conn, 'general_terms', 'Payment due within 30 days.\nGoods once sold will not be taken back.')
-    }
+# View helpers
+def generate_doc_html(doc_type, doc_number, doc_date, company_info, customer_info, items, taxes,
+                      subtotal, cgst, sgst, igst, total, terms, general_terms):
+    return render_document(
+        doc_type, doc_number=doc_number, doc_date=doc_date, company=company_info,
+        customer=customer_info, items=items, taxes=taxes, subtotal=subtotal, cgst=cgst, sgst=sgst,
+        igst=igst, total=total, terms=terms, general_terms=general_terms
+    )
 
-# Helper Functions
-def get_customers(status='active'):
-    return pd.read_sql(f"SELECT * FROM customers WHERE status='{status}' ORDER BY name", conn)
+def build_document_html(doc, items, company_info):
+    return svc.document_html(doc, items, company_info)
 
-def get_items(status='active'):
-    return pd.read_sql(f"SELECT * FROM items WHERE status='{status}' ORDER BY name", conn)
+def html_to_pdf_download(html_content, doc_number):
+    # Rendering happens in the worker pool; each rerun just polls the job
+    renderer = get_renderer()
+    try:
+        path = renderer.submit(doc_number, html_content)
+    except queue.Full:
+        st.warning("⏳ PDF renderer is busy, please try again in a moment.")
+        return None
+    status = renderer.status(path)
+    if status == 'done':
+        pdf = renderer.read(path)
+        st.download_button("📥 Download PDF", pdf, file_name(doc_number, "pdf"), "application/pdf",
+                           use_container_width=True, key=f"pdf_{path}")
+        return pdf
+    if status == 'failed':
+        st.error(f"❌ PDF generation failed: {renderer.error(path)}")
+        st.caption(f"Download the HTML instead, or refresh after {renderer.retry_after} seconds to try again.")
+        return None
+    st.button(f"⏳ PDF {status}... 🔄 Refresh", key=f"refresh_{path}", use_container_width=True)
+    return None
 
-def get_documents(doc_type=None):
-    query = "SELECT * FROM documents WHERE status!='deleted'"
-    if doc_type:
-        query += f" AND doc_type='{doc_type}'"
-    query += " ORDER BY created_at DESC"
-    return pd.read_sql(query, conn)
+# Line grid for Create Document; 'amount' is display only and recomputed by the tax engine
+LINE_EDITOR_CONFIG = {
+    'name': st.column_config.TextColumn("Item", required=True),
+    'description': st.column_config.TextColumn("Description"),
+    'hsn': st.column_config.TextColumn("HSN/SAC"),
+    'qty': st.column_config.NumberColumn("Qty", min_value=0.001, required=True),
+    'price': st.column_config.NumberColumn("Rate", min_value=0.0, format="%.2f", required=True),
+    'tax_rate': st.column_config.NumberColumn("GST %", min_value=0.0, max_value=100.0),
+    'amount': st.column_config.NumberColumn("Amount", format="%.2f", disabled=True),
+}
 
-def get_payments():
-    return pd.read_sql("SELECT * FROM payments ORDER BY payment_date DESC", conn)
+def line_editor_frame(priced_items):
+    # Rates the user didn't set stay blank so a changed HSN code still picks up its own rate
+    overrides = [item.get('tax_rate') for item in st.session_state.doc_items]
+    return pd.DataFrame({
+        'name': [item['name'] for item in priced_items],
+        'description': [item['description'] for item in priced_items],
+        'hsn': [item['hsn'] for item in priced_items],
+        'qty': [float(item['qty']) for item in priced_items],
+        'price': [float(item['price']) for item in priced_items],
+        'tax_rate': pd.Series([None if rate is None else float(rate) for rate in overrides], dtype='float64'),
+        'amount': [float(item['total']) for item in priced_items],
+    })
 
-def save_customer(name, contact, address, phone, gstin, email):
-    c = conn.cursor()
-    c.execute("INSERT INTO customers (name, contact_person, address, phone, gstin, email) VALUES (?, ?, ?, ?, ?, ?)",
-              (name, contact, address, phone, gstin, email))
-    conn.commit()
+def search_select(label, repo, key, all_label=None, empty_message=None, **filters):
+    # Typeahead picker: only the top matches are loaded, and the selection is the row id
+    text = st.text_input(f"🔍 Search {label}", key=f"{key}_search")
+    hits = repo.search(text, **filters)
+    if not hits and not all_label:
+        if text:
+            st.warning(f"No matches for '{text}'.")
+        elif empty_message:
+            st.info(empty_message)
+        return None
+    # Same-named rows stay distinguishable: their labels carry the id
+    counts = Counter(text for _, text in hits)
+    ids = {(f"{text} (#{row_id})" if counts[text] > 1 else text): row_id for row_id, text in hits}
+    if all_label:
+        ids = {all_label: None, **ids}
+    return ids[st.selectbox(label, list(ids), key=key)]
 
-def update_customer(cid, name, contact, address, phone, gstin, email, status):
-    c = conn.cursor()
-    c.execute("UPDATE customers SET name=?, contact_person=?, address=?, phone=?, gstin=?, email=?, status=? WHERE id=?",
-              (name, contact, address, phone, gstin, email, status, cid))
-    conn.commit()
+def show_diagnostics():
+    # Process-wide since startup: every session's DB helpers, SQL, template and PDF renders
+    st.subheader("⏱️ Calls")
+    st.dataframe(registry.calls_frame().round(2), use_container_width=True, hide_index=True)
+    st.subheader("🗄️ SQL Statements")
+    st.dataframe(registry.statements_frame().round(2), use_container_width=True, hide_index=True)
+    st.subheader(f"🐢 Slow Queries (≥ {SLOW_QUERY_SECONDS * 1000:.0f} ms)")
+    st.dataframe(registry.slow_frame(), use_container_width=True, hide_index=True)
+    st.subheader("🧠 Result Cache")
+    cache = svc.cache.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Entries", f"{cache['entries']:,}")
+    col2.metric("Memory", f"{cache['bytes'] / 2**20:.1f} / {cache['budget'] / 2**20:.0f} MB")
+    col3.metric("Hit Rate", f"{cache['hits'] / max(1, cache['hits'] + cache['misses']):.0%}")
+    col4.metric("Evictions", f"{cache['evictions']:,}")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("📥 Prometheus Metrics", registry.prometheus(), "sales_erp.prom", "text/plain")
+        if METRICS_FILE:
+            st.caption(f"Also written to {METRICS_FILE}")
+    with col2:
+        if st.button("🔄 Reset"):
+            registry.reset()
+            st.rerun()
 
-def save_item(name, desc, hsn, price):
-    c = conn.cursor()
-    c.execute("INSERT INTO items (name, description, hsn_code, price) VALUES (?, ?, ?, ?)",
-              (name, desc, hsn, price))
-    conn.commit()
+def show_companies():
+    open_now = router.open_companies()
+    st.dataframe(pd.DataFrame([{'company': name, 'id': slug, 'database': router.path(slug), 'open': slug in open_now}
+                               for slug, name in router.companies().items()]),
+                 use_container_width=True, hide_index=True)
+    st.caption(f"Each company keeps its data in its own database file; up to {router.max_open} stay open at once.")
+    with st.form("add_company", clear_on_submit=True):
+        new_name = st.text_input("New Company Name")
+        if st.form_submit_button("➕ Add Company"):
+            try:
+                router.add(new_name)
+            except ValueError:
+                st.error("❌ Enter a name that no other company uses.")
+            else:
+                st.success(f"✅ {new_name} added! Pick it in the sidebar to set it up.")
+                st.rerun()
 
-def update_item(iid, name, desc, hsn, price, status):
-    c = conn.cursor()
-    c.execute("UPDATE items SET name=?, description=?, hsn_code=?, price=?, status=? WHERE id=?",
-              (name, desc, hsn, price, status, iid))
-    conn.commit()
+def show_backups():
+    # Scheduled snapshots run in the background (erp.backup); restoring is a command-line job
+    # because every process using the database has to be restarted afterwards
+    error = scheduler_error(db)
+    if error:
+        st.error(f"❌ Last scheduled backup failed: {error}")
+    snapshots = list_snapshots(BACKUP_DIR, db.path)
+    if snapshots:
+        st.dataframe(pd.DataFrame([{'snapshot': snap['name'], 'created': snap['created'],
+                                    'schema': snap['schema_version'], 'files': len(snap['files']),
+                                    'MB': round(sum(entry['compressed'] for entry in snap['files'].values()) / 2**20, 1)}
+                                   for snap in snapshots]), use_container_width=True, hide_index=True)
+    else:
+        st.info("No snapshots yet.")
+    if BACKUP_HOURS > 0:
+        st.caption(f"Every {BACKUP_HOURS:g} hours to {os.path.abspath(BACKUP_DIR)}; the newest {KEEP_LAST} "
+                   f"and one a day for {KEEP_DAILY} days are kept.")
+    else:
+        st.caption("Scheduled backups are off (SALES_ERP_BACKUP_HOURS=0).")
+    if st.button("💾 Back Up Now"):
+        with st.spinner("Copying..."):
+            manifest = create_snapshot(db)
+            rotate(BACKUP_DIR, db.path)
+        st.success(f"✅ Saved {manifest['name']}")
+        st.rerun()
+    if snapshots:
+        st.code(f"python -m erp.backup --db {db.path} restore {snapshots[0]['name']}", language="bash")
 
-def save_document(doc_type, doc_number, doc_date, customer_id, customer_name, customer_contact,
-                  customer_address, customer_phone, customer_gstin, items_data, subtotal, 
-                  cgst, sgst, igst, total, terms, created_by):
-    c = conn.cursor()
-    c.execute("""INSERT INTO documents (doc_type, doc_number, doc_date, customer_id, customer_name, 
-                 customer_contact, customer_address, customer_phone, customer_gstin, items_data, 
-                 subtotal, cgst, sgst, igst, total, terms_conditions, created_by) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-              (doc_type, doc_number, doc_date, customer_id, customer_name, customer_contact,
-               customer_address, customer_phone, customer_gstin, items_data, subtotal, 
-               cgst, sgst, igst, total, terms, created_by))
-    conn.commit()
-    return c.lastrowid
+def include_archived(key):
+    # Lists and pickers show live rows; archived ones (see the Archive tab) on request
+    return svc.archive.is_open and st.checkbox("Include archived", key=key,
+                                               help="Also list documents and payments moved to the archive (slower)")
 
-def update_document_status(doc_id, status):
-    c = conn.cursor()
-    c.execute("UPDATE documents SET status=?, modified_at=CURRENT_TIMESTAMP WHERE id=?", 
-              (status, doc_id))
-    conn.commit()
+def show_paged(key, fetch_page):
+    # Keyset paging: keep the cursor of every page visited so Previous is a pop
+    cursors_key = f"{key}_cursors"
+    if cursors_key not in st.session_state:
+        st.session_state[cursors_key] = [None]
+    cursors = st.session_state[cursors_key]
+    page, next_cursor = fetch_page(cursors[-1])
+    if page.empty:
+        return page
+    st.dataframe(page, use_container_width=True, hide_index=True)
+    col1, col2, col3 = st.columns([1, 1, 4])
+    with col1:
+        if st.button("⬅️ Previous", key=f"{key}_prev", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if st.button("Next ➡️", key=f"{key}_next", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
+    col3.caption(f"Page {len(cursors)}")
+    return page
 
-def delete_document(doc_id):
-    c = conn.cursor()
-    c.execute("UPDATE documents SET status='deleted' WHERE id=?", (doc_id,))
-    conn.commit()
+def show_import_report(report, label):
+    st.success(f"✅ Imported {report['accepted']} {label}!")
+    if report['rejected']:
+        reasons = ", ".join(f"{why}: {count}" for why, count in report['reasons'].items())
+        st.warning(f"⚠️ Rejected {report['rejected']} rows ({reasons})")
+        st.dataframe(report['rejected_rows'], use_container_width=True, hide_index=True)
 
-def save_payment(doc_id, doc_number, trans_type, amount, mode, pay_date, remarks):
-    c = conn.cursor()
-    c.execute("""INSERT INTO payments (doc_id, doc_number, transaction_type, amount, 
-                 payment_mode, payment_date, remarks) VALUES (?, ?, ?, ?, ?, ?, ?)""",
-              (doc_id, doc_number, trans_type, amount, mode, pay_date, remarks))
-    conn.commit()
-
-def generate_doc_html(doc_type, doc_number, doc_date, company_info, customer_info, items, 
-                      subtotal, cgst, sgst, igst, total, terms, general_terms):
-    rows = ""
-    for item in items:
-        rows += f"""<tr>
-            <td>{item['name']}<br><small style="color:#666;">{item['description']}</small></td>
-            <td>{item['hsn']}</td>
-            <td>{item['qty']}</td>
-            <td>₹{item['price']:.2f}</td>
-            <td>₹{item['total']:.2f}</td>
-        </tr>"""
-    
-    gst_rows = ""
-    if cgst > 0:
-        gst_rows = f"""
-        <tr><td colspan="4" align="right"><strong>CGST (9%):</strong></td><td>₹{cgst:.2f}</td></tr>
-        <tr><td colspan="4" align="right"><strong>SGST (9%):</strong></td><td>₹{sgst:.2f}</td></tr>
-        """
-    else:
-        gst_rows = f"""
-        <tr><td colspan="4" align="right"><strong>IGST (18%):</strong></td><td>₹{igst:.2f}</td></tr>
-        """
-    
-    logo_html = f'<img src="{company_info["logo"]}" style="max-height:80px; max-width:150px;">' if company_info.get('logo') else ""
-    
-    html = f"""
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 30px; line-height: 1.4; }}
-            .header {{ display: flex; justify-content: space-between; align-items: center; border-bottom: 3px solid #333; padding-bottom: 15px; }}
-            .company {{ font-size: 26px; font-weight: bold; color: #333; }}
-            .company-details {{ font-size: 13px; color: #555; margin-top: 5px; }}
-            .doc-type {{ font-size: 22px; color: #0066cc; margin: 15px 0; font-weight: bold; }}
-            .info-section {{ margin-top: 20px; display: flex; justify-content: space-between; }}
-            .box {{ width: 48%; border: 1px solid #ddd; padding: 12px; background: #f9f9f9; }}
-            .box strong {{ color: #333; }}
-            table {{ width: 100%; border-collapse: collapse; margin-top: 20px; }}
-            th, td {{ border: 1px solid #ddd; padding: 10px; text-align: left; }}
-            th {{ background: #4CAF50; color: white; font-weight: bold; }}
-            .total-row {{ background: #e8f5e9; font-weight: bold; font-size: 16px; }}
-            .terms {{ margin-top: 25px; padding: 15px; background: #fffbf0; border: 1px solid #f0e68c; }}
-            .terms h4 {{ margin: 0 0 10px 0; color: #333; }}
-            .footer {{ margin-top: 30px; text-align: center; font-size: 12px; color: #777; padding-top: 15px; border-top: 1px solid #ddd; }}
-            .signature {{ margin-top: 40px; text-align: right; }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <div>
-                <div class="company">{company_info['name']}</div>
-                <div class="company-details">
-                    {company_info['address'].replace(chr(10), '<br>')}<br>
-                    GSTIN: {company_info['gstin']} | Phone: {company_info['phone']}
-                </div>
-            </div>
-            <div>{logo_html}</div>
-        </div>
-        
-        <div class="doc-type">{doc_type}</div>
-        
-        <div style="margin: 15px 0;">
-            <strong>{doc_type} No:</strong> {doc_number} | <strong>Date:</strong> {doc_date} | <strong>Created By:</strong> {company_info['created_by']}
-        </div>
-        
-        <div class="info-section">
-            <div class="box">
-                <strong>Bill To:</strong><br>
-                <strong>{customer_info['name']}</strong><br>
-                {f"Attn: {customer_info['contact']}<br>" if customer_info.get('contact') else ""}
-                {customer_info['address'].replace(chr(10), '<br>')}<br>
-                Phone: {customer_info['phone']}<br>
-                GSTIN: {customer_info['gstin']}
-            </div>
-            <div class="box">
-                <strong>Terms & Conditions:</strong><br>
-                {terms.replace(chr(10), '<br>')}
-            </div>
-        </div>
-        
-        <table>
-            <thead>
-                <tr>
-                    <th>Item & Description</th>
-                    <th>HSN/SAC</th>
-                    <th>Qty</th>
-                    <th>Rate</th>
-                    <th>Amount</th>
-                </tr>
-            </thead>
-            <tbody>
-                {rows}
-                <tr><td colspan="4" align="right"><strong>Subtotal:</strong></td><td>₹{subtotal:.2f}</td></tr>
-                {gst_rows}
-                <tr class="total-row"><td colspan="4" align="right"><strong>Grand Total:</strong></td><td>₹{total:.2f}</td></tr>
-            </tbody>
-        </table>
-        
-        <div class="terms">
-            <h4>General Terms & Conditions:</h4>
-            {general_terms.replace(chr(10), '<br>')}
-        </div>
-        
-        <div class="signature">
-            <p style="margin-bottom: 50px;">For <strong>{company_info['name']}</strong></p>
-            <p style="border-top: 1px solid #000; display: inline-block; padding-top: 5px; min-width: 200px;">Authorized Signatory</p>
-        </div>
-        
-        <div class="footer">
-            <p>This is a computer-generated document.</p>
-            <p><strong>Powered by Sales Pipeline ERP System</strong></p>
-        </div>
-    </body>
-    </html>
-    """
-    return html
-
-def html_to_pdf_download(html_content, filename):
-    try:
-        from weasyprint import HTML
-        pdf = HTML(string=html_content).write_pdf()
-        return pdf
-    except:
-        st.error("PDF generation requires WeasyPrint. Install: pip install weasyprint")
-        return None
+def export_panel(table):
+    # The export is streamed to a file first; the download is served from that file
+    with db.read() as conn:
+        all_columns = [col for col, _ in table_columns(conn, table)]
+    fmt = st.radio("Format", ["CSV", "Parquet"], horizontal=True, key=f"{table}_export_fmt").lower()
+    columns = st.multiselect("Columns", all_columns, [col for col in all_columns if col != 'items_data'],
+                             key=f"{table}_export_cols")
+    date_from = date_to = None
+    if st.checkbox("Filter by date", key=f"{table}_export_by_date"):
+        date_range = st.date_input("Date range", (date.today().replace(day=1), date.today()), key=f"{table}_export_range")
+        date_from, date_to = (tuple(date_range) + (None, None))[:2]
+    if st.button("⚙️ Prepare Export", key=f"{table}_export_run", disabled=not columns):
+        st.session_state[f"{table}_export"] = export_table(db, table, fmt, columns, date_from, date_to)
+    path = st.session_state.get(f"{table}_export")
+    if path and os.path.exists(path):
+        ext = path.rsplit('.', 1)[-1]
+        with open(path, 'rb') as f:
+            st.download_button(f"📥 Download {ext.upper()}", f, f"{table}.{ext}", FORMATS[ext], key=f"{table}_export_download")
 
 # Page Configuration
 st.set_page_config(page_title="Sales Pipeline ERP", layout="wide", initial_sidebar_state="expanded")
 
 # Sidebar Navigation
 st.sidebar.title("📊 Sales ERP System")
+# Every company has its own database; the choice is per session
+companies = router.companies()
+company_name = st.sidebar.selectbox("🏢 Company", list(companies.values()), key="company")
+company = list(companies)[list(companies.values()).index(company_name)]
+if st.session_state.get('active_company') != company:
+    # Selections and page cursors refer to the other company's rows
+    for key in list(st.session_state):
+        if key != 'company':
+            del st.session_state[key]
+    st.session_state.active_company = company
+svc = router.services(company)
+db = svc.db
 menu = st.sidebar.radio("Navigation", [
     "🏠 Dashboard",
     "📝 Create Document",
@@ -327,96 +257,119 @@ menu = st.sidebar.radio("Navigation", [
 ])
 
 # Settings
-if menu == "⚙️ Settings":
+def settings_page():
     st.title("⚙️ Company Settings")
     
-    company_info = load_company_info()
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        name = st.text_input("Company Name*", company_info['name'])
-        address = st.text_area("Address*", company_info['address'])
-        phone = st.text_input("Phone*", company_info['phone'])
-        gstin = st.text_input("GSTIN*", company_info['gstin'])
-    
-    with col2:
-        created_by = st.text_input("Default Created By", company_info['created_by'])
-        invoice_prefix = st.text_input("Invoice Prefix", company_info['invoice_prefix'])
-        quotation_prefix = st.text_input("Quotation Prefix", company_info['quotation_prefix'])
-        po_prefix = st.text_input("Purchase Order Prefix", company_info['po_prefix'])
-    
-    st.subheader("Company Logo")
-    logo_file = st.file_uploader("Upload Logo (PNG/JPG)", type=['png', 'jpg', 'jpeg'])
-    if logo_file:
-        logo_bytes = logo_file.read()
-        logo_b64 = base64.b64encode(logo_bytes).decode()
-        logo_url = f"data:image/png;base64,{logo_b64}"
-        st.image(logo_url, width=150)
-    else:
-        logo_url = company_info['logo']
-        if logo_url:
-            st.image(logo_url, width=150)
-    
-    st.subheader("General Terms & Conditions")
-    terms = st.text_area("Terms (shown at bottom of all documents)", company_info['terms'], height=100)
-    
-    if st.button("💾 Save Settings", type="primary"):
-        set_setting(conn, 'company_name', name)
-        set_setting(conn, 'company_address', address)
-        set_setting(conn, 'company_phone', phone)
-        set_setting(conn, 'company_gstin', gstin)
-        set_setting(conn, 'created_by', created_by)
-        set_setting(conn, 'invoice_prefix', invoice_prefix)
-        set_setting(conn, 'quotation_prefix', quotation_prefix)
-        set_setting(conn, 'po_prefix', po_prefix)
-        set_setting(conn, 'general_terms', terms)
+    # Diagnostics stay out of the way unless the page is opened with ?diagnostics=1
+    diagnostics = st.query_params.get("diagnostics") == "1"
+    tabs = st.tabs(["🏢 Company", "🏬 Companies", "💾 Backups"] + (["🩺 Diagnostics"] if diagnostics else []))
+    company_tab = tabs[0]
+    with tabs[1]:
+        show_companies()
+    with tabs[2]:
+        show_backups()
+    if diagnostics:
+        with tabs[3]:
+            show_diagnostics()
+    
+    with company_tab:
+        company_info = svc.company_info()
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            name = st.text_input("Company Name*", company_info['name'])
+            address = st.text_area("Address*", company_info['address'])
+            phone = st.text_input("Phone*", company_info['phone'])
+            gstin = st.text_input("GSTIN*", company_info['gstin'])
+        
+        with col2:
+            created_by = st.text_input("Default Created By", company_info['created_by'])
+            invoice_prefix = st.text_input("Invoice Prefix", company_info['invoice_prefix'])
+            quotation_prefix = st.text_input("Quotation Prefix", company_info['quotation_prefix'])
+            po_prefix = st.text_input("Purchase Order Prefix", company_info['po_prefix'])
+        
+        st.subheader("Company Logo")
+        logo_file = st.file_uploader("Upload Logo (PNG/JPG)", type=['png', 'jpg', 'jpeg'])
+        logo_key = company_info['logo_key']
         if logo_file:
-            set_setting(conn, 'company_logo', logo_url)
-        st.success("✅ Settings saved successfully!")
-        st.rerun()
+            try:
+                logo_key = store_logo(logo_file.getvalue())
+            except OSError:
+                st.error("❌ That file could not be read as an image.")
+                logo_file = None
+                logo_key = company_info['logo_key']
+        if logo_key and os.path.exists(asset_path(logo_key, 'preview')):
+            st.image(asset_path(logo_key, 'preview'))
+        elif logo_key:
+            st.warning("⚠️ The saved logo's file is missing; documents print without it until you upload it again.")
+        
+        st.subheader("GST Rates")
+        default_rate = st.number_input("Default GST Rate (%)", min_value=0.0, max_value=100.0, step=0.25,
+                                       value=float(svc.default_tax_rate()))
+        st.caption("Rates by HSN/SAC prefix; the longest matching prefix applies, otherwise the default.")
+        rates = st.data_editor(
+            pd.DataFrame(svc.rates.rows(), columns=['hsn_prefix', 'rate', 'description']),
+            num_rows="dynamic", use_container_width=True, hide_index=True, key="tax_rates",
+            column_config={'hsn_prefix': st.column_config.TextColumn("HSN/SAC Prefix", required=True),
+                           'rate': st.column_config.NumberColumn("GST %", min_value=0.0, max_value=100.0, required=True),
+                           'description': st.column_config.TextColumn("Description")}
+        )
+        
+        st.subheader("General Terms & Conditions")
+        terms = st.text_area("Terms (shown at bottom of all documents)", company_info['terms'], height=100)
+        
+        if st.button("💾 Save Settings", type="primary"):
+            values = {
+                'company_name': name,
+                'company_address': address,
+                'company_phone': phone,
+                'company_gstin': gstin,
+                'created_by': created_by,
+                'invoice_prefix': invoice_prefix,
+                'quotation_prefix': quotation_prefix,
+                'po_prefix': po_prefix,
+                'general_terms': terms,
+                'default_gst_rate': f"{default_rate:g}",
+            }
+            if logo_file:
+                values['company_logo'] = logo_key
+            svc.settings.set_many(values)
+            router.rename(company, name)
+            svc.rates.replace(rates.dropna(subset=['hsn_prefix', 'rate']).itertuples(index=False))
+            st.success("✅ Settings saved successfully!")
+            st.rerun()
 
 # Dashboard
-elif menu == "🏠 Dashboard":
+def dashboard_page():
     st.title("🏠 Dashboard")
     
-    company_info = load_company_info()
+    company_info = svc.company_info()
     if company_info['name'] == 'Your Company Name':
         st.warning("⚠️ Please configure company settings first!")
     
     col1, col2, col3, col4 = st.columns(4)
     
-    with col1:
-        customer_count = pd.read_sql("SELECT COUNT(*) as count FROM customers WHERE status='active'", conn).iloc[0]['count']
-        st.metric("Active Customers", customer_count)
-    
-    with col2:
-        item_count = pd.read_sql("SELECT COUNT(*) as count FROM items WHERE status='active'", conn).iloc[0]['count']
-        st.metric("Active Items", item_count)
-    
-    with col3:
-        invoice_count = pd.read_sql("SELECT COUNT(*) as count FROM documents WHERE doc_type='Invoice' AND status='active'", conn).iloc[0]['count']
-        st.metric("Invoices", invoice_count)
+    summary = svc.dashboard.summary()
     
-    with col4:
-        total_revenue = pd.read_sql("SELECT COALESCE(SUM(total), 0) as total FROM documents WHERE doc_type='Invoice' AND status='active'", conn).iloc[0]['total']
-        st.metric("Total Revenue", f"₹{total_revenue:,.2f}")
+    col1.metric("Active Customers", summary['active_customers'])
+    col2.metric("Active Items", summary['active_items'])
+    col3.metric("Invoices", summary['active_invoices'])
+    col4.metric("Total Revenue", f"₹{summary['invoice_revenue']:,.2f}")
     
     st.subheader("Recent Documents")
-    recent_docs = get_documents()
+    recent_docs, _ = svc.documents.page(limit=10)
     if not recent_docs.empty:
-        st.dataframe(recent_docs[['doc_type', 'doc_number', 'doc_date', 'customer_name', 'total', 'status']].head(10), use_container_width=True)
+        st.dataframe(recent_docs[['doc_type', 'doc_number', 'doc_date', 'customer_name', 'total', 'status']], use_container_width=True)
 
 # Customer Register
-elif menu == "👥 Customer Register":
+def customer_register_page():
     st.title("👥 Customer Register")
     
     tab1, tab2, tab3 = st.tabs(["📋 View Customers", "➕ Add/Edit Customer", "📥 Import/Export"])
     
     with tab1:
-        customers = get_customers()
-        if not customers.empty:
-            st.dataframe(customers, use_container_width=True)
-        else:
+        customers = show_paged("customers", lambda cursor: svc.customers.page(cursor=cursor))
+        if customers.empty:
             st.info("No customers found.")
     
     with tab2:
@@ -433,16 +386,15 @@ elif menu == "👥 Customer Register":
                 
                 if st.form_submit_button("💾 Save Customer"):
                     if name:
-                        save_customer(name, contact, address, phone, gstin, email)
+                        svc.customers.create(name, contact, address, phone, gstin, email)
                         st.success(f"✅ Customer '{name}' added!")
                         st.rerun()
                     else:
                         st.error("Customer name is required!")
         else:
-            customers = get_customers(status='active')
-            if not customers.empty:
-                selected = st.selectbox("Select Customer", customers['name'].tolist())
-                customer = customers[customers['name'] == selected].iloc[0]
+            customer_id = search_select("Select Customer", svc.customers, "edit_customer_id")
+            if customer_id is not None:
+                customer = svc.customers.get(customer_id)
                 
                 with st.form("edit_customer"):
                     name = st.text_input("Customer Name*", customer['name'])
@@ -456,12 +408,12 @@ elif menu == "👥 Customer Register":
                     col1, col2 = st.columns(2)
                     with col1:
                         if st.form_submit_button("💾 Update"):
-                            update_customer(customer['id'], name, contact, address, phone, gstin, email, status)
+                            svc.customers.update(customer['id'], name, contact, address, phone, gstin, email, status)
                             st.success("✅ Customer updated!")
                             st.rerun()
                     with col2:
                         if st.form_submit_button("🗑️ Delete"):
-                            update_customer(customer['id'], name, contact, address, phone, gstin, email, 'deleted')
+                            svc.customers.update(customer['id'], name, contact, address, phone, gstin, email, 'deleted')
                             st.success("✅ Customer deleted!")
                             st.rerun()
     
@@ -469,43 +421,25 @@ elif menu == "👥 Customer Register":
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("📥 Export")
-            customers = pd.read_sql("SELECT * FROM customers WHERE status!='deleted'", conn)
-            if not customers.empty:
-                csv = customers.to_csv(index=False)
-                st.download_button("📥 Download CSV", csv, "customers.csv", "text/csv")
+            export_panel("customers")
         
         with col2:
             st.subheader("📤 Import")
             uploaded = st.file_uploader("Upload CSV", type=['csv'])
-            if uploaded:
+            if uploaded and st.button("📤 Import Customers"):
                 try:
-                    df = pd.read_csv(uploaded)
-                    c = conn.cursor()
-                    for _, row in df.iterrows():
-                        try:
-                            c.execute("""INSERT INTO customers (name, contact_person, address, phone, gstin, email, status) 
-                                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                                    (row.get('name'), row.get('contact_person'), row.get('address'), 
-                                     row.get('phone'), row.get('gstin'), row.get('email'), 
-                                     row.get('status', 'active')))
-                        except:
-                            continue
-                    conn.commit()
-                    st.success(f"✅ Imported {len(df)} customers!")
-                    st.dataframe(df)
+                    show_import_report(import_csv(db, uploaded, 'customers'), 'customers')
                 except Exception as e:
                     st.error(f"Error: {e}")
 
 # Item Register
-elif menu == "📦 Item Register":
+def item_register_page():
     st.title("📦 Item Register")
     
     tab1, tab2, tab3 = st.tabs(["📋 View Items", "➕ Add/Edit Item", "📥 Import/Export"])
     
     with tab1:
-        items = get_items()
-        if not items.empty:
-            st.dataframe(items, use_container_width=True)
+        show_paged("items", lambda cursor: svc.items.page(cursor=cursor))
     
     with tab2:
         action = st.radio("Action", ["Add New", "Edit Existing"])
@@ -519,14 +453,13 @@ elif menu == "📦 Item Register":
                 
                 if st.form_submit_button("💾 Save Item"):
                     if name:
-                        save_item(name, desc, hsn, price)
+                        svc.items.create(name, desc, hsn, price)
                         st.success(f"✅ Item '{name}' added!")
                         st.rerun()
         else:
-            items = get_items(status='active')
-            if not items.empty:
-                selected = st.selectbox("Select Item", items['name'].tolist())
-                item = items[items['name'] == selected].iloc[0]
+            item_id = search_select("Select Item", svc.items, "edit_item_id")
+            if item_id is not None:
+                item = svc.items.get(item_id)
                 
                 with st.form("edit_item"):
                     name = st.text_input("Item Name*", item['name'])
@@ -538,12 +471,12 @@ elif menu == "📦 Item Register":
                     col1, col2 = st.columns(2)
                     with col1:
                         if st.form_submit_button("💾 Update"):
-                            update_item(item['id'], name, desc, hsn, price, status)
+                            svc.items.update(item['id'], name, desc, hsn, price, status)
                             st.success("✅ Item updated!")
                             st.rerun()
                     with col2:
                         if st.form_submit_button("🗑️ Delete"):
-                            update_item(item['id'], name, desc, hsn, price, 'deleted')
+                            svc.items.update(item['id'], name, desc, hsn, price, 'deleted')
                             st.success("✅ Item deleted!")
                             st.rerun()
     
@@ -551,37 +484,22 @@ elif menu == "📦 Item Register":
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("📥 Export")
-            items = pd.read_sql("SELECT * FROM items WHERE status!='deleted'", conn)
-            if not items.empty:
-                csv = items.to_csv(index=False)
-                st.download_button("📥 Download CSV", csv, "items.csv", "text/csv")
+            export_panel("items")
         
         with col2:
             st.subheader("📤 Import")
             uploaded = st.file_uploader("Upload CSV", type=['csv'])
-            if uploaded:
+            if uploaded and st.button("📤 Import Items"):
                 try:
-                    df = pd.read_csv(uploaded)
-                    c = conn.cursor()
-                    for _, row in df.iterrows():
-                        try:
-                            c.execute("""INSERT INTO items (name, description, hsn_code, price, status) 
-                                       VALUES (?, ?, ?, ?, ?)""",
-                                    (row.get('name'), row.get('description'), row.get('hsn_code'), 
-                                     row.get('price'), row.get('status', 'active')))
-                        except:
-                            continue
-                    conn.commit()
-                    st.success(f"✅ Imported {len(df)} items!")
-                    st.dataframe(df)
+                    show_import_report(import_csv(db, uploaded, 'items'), 'items')
                 except Exception as e:
                     st.error(f"Error: {e}")
 
 # Create Document
-elif menu == "📝 Create Document":
+def create_document_page():
     st.title("📝 Create Document")
     
-    company_info = load_company_info()
+    company_info = svc.company_info()
     if company_info['name'] == 'Your Company Name':
         st.error("❌ Please configure company settings first!")
         st.stop()
@@ -589,13 +507,11 @@ elif menu == "📝 Create Document":
     doc_type = st.selectbox("Document Type", ["Invoice", "Quotation", "Purchase Order"])
     doc_date = st.date_input("Document Date", date.today())
     
-    customers = get_customers()
-    if customers.empty:
-        st.error("❌ Please add customers first!")
+    customer_id = search_select("Select Customer", svc.customers, "doc_customer_id",
+                                empty_message="❌ Please add customers first!")
+    if customer_id is None:
         st.stop()
-    
-    customer_name = st.selectbox("Select Customer", customers['name'].tolist())
-    customer = customers[customers['name'] == customer_name].iloc[0]
+    customer = svc.customers.get(customer_id)
     
     col1, col2 = st.columns(2)
     with col1:
@@ -609,23 +525,20 @@ elif menu == "📝 Create Document":
     
     st.subheader("📦 Add Items")
     
-    items_data = get_items()
-    if items_data.empty:
-        st.error("❌ Please add items first!")
-        st.stop()
-    
     if 'doc_items' not in st.session_state:
         st.session_state.doc_items = []
     
     if 'adding_item' not in st.session_state:
         st.session_state.adding_item = True
     
-    if st.session_state.adding_item:
+    item_id = search_select("Select Item", svc.items, "doc_item_id", empty_message="❌ Please add items first!")
+    
+    if st.session_state.adding_item and item_id is not None:
+        item = svc.items.get(item_id)
         with st.form("add_item_form", clear_on_submit=True):
             col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
             with col1:
-                item_name = st.selectbox("Select Item", items_data['name'].tolist())
-                item = items_data[items_data['name'] == item_name].iloc[0]
+                st.text_input("Item", item['name'], disabled=True)
             with col2:
                 qty = st.number_input("Quantity", min_value=1, value=1)
             with col3:
@@ -637,6 +550,7 @@ elif menu == "📝 Create Document":
             
             item_desc = st.text_area("Description", item['description'] or '', height=60)
             
+            # The grid below is drawn after this, so it already shows the new line; no extra rerun
             if add_btn:
                 st.session_state.doc_items.append({
                     'name': item['name'],
@@ -644,128 +558,121 @@ elif menu == "📝 Create Document":
                     'hsn': item['hsn_code'] or '',
                     'price': price,
                     'qty': qty,
-                    'total': price * qty
+                    'tax_rate': None,
                 })
-                st.rerun()
+                st.session_state.pop('last_document', None)
     
     if st.session_state.doc_items:
         st.subheader("📋 Items in Document")
-        for idx, item in enumerate(st.session_state.doc_items):
-            col1, col2 = st.columns([5, 1])
+        gst_types = ["CGST + SGST (intra-state)", "IGST (inter-state)"]
+        gst_type = st.radio("GST Type", gst_types, index=int(is_interstate(company_info['gstin'], cust_gstin)))
+        interstate = gst_type == gst_types[1]
+        
+        # All lines are edited, added and removed in the browser; nothing reruns until
+        # one of the form's buttons sends the whole grid back
+        priced = svc.price(st.session_state.doc_items, interstate)
+        with st.form("line_items"):
+            edited = st.data_editor(
+                line_editor_frame(priced['items']), num_rows="dynamic", use_container_width=True,
+                hide_index=True, key="line_editor", column_config=LINE_EDITOR_CONFIG
+            )
+            st.caption("Leave GST % blank to use the rate for the HSN/SAC code.")
+            col1, col2 = st.columns(2)
             with col1:
-                st.write(f"**{item['name']}** | HSN: {item['hsn']} | Qty: {item['qty']} × ₹{item['price']:.2f} = ₹{item['total']:.2f}")
-                st.caption(item['description'])
+                update_btn = st.form_submit_button("🔄 Update Totals", use_container_width=True)
             with col2:
-                if st.button("🗑️", key=f"del_{idx}"):
-                    st.session_state.doc_items.pop(idx)
-                    st.rerun()
-        
-        subtotal = sum(item['total'] for item in st.session_state.doc_items)
-        
-        gst_type = st.radio("GST Type", ["CGST/SGST (9% + 9%)", "IGST (18%)"])
-        
-        if "CGST" in gst_type:
-            cgst = sgst = subtotal * 0.09
-            igst = 0
-            total = subtotal + cgst + sgst
-        else:
-            igst = subtotal * 0.18
-            cgst = sgst = 0
-            total = subtotal + igst
+                generate_btn = st.form_submit_button("🚀 Generate Document", type="primary", use_container_width=True)
+        if update_btn or generate_btn:
+            st.session_state.doc_items = lines_from_frame(edited)
+            # Redraw the grid with the recomputed amounts (or without it, if emptied)
+            if update_btn or not st.session_state.doc_items:
+                st.rerun()
+            priced = svc.price(st.session_state.doc_items, interstate)
         
         st.write("---")
         col1, col2 = st.columns([3, 1])
         with col2:
-            st.write(f"**Subtotal:** ₹{subtotal:.2f}")
-            if "CGST" in gst_type:
-                st.write(f"**CGST (9%):** ₹{cgst:.2f}")
-                st.write(f"**SGST (9%):** ₹{sgst:.2f}")
-            else:
-                st.write(f"**IGST (18%):** ₹{igst:.2f}")
-            st.write(f"### **Total:** ₹{total:.2f}")
+            st.write(f"**Subtotal:** ₹{priced['subtotal']:.2f}")
+            for tax in priced['taxes']:
+                if tax['igst']:
+                    st.write(f"**IGST ({percent(tax['rate'])}):** ₹{tax['igst']:.2f}")
+                elif tax['cgst']:
+                    st.write(f"**CGST ({percent(tax['rate'] / 2)}):** ₹{tax['cgst']:.2f}")
+                    st.write(f"**SGST ({percent(tax['rate'] / 2)}):** ₹{tax['sgst']:.2f}")
+            st.write(f"### **Total:** ₹{priced['total']:.2f}")
         
-        if st.button("🚀 Generate Document", type="primary", use_container_width=True):
-            prefix_key = f"{doc_type.lower().replace(' ', '_')}_prefix"
-            prefix = company_info.get(prefix_key, "DOC")
-            doc_number = f"{prefix}-{uuid.uuid4().hex[:8].upper()}"
-            
-            items_json = str(st.session_state.doc_items)
-            
-            doc_id = save_document(
-                doc_type, doc_number, doc_date, customer['id'], customer['name'], cust_contact,
-                cust_address, cust_phone, cust_gstin, items_json, subtotal, 
-                cgst, sgst, igst, total, terms_conditions, company_info['created_by']
+        if generate_btn:
+            customer_info = {'id': customer['id'], 'name': customer['name'], 'contact': cust_contact,
+                             'address': cust_address, 'phone': cust_phone, 'gstin': cust_gstin}
+            doc_id, doc_number = svc.issue_document(
+                doc_type, doc_date, customer_info, priced, terms_conditions, company_info
             )
             
-            if doc_type == "Invoice":
-                save_payment(doc_id, doc_number, 'debit', total, 'Invoice', doc_date, 'Invoice generated')
-            
             html = generate_doc_html(
-                doc_type, doc_number, doc_date, company_info,
-                {'name': customer['name'], 'contact': cust_contact, 'address': cust_address, 
-                 'phone': cust_phone, 'gstin': cust_gstin},
-                st.session_state.doc_items, subtotal, cgst, sgst, igst, total, 
-                terms_conditions, company_info['terms']
+                doc_type, doc_number, doc_date, company_info, customer_info,
+                priced['items'], priced['taxes'], priced['subtotal'], priced['cgst'], priced['sgst'],
+                priced['igst'], priced['total'], terms_conditions, company_info['terms']
             )
             
-            st.success(f"✅ {doc_type} {doc_number} created successfully!")
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                st.download_button("📥 Download HTML", html, f"{doc_number}.html", "text/html", use_container_width=True)
-            with col2:
-                try:
-                    from weasyprint import HTML as WPHTML
-                    pdf = WPHTML(string=html).write_pdf()
-                    st.download_button("📥 Download PDF", pdf, f"{doc_number}.pdf", "application/pdf", use_container_width=True)
-                except:
-                    st.info("PDF generation requires: pip install weasyprint")
-            
-            with st.expander("👁️ Preview Document"):
-                st.components.v1.html(html, height=800, scrolling=True)
-            
+            st.session_state.last_document = {'doc_type': doc_type, 'doc_number': doc_number, 'html': html}
             st.session_state.doc_items = []
             st.session_state.adding_item = True
     else:
         st.info("Add items to create document.")
+    
+    if 'last_document' in st.session_state:
+        last = st.session_state.last_document
+        st.success(f"✅ {last['doc_type']} {last['doc_number']} created successfully!")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("📥 Download HTML", inline_assets(last['html']), file_name(last['doc_number'], "html"), "text/html", use_container_width=True)
+        with col2:
+            html_to_pdf_download(last['html'], last['doc_number'])
+        
+        with st.expander("👁️ Preview Document"):
+            # Streamlit's static route serves .css as text/plain (nosniff), so the preview
+            # gets the stylesheet inlined like a download does
+            st.components.v1.html(inline_assets(last['html']), height=800, scrolling=True)
 
 # Payment Entry
-elif menu == "💰 Payment Entry":
+def payment_entry_page():
     st.title("💰 Payment Entry")
     
-    invoices = get_documents("Invoice")
-    if invoices.empty:
-        st.info("No invoices found for payment entry.")
-        st.stop()
-    
     tab1, tab2 = st.tabs(["➕ Add Payment", "📋 Payment History"])
     
     with tab1:
-        with st.form("payment_entry"):
-            doc_number = st.selectbox("Select Invoice", invoices['doc_number'].tolist())
-            invoice = invoices[invoices['doc_number'] == doc_number].iloc[0]
+        invoice_id = search_select("Select Invoice", svc.documents, "pay_invoice_id", doc_type="Invoice",
+                                   empty_message="No invoices found for payment entry.")
+        if invoice_id is not None:
+            invoice = svc.documents.get(invoice_id)
+            doc_number = invoice['doc_number']
             
             st.write(f"**Customer:** {invoice['customer_name']}")
             st.write(f"**Total:** ₹{invoice['total']:.2f}")
+            invoice_due = svc.documents.balance(invoice['id'])
+            customer_due = svc.customers.balance(invoice['customer_id']) if pd.notna(invoice['customer_id']) else None
+            st.write(f"**Invoice Outstanding:** ₹{invoice_due['balance']:,.2f}")
+            if customer_due:
+                st.write(f"**Customer Outstanding:** ₹{customer_due['balance']:,.2f}")
             
-            trans_type = st.selectbox("Transaction Type", ["credit", "debit"])
-            amount = st.number_input("Amount", min_value=0.01, step=0.01)
-            mode = st.selectbox("Payment Mode", ["Cash", "Bank Transfer", "Cheque", "UPI", "Card", "Other"])
-            pay_date = st.date_input("Payment Date", date.today())
-            remarks = st.text_area("Remarks")
-            
-            if st.form_submit_button("💾 Save Payment"):
-                save_payment(invoice['id'], doc_number, trans_type, amount, mode, pay_date, remarks)
-                st.success(f"✅ Payment of ₹{amount:.2f} recorded!")
-                st.rerun()
+            with st.form("payment_entry"):
+                trans_type = st.selectbox("Transaction Type", ["credit", "debit"])
+                amount = st.number_input("Amount", min_value=0.01, step=0.01)
+                mode = st.selectbox("Payment Mode", ["Cash", "Bank Transfer", "Cheque", "UPI", "Card", "Other"])
+                pay_date = st.date_input("Payment Date", date.today())
+                remarks = st.text_area("Remarks")
+                
+                if st.form_submit_button("💾 Save Payment"):
+                    svc.payments.create(invoice['id'], doc_number, trans_type, amount, mode, pay_date, remarks)
+                    st.success(f"✅ Payment of ₹{amount:.2f} recorded!")
+                    st.rerun()
     
     with tab2:
-        payments = get_payments()
+        archived = include_archived("payment_history_archived")
+        payments = show_paged(f"payment_history_{archived}", lambda cursor: svc.payments.page(cursor, archived=archived))
         if not payments.empty:
-            st.dataframe(payments, use_container_width=True)
-            
-            total_debit = payments[payments['transaction_type']=='debit']['amount'].sum()
-            total_credit = payments[payments['transaction_type']=='credit']['amount'].sum()
+            total_debit, total_credit = svc.dashboard.payment_totals()
             balance = total_debit - total_credit
             
             col1, col2, col3 = st.columns(3)
@@ -774,23 +681,25 @@ elif menu == "💰 Payment Entry":
             col3.metric("Outstanding", f"₹{balance:,.2f}")
 
 # Document Reports
-elif menu == "📋 Document Reports":
+def document_reports_page():
     st.title("📋 Document Reports")
     
-    tab1, tab2, tab3 = st.tabs(["📊 All Documents", "🔍 Manage Documents", "📥 Import/Export"])
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["📊 All Documents", "🔍 Manage Documents", "📥 Import/Export",
+                                                  "📦 Item Summary", "🗂️ Batch Export", "🗄️ Archive"])
     
     with tab1:
         doc_filter = st.selectbox("Filter by Type", ["All", "Invoice", "Quotation", "Purchase Order"])
-        docs = get_documents() if doc_filter == "All" else get_documents(doc_filter)
-        
-        if not docs.empty:
-            st.dataframe(docs[['id', 'doc_type', 'doc_number', 'doc_date', 'customer_name', 'total', 'status', 'created_by']], use_container_width=True)
+        doc_type = None if doc_filter == "All" else doc_filter
+        archived = include_archived("docs_archived")
+        show_paged(f"docs_{doc_filter}_{archived}", lambda cursor: svc.documents.page(doc_type, cursor, archived=archived))
     
     with tab2:
-        docs = get_documents()
-        if not docs.empty:
-            doc_number = st.selectbox("Select Document", docs['doc_number'].tolist())
-            doc = docs[docs['doc_number'] == doc_number].iloc[0]
+        archived = include_archived("manage_doc_archived")
+        doc_id = search_select("Select Document", svc.documents, "manage_doc_id", empty_message="No documents found.",
+                               archived=archived)
+        if doc_id is not None:
+            doc = svc.documents.get(doc_id)
+            read_only = archived and svc.documents.is_archived(doc_id)
             
             col1, col2 = st.columns(2)
             with col1:
@@ -801,66 +710,126 @@ elif menu == "📋 Document Reports":
                 st.write(f"**Total:** ₹{doc['total']:.2f}")
                 st.write(f"**Status:** {doc['status']}")
                 st.write(f"**Created By:** {doc['created_by']}")
+            if read_only:
+                st.caption("🗄️ Archived: it can be viewed and reprinted, not changed.")
             
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
                 if st.button("🖨️ Reprint", use_container_width=True):
-                    company_info = load_company_info()
-                    items = eval(doc['items_data'])
-                    html = generate_doc_html(
-                        doc['doc_type'], doc['doc_number'], doc['doc_date'], company_info,
-                        {'name': doc['customer_name'], 'contact': doc['customer_contact'],
-                         'address': doc['customer_address'], 'phone': doc['customer_phone'], 
-                         'gstin': doc['customer_gstin']},
-                        items, doc['subtotal'], doc['cgst'], doc['sgst'], doc['igst'], 
-                        doc['total'], doc['terms_conditions'], company_info['terms']
-                    )
-                    st.download_button("📥 Download HTML", html, f"{doc['doc_number']}.html", "text/html")
+                    st.session_state.reprint_doc = doc['doc_number']
             
             with col2:
-                if st.button("❌ Cancel", use_container_width=True):
-                    update_document_status(doc['id'], 'cancelled')
+                if st.button("❌ Cancel", use_container_width=True, disabled=read_only):
+                    svc.documents.set_status(doc['id'], 'cancelled')
                     st.success("✅ Document cancelled!")
                     st.rerun()
             
             with col3:
-                if st.button("🔄 Revise", use_container_width=True):
+                if st.button("🔄 Revise", use_container_width=True, disabled=read_only):
                     st.info("Create a new document based on this one")
             
             with col4:
-                if st.button("🗑️ Delete", use_container_width=True):
-                    delete_document(doc['id'])
+                if st.button("🗑️ Delete", use_container_width=True, disabled=read_only):
+                    svc.documents.delete(doc['id'])
                     st.success("✅ Document deleted!")
                     st.rerun()
+            
+            # Kept in session state so the PDF job can be polled across reruns
+            if st.session_state.get('reprint_doc') == doc['doc_number']:
+                html = build_document_html(doc, svc.documents.lines(doc['id']), svc.company_info())
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.download_button("📥 Download HTML", inline_assets(html), file_name(doc['doc_number'], "html"), "text/html", use_container_width=True)
+                with col2:
+                    html_to_pdf_download(html, doc['doc_number'])
     
     with tab3:
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("📥 Export")
-            docs = get_documents()
-            if not docs.empty:
-                csv = docs.to_csv(index=False)
-                st.download_button("📥 Download CSV", csv, "documents.csv", "text/csv")
+            export_panel("documents")
         
         with col2:
             st.subheader("📤 Import")
             st.info("Document import requires careful data mapping. Use export format as template.")
+    
+    with tab4:
+        group_by = st.radio("Group by", ["Item", "HSN/SAC"], horizontal=True)
+        summary = svc.documents.line_summary('name' if group_by == "Item" else 'hsn')
+        if not summary.empty:
+            st.dataframe(summary, use_container_width=True, hide_index=True)
+        else:
+            st.info("No line items found.")
+        
+        st.subheader("🧾 GST by Rate (Invoices)")
+        taxes = svc.documents.tax_summary()
+        if not taxes.empty:
+            st.dataframe(taxes, use_container_width=True, hide_index=True)
+        else:
+            st.info("No taxed invoices yet.")
+    
+    with tab5:
+        col1, col2 = st.columns(2)
+        with col1:
+            date_from = st.date_input("From", date.today().replace(day=1), key="batch_from")
+            batch_type = st.selectbox("Document Type", ["All", "Invoice", "Quotation", "Purchase Order"], key="batch_type")
+        with col2:
+            date_to = st.date_input("To", date.today(), key="batch_to")
+            customer_id = search_select("Customer", svc.customers, "batch_customer", all_label="All")
+        include_html = st.checkbox("Include HTML copies", key="batch_html")
+        
+        with db.read() as conn:
+            doc_ids = select_document_ids(conn, date_from, date_to, customer_id,
+                                          None if batch_type == "All" else batch_type)
+        st.write(f"**{len(doc_ids)}** documents selected")
+        
+        if doc_ids and st.button("📦 Build ZIP", type="primary"):
+            company_info = svc.company_info()
+            bar = st.progress(0.0)
+            out_path = new_export_path("documents", "zip")
+            failed = export_documents_zip(
+                db, doc_ids, lambda doc, items: build_document_html(doc, items, company_info), out_path,
+                include_html=include_html, progress=lambda done, total: bar.progress(done / total, f"{done}/{total}")
+            )
+            st.session_state.batch_export = out_path
+            if failed:
+                st.warning(f"⚠️ {len(failed)} documents could not be rendered to PDF and were exported as HTML.")
+        
+        out_path = st.session_state.get('batch_export')
+        if out_path and os.path.exists(out_path):
+            with open(out_path, 'rb') as f:
+                st.download_button("📥 Download ZIP", f, os.path.basename(out_path), "application/zip")
+    
+    with tab6:
+        stats = svc.archive.stats()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Archived Documents", f"{stats['documents']:,}")
+        col2.metric("Archived Payments", f"{stats['payments']:,}")
+        col3.metric("Last Run", stats['last_run'] or "Never")
+        st.caption("Deleted and cancelled documents, and settled documents from closed fiscal years, move to "
+                   f"{svc.archive.path} with their lines and payments. Exports and batch exports still include "
+                   "them; the dashboard and customer balances are unchanged.")
+        keep_years = st.number_input("Fiscal years to keep", min_value=1, max_value=10, value=KEEP_YEARS, step=1,
+                                     help="Counting the current one")
+        st.write(f"Documents dated before **{cutoff_date(keep_years)}** will be archived.")
+        if st.button("🗄️ Archive Now", type="primary"):
+            with st.spinner("Archiving..."):
+                result = svc.archive.run(keep_years)
+            st.success(f"✅ Archived {result['documents']} documents and {result['payments']} payments!")
 
 # Payment Reports
-elif menu == "💳 Payment Reports":
+def payment_reports_page():
     st.title("💳 Payment Reports")
     
-    tab1, tab2 = st.tabs(["📊 Payment Summary", "📥 Export"])
+    tab1, tab2, tab3 = st.tabs(["📊 Payment Summary", "⏳ Aging", "📥 Export"])
     
     with tab1:
-        payments = get_payments()
+        archived = include_archived("payment_report_archived")
+        payments = show_paged(f"payment_report_{archived}", lambda cursor: svc.payments.page(cursor, archived=archived))
         if not payments.empty:
-            st.dataframe(payments, use_container_width=True)
-            
             col1, col2, col3 = st.columns(3)
-            total_debit = payments[payments['transaction_type']=='debit']['amount'].sum()
-            total_credit = payments[payments['transaction_type']=='credit']['amount'].sum()
+            total_debit, total_credit = svc.dashboard.payment_totals()
             balance = total_debit - total_credit
             
             col1.metric("Total Debit", f"₹{total_debit:,.2f}")
@@ -868,7 +837,31 @@ elif menu == "💳 Payment Reports":
             col3.metric("Outstanding", f"₹{balance:,.2f}")
     
     with tab2:
-        payments = get_payments()
-        if not payments.empty:
-            csv = payments.to_csv(index=False)
-            st.download_button("📥 Download CSV", csv, "payments.csv", "text/csv")
\ No newline at end of file
+        as_of = st.date_input("Age to", date.today(), key="aging_as_of")
+        st.caption(f"Current balances of invoices dated up to {as_of:%d %b %Y}, aged to that date. "
+                   "Payments made after it are already deducted.")
+        aging = svc.payments.aging(as_of)
+        if aging.empty:
+            st.info("No outstanding invoices.")
+        else:
+            st.dataframe(aging.drop(columns=['customer_id']), use_container_width=True, hide_index=True)
+            totals = aging.drop(columns=['customer_id', 'customer']).sum()
+            cols = st.columns(len(totals))
+            for col, (label, amount) in zip(cols, totals.items()):
+                col.metric(label.title(), f"₹{amount:,.2f}")
+    
+    with tab3:
+        export_panel("payments")
+
+PAGES = {
+    "🏠 Dashboard": dashboard_page,
+    "📝 Create Document": create_document_page,
+    "👥 Customer Register": customer_register_page,
+    "📦 Item Register": item_register_page,
+    "💰 Payment Entry": payment_entry_page,
+    "📋 Document Reports": document_reports_page,
+    "💳 Payment Reports": payment_reports_page,
+    "⚙️ Settings": settings_page,
+}
+
+PAGES[menu]()
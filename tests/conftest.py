@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from erp.db import Database
+from erp.schema import migrate
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'erp.db'))
+    migrate(db)
+    yield db
+    db.close()
@@ -0,0 +1,133 @@
+from datetime import date, timedelta
+
+import pytest
+
+from erp.schema import REBUILD_LEDGER, REBUILD_SUMMARY
+from erp.services import Services
+
+CUSTOMER = {'name': 'Acme Traders', 'gstin': '27AAAAA0000A1Z5'}
+
+
+@pytest.fixture
+def services(db):
+    services = Services(db)
+    yield services
+    services.close()
+
+
+def issue(services, customer_id, qty, price, doc_type='Invoice', doc_date=None):
+    priced = services.price([{'name': 'Widget', 'hsn': '8481', 'qty': qty, 'price': price}])
+    return services.issue_document(doc_type, doc_date or date.today(), dict(CUSTOMER, id=customer_id), priced, '')[0]
+
+
+def pay(services, doc_id, amount):
+    services.record_payments([{'doc_id': doc_id, 'transaction_type': 'credit', 'amount': amount,
+                               'payment_mode': 'Cash', 'payment_date': date.today()}])
+
+
+def invoice_balance(db, doc_id):
+    with db.read() as conn:
+        return conn.execute("SELECT debit, credit, balance, status FROM invoice_balances WHERE doc_id=?",
+                            (doc_id,)).fetchone()
+
+
+def customer_balance(db, customer_id):
+    with db.read() as conn:
+        return conn.execute("SELECT debit, credit, balance FROM customer_balances WHERE customer_id=?",
+                            (customer_id,)).fetchone()
+
+
+def summary(db):
+    with db.read() as conn:
+        return conn.execute("""SELECT active_invoices, invoice_revenue, total_debit, total_credit
+                               FROM dashboard_summary WHERE id=1""").fetchone()
+
+
+def assert_matches_rebuild(db):
+    # What the triggers kept up to date must equal a recount from the base tables
+    with db.read() as conn:
+        invoices = conn.execute("SELECT * FROM invoice_balances ORDER BY doc_id").fetchall()
+        customers = conn.execute("SELECT * FROM customer_balances ORDER BY customer_id").fetchall()
+        rollup = conn.execute("SELECT * FROM dashboard_summary").fetchall()
+    with db.write() as conn:
+        conn.execute("SAVEPOINT rebuild")
+        for sql in REBUILD_LEDGER + [REBUILD_SUMMARY]:
+            conn.execute(sql)
+        assert conn.execute("SELECT * FROM invoice_balances ORDER BY doc_id").fetchall() == invoices
+        assert conn.execute("SELECT * FROM customer_balances ORDER BY customer_id").fetchall() == customers
+        assert conn.execute("SELECT * FROM dashboard_summary").fetchall() == rollup
+        conn.execute("ROLLBACK TO rebuild")
+        conn.execute("RELEASE rebuild")
+
+
+def test_invoice_posts_its_total_as_a_debit(db, services):
+    customer_id = services.customers.create(CUSTOMER['name'], '', '', '', CUSTOMER['gstin'], '')
+    doc_id = issue(services, customer_id, 2, 500)
+    assert invoice_balance(db, doc_id) == (1180.0, 0.0, 1180.0, 'active')
+    assert customer_balance(db, customer_id) == (1180.0, 0.0, 1180.0)
+    assert summary(db) == (1, 1180.0, 1180.0, 0.0)
+    assert_matches_rebuild(db)
+
+
+def test_quotations_stay_out_of_the_ledger(db, services):
+    customer_id = services.customers.create(CUSTOMER['name'], '', '', '', CUSTOMER['gstin'], '')
+    doc_id = issue(services, customer_id, 2, 500, doc_type='Quotation')
+    assert invoice_balance(db, doc_id) is None
+    assert summary(db) == (0, 0.0, 0.0, 0.0)
+    with pytest.raises(ValueError):
+        pay(services, doc_id, 100)
+
+
+def test_payments_reduce_invoice_and_customer_balance(db, services):
+    customer_id = services.customers.create(CUSTOMER['name'], '', '', '', CUSTOMER['gstin'], '')
+    first, second = issue(services, customer_id, 1, 1000), issue(services, customer_id, 1, 100)
+    pay(services, first, 180)
+    pay(services, first, 1000)
+    pay(services, second, 18)
+    assert invoice_balance(db, first) == (1180.0, 1180.0, 0.0, 'active')
+    assert invoice_balance(db, second) == (118.0, 18.0, 100.0, 'active')
+    assert customer_balance(db, customer_id) == (1298.0, 1198.0, 100.0)
+    assert summary(db) == (2, 1298.0, 1298.0, 1198.0)
+    assert_matches_rebuild(db)
+
+
+def test_cancelling_takes_the_invoice_out_of_the_customer_balance(db, services):
+    customer_id = services.customers.create(CUSTOMER['name'], '', '', '', CUSTOMER['gstin'], '')
+    issue(services, customer_id, 1, 100)
+    cancelled = issue(services, customer_id, 1, 1000)
+    pay(services, cancelled, 180)
+    services.documents.set_status(cancelled, 'cancelled')
+    assert invoice_balance(db, cancelled) == (1180.0, 180.0, 1000.0, 'cancelled')
+    assert customer_balance(db, customer_id) == (118.0, 0.0, 118.0)
+    # Revenue and the invoice count drop; the payments themselves are still on record
+    assert summary(db) == (1, 118.0, 1298.0, 180.0)
+    assert_matches_rebuild(db)
+    with pytest.raises(ValueError):
+        pay(services, cancelled, 100)
+
+    services.documents.set_status(cancelled, 'active')
+    assert customer_balance(db, customer_id) == (1298.0, 180.0, 1118.0)
+    assert_matches_rebuild(db)
+
+
+def test_archiving_leaves_balances_and_dashboard_as_they_were(db, services):
+    customer_id = services.customers.create(CUSTOMER['name'], '', '', '', CUSTOMER['gstin'], '')
+    long_ago = date.today() - timedelta(days=5 * 366)
+    settled, owed = issue(services, customer_id, 1, 1000, doc_date=long_ago), issue(services, customer_id, 1, 100,
+                                                                                    doc_date=long_ago)
+    current = issue(services, customer_id, 1, 10)
+    pay(services, settled, 1180)
+    cancelled = issue(services, customer_id, 1, 50)
+    services.documents.set_status(cancelled, 'cancelled')
+    before = customer_balance(db, customer_id), summary(db)
+
+    result = services.archive.run()
+
+    # The settled old invoice and the cancelled one move; an old invoice still owed stays hot
+    assert (result['documents'], result['payments']) == (2, 3)
+    with db.read() as conn:
+        assert sorted(row[0] for row in conn.execute("SELECT id FROM main.documents")) == [owed, current]
+        assert sorted(row[0] for row in conn.execute("SELECT id FROM archive.documents")) == [settled, cancelled]
+    assert invoice_balance(db, settled) is None
+    assert (customer_balance(db, customer_id), summary(db)) == before
+    assert services.archive.run()['documents'] == 0
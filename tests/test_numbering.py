@@ -0,0 +1,71 @@
+from datetime import date
+
+from erp.numbering import NumberAllocator, financial_year
+
+DAY = date(2026, 5, 1)
+
+
+def counter(db, prefix='INV', fy='26-27'):
+    with db.read() as conn:
+        row = conn.execute("SELECT next_value FROM document_counters WHERE prefix=? AND fiscal_year=?",
+                           (prefix, fy)).fetchone()
+    return row and row[0]
+
+
+def test_financial_year_runs_april_to_march():
+    assert financial_year(date(2026, 3, 31)) == '25-26'
+    assert financial_year(date(2026, 4, 1)) == '26-27'
+    assert financial_year(date(2099, 12, 1)) == '99-00'
+
+
+def test_numbers_come_from_a_reserved_block(db):
+    numbers = NumberAllocator(db, block_size=5)
+    assert [numbers.next_number('INV', DAY) for _ in range(3)] == ['INV/26-27/00001', 'INV/26-27/00002',
+                                                                    'INV/26-27/00003']
+    # One write reserved 1-5; the counter already points past the block
+    assert counter(db) == 6
+    assert [numbers.next_number('INV', DAY) for _ in range(3)] == ['INV/26-27/00004', 'INV/26-27/00005',
+                                                                    'INV/26-27/00006']
+    assert counter(db) == 11
+
+
+def test_series_are_separate(db):
+    numbers = NumberAllocator(db, block_size=5)
+    assert numbers.next_number('INV', DAY) == 'INV/26-27/00001'
+    assert numbers.next_number('QUO', DAY) == 'QUO/26-27/00001'
+    assert numbers.next_number('INV', date(2027, 4, 1)) == 'INV/27-28/00001'
+
+
+def test_release_gives_back_the_unused_rest(db):
+    numbers = NumberAllocator(db, block_size=10)
+    numbers.next_number('INV', DAY)
+    numbers.next_number('INV', DAY)
+    numbers.release()
+    assert counter(db) == 3
+    assert NumberAllocator(db, block_size=10).next_number('INV', DAY) == 'INV/26-27/00003'
+
+
+def test_release_keeps_the_block_once_another_process_reserved_after_it(db):
+    first, second = NumberAllocator(db, block_size=10), NumberAllocator(db, block_size=10)
+    assert first.next_number('INV', DAY) == 'INV/26-27/00001'
+    assert second.next_number('INV', DAY) == 'INV/26-27/00011'
+    first.release()
+    # Rewinding to 2 would reissue 11-20, which the second allocator still holds
+    assert counter(db) == 21
+    second.release()
+    assert counter(db) == 12
+
+
+def test_counter_starts_after_numbers_already_issued(db):
+    with db.write() as conn:
+        conn.execute("INSERT INTO documents (doc_type, doc_number, doc_date) VALUES ('Invoice', 'INV/26-27/00042', ?)",
+                     (str(DAY),))
+    assert NumberAllocator(db, block_size=1).next_number('INV', DAY) == 'INV/26-27/00043'
+
+
+def test_block_size_one_is_gapless(db):
+    numbers = NumberAllocator(db, block_size=1)
+    numbers.next_number('INV', DAY)
+    assert counter(db) == 2
+    numbers.release()
+    assert counter(db) == 2
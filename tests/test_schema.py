@@ -0,0 +1,80 @@
+import sqlite3
+import sys
+
+from erp.db import Database
+from erp.schema import MIGRATIONS, SCHEMA_VERSION, check_query_plans, migrate
+
+# The tables as the app created them before there were migrations (version 0)
+BASELINE = MIGRATIONS[0][1]
+
+
+def blob_id(value):
+    # How numpy ids used to end up in the database
+    return value.to_bytes(8, sys.byteorder, signed=True)
+
+
+def baseline_db(path):
+    conn = sqlite3.connect(path)
+    for sql in BASELINE:
+        conn.execute(sql)
+    conn.execute("""INSERT INTO customers (id, name, gstin) VALUES (1, 'Acme Traders', '27AAAAA0000A1Z5')""")
+    conn.executemany(
+        """INSERT INTO documents (id, doc_type, doc_number, doc_date, customer_id, customer_name, items_data,
+           subtotal, cgst, sgst, igst, total, status) VALUES (?, ?, ?, '2024-05-01', ?, 'Acme Traders', ?, ?, ?, ?, 0, ?, ?)""",
+        [(1, 'Invoice', 'INV-0001', blob_id(1), '[{"name": "Widget", "qty": 2, "price": 500, "total": 1000}]',
+          1000, 90, 90, 1180, 'active'),
+         (2, 'Invoice', 'INV-0002', 1, '[{"name": "Bolt", "qty": 1, "price": 100, "total": 100}]',
+          100, 9, 9, 118, 'cancelled'),
+         (3, 'Quotation', 'QUO-0001', 1, '[]', 50, 4.5, 4.5, 59, 'active')])
+    conn.executemany(
+        "INSERT INTO payments (doc_id, doc_number, transaction_type, amount, payment_date) VALUES (?, ?, ?, ?, '2024-05-02')",
+        [(blob_id(1), 'INV-0001', 'debit', 1180), (1, 'INV-0001', 'credit', 180), (2, 'INV-0002', 'debit', 118)])
+    conn.execute("INSERT INTO settings (key, value) VALUES ('company_name', 'Test Co')")
+    conn.commit()
+    conn.close()
+
+
+def test_migrate_brings_a_baseline_database_up_to_date(tmp_path):
+    path = str(tmp_path / 'old.db')
+    baseline_db(path)
+    db = Database(path)
+    try:
+        assert migrate(db) == SCHEMA_VERSION
+        with db.read() as conn:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+            # Ids stored as BLOBs are integers again
+            assert conn.execute("SELECT COUNT(*) FROM documents WHERE typeof(customer_id)='blob'").fetchone()[0] == 0
+            assert conn.execute("SELECT COUNT(*) FROM payments WHERE typeof(doc_id)='blob'").fetchone()[0] == 0
+            # Ledger and dashboard are built from the existing rows
+            assert conn.execute("SELECT doc_id, debit, credit, balance, status FROM invoice_balances ORDER BY doc_id"
+                                ).fetchall() == [(1, 1180.0, 180.0, 1000.0, 'active'), (2, 118.0, 0.0, 118.0, 'cancelled')]
+            assert conn.execute("SELECT debit, credit, balance FROM customer_balances WHERE customer_id=1"
+                                ).fetchone() == (1180.0, 180.0, 1000.0)
+            assert conn.execute("""SELECT active_customers, active_invoices, invoice_revenue, total_debit, total_credit
+                                   FROM dashboard_summary""").fetchone() == (1, 1, 1180.0, 1298.0, 180.0)
+            # Old documents get their flat rate recorded as a single tax group
+            assert conn.execute("SELECT doc_id, rate, taxable FROM document_taxes ORDER BY doc_id").fetchall() == [
+                (1, 18.0, 1000.0), (2, 18.0, 100.0), (3, 18.0, 50.0)]
+            assert conn.execute("SELECT rowid FROM documents_fts WHERE documents_fts MATCH 'acme'").fetchall() == [
+                (1,), (2,), (3,)]
+            assert check_query_plans(conn) == []
+        # Already current: a second run changes nothing
+        assert migrate(db) == SCHEMA_VERSION
+    finally:
+        db.close()
+
+
+def test_migrated_baseline_matches_a_fresh_schema(tmp_path, db):
+    path = str(tmp_path / 'old.db')
+    baseline_db(path)
+    old = Database(path)
+    try:
+        migrate(old)
+        query = "SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' ORDER BY type, name"
+        with old.read() as conn:
+            migrated = conn.execute(query).fetchall()
+        with db.read() as conn:
+            fresh = conn.execute(query).fetchall()
+        assert migrated == fresh
+    finally:
+        old.close()
@@ -0,0 +1,71 @@
+from decimal import Decimal
+
+from erp.tax import compute, is_interstate, lookup_rate, round_money
+
+
+def test_round_money_is_half_up_to_paise():
+    assert round_money('2.345') == Decimal('2.35')
+    assert round_money('2.344') == Decimal('2.34')
+    # Through str(): the float 1.005 is just below 1.005 in binary, but is priced as written
+    assert round_money(1.005) == Decimal('1.01')
+
+
+def test_line_totals_are_rounded_before_tax():
+    result = compute([{'name': 'Bolt', 'hsn': '7318', 'qty': 3, 'price': 0.335}], {}, default=Decimal('18'))
+    assert result['items'][0]['total'] == Decimal('1.01')
+    assert result['subtotal'] == Decimal('1.01')
+    # 18% of 1.01 is 0.1818, split in half and each half rounded: 0.0909 -> 0.09
+    assert (result['cgst'], result['sgst'], result['igst']) == (Decimal('0.09'), Decimal('0.09'), Decimal('0'))
+    assert result['total'] == Decimal('1.19')
+
+
+def test_tax_is_rounded_per_rate_not_per_line():
+    items = [{'name': f"Part {n}", 'hsn': '8481', 'qty': 1, 'price': '0.05'} for n in range(3)]
+    result = compute(items, {}, default=Decimal('18'))
+    # Per line 0.05 * 9% = 0.0045 would round to 0.00 three times; on 0.15 it is 0.0135 -> 0.01
+    assert result['cgst'] == result['sgst'] == Decimal('0.01')
+
+
+def test_intrastate_splits_cgst_and_sgst():
+    result = compute([{'name': 'Pump', 'hsn': '8413', 'qty': 2, 'price': 1000}], {'84': Decimal('12')})
+    assert result['taxes'] == [{'rate': Decimal('12'), 'taxable': Decimal('2000.00'), 'cgst': Decimal('120.00'),
+                                'sgst': Decimal('120.00'), 'igst': Decimal('0')}]
+    assert result['total'] == Decimal('2240.00')
+
+
+def test_interstate_charges_igst_only():
+    result = compute([{'name': 'Pump', 'hsn': '8413', 'qty': 2, 'price': 1000}], {'84': Decimal('12')},
+                     interstate=True)
+    assert (result['cgst'], result['sgst'], result['igst']) == (Decimal('0'), Decimal('0'), Decimal('240.00'))
+    assert result['total'] == Decimal('2240.00')
+
+
+def test_lines_are_grouped_by_rate():
+    rates = {'8413': Decimal('12'), '30': Decimal('5')}
+    items = [
+        {'name': 'Pump', 'hsn': '8413 91', 'qty': 1, 'price': 100},
+        {'name': 'Tablets', 'hsn': '3004', 'qty': 1, 'price': 100},
+        {'name': 'Service', 'hsn': '9987', 'qty': 1, 'price': 100},
+        {'name': 'Spare', 'hsn': '8413', 'qty': 1, 'price': 100, 'tax_rate': 28},
+    ]
+    result = compute(items, rates, default=Decimal('18'))
+    assert [item['tax_rate'] for item in result['items']] == [Decimal('12'), Decimal('5'), Decimal('18'), Decimal('28')]
+    assert [(tax['rate'], tax['cgst']) for tax in result['taxes']] == [
+        (Decimal('5'), Decimal('2.50')), (Decimal('12'), Decimal('6.00')),
+        (Decimal('18'), Decimal('9.00')), (Decimal('28'), Decimal('14.00'))]
+    assert result['total'] == Decimal('400') + 2 * Decimal('31.50')
+
+
+def test_longest_hsn_prefix_wins():
+    rates = {'84': Decimal('18'), '8413': Decimal('12')}
+    assert lookup_rate(rates, '8413.91') == Decimal('12')
+    assert lookup_rate(rates, '8471') == Decimal('18')
+    assert lookup_rate(rates, '', default=Decimal('5')) == Decimal('5')
+
+
+def test_interstate_needs_two_different_state_codes():
+    assert is_interstate('27AAAAA0000A1Z5', '29BBBBB0000B1Z5')
+    assert not is_interstate('27AAAAA0000A1Z5', '27BBBBB0000B1Z5')
+    # Unregistered customers and the placeholder GSTIN count as intrastate
+    assert not is_interstate('27AAAAA0000A1Z5', '')
+    assert not is_interstate('00XXXXX0000X0XX', '29BBBBB0000B1Z5')